@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Supplier, Order, OrderItem, CustomerInfo, Product
+from .models import Category, Supplier, Order, OrderItem, CustomerInfo, Product, Job, JobSchedule
 
 # Register your models here.
 
@@ -8,4 +8,6 @@ admin.site.register(Supplier)
 admin.site.register(Product)
 admin.site.register(CustomerInfo)
 admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+admin.site.register(Job)
+admin.site.register(JobSchedule)
@@ -0,0 +1,206 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction, close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+class AuditStats:
+    """Counters for the audit sink, per process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.written = 0
+        self.flushes = 0
+        self.overflowed = 0  # written by the request because the queue was full
+        self.dropped = 0  # failed to write
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def flushed(self, count, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.written += count
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+
+    def add(self, counter, count):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "written": self.written,
+                "flushes": self.flushes,
+                "overflowed": self.overflowed,
+                "dropped": self.dropped,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            }
+
+
+def write_records(records, stats):
+    """bulk_create the records, one statement per model."""
+    by_model = defaultdict(list)
+    for record in records:
+        by_model[type(record)].append(record)
+
+    started = time.perf_counter()
+    written = 0
+    for model, rows in by_model.items():
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(rows)
+            written += len(rows)
+        except Exception:
+            stats.add('dropped', len(rows))
+            logger.exception("Could not write %s %s audit records", len(rows), model.__name__)
+    stats.flushed(written, started)
+
+
+class AuditWriter(threading.Thread):
+    """
+    Background thread that writes audit records in batches of `batch_size`,
+    or whatever has arrived after `interval` seconds. stop() drains the
+    queue before the thread exits.
+    """
+
+    def __init__(self, stats, max_size=10000, batch_size=500, interval=1.0):
+        super().__init__(name='audit-writer', daemon=True)
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def put(self, records):
+        """Queue the records, or return False when the queue is full."""
+        for index, record in enumerate(records):
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.stats.add('overflowed', len(records) - index)
+                write_records(records[index:], self.stats)
+                return False
+        return True
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            if batch:
+                close_old_connections()
+                write_records(batch, self.stats)
+        connection.close()
+
+    def stop(self, timeout=10):
+        self.queue.put(STOP)
+        self.join(timeout)
+
+
+class AuditBatch:
+    def __init__(self, sink):
+        self.sink = sink
+        self.records = []
+
+    def is_scheduled(self):
+        return any(func == self.flush for _, func, _ in connection.run_on_commit)
+
+    def flush(self):
+        # The transaction is over, so every batch of this thread is either being flushed or was rolled back
+        self.sink.local.batches = {}
+        self.sink.write(self.records)
+
+
+class AuditSink:
+    """
+    Collects OrderLog, Report, OrderPaymentLog and ProductLog rows and writes
+    them with bulk_create once the surrounding transaction commits.
+
+    Records added under the same savepoint share one on_commit callback, so a
+    rolled back savepoint drops its records together with the callback. With
+    AUDIT_ASYNC the committed records go to a background writer instead.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.stats = AuditStats()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+
+    def add(self, *records):
+        if not connection.in_atomic_block:
+            self.write(list(records))
+            return
+
+        batches = getattr(self.local, 'batches', None)
+        if batches is None:
+            batches = self.local.batches = {}
+        key = tuple(connection.savepoint_ids)
+        batch = batches.get(key)
+        if batch is None or not batch.is_scheduled():
+            batch = batches[key] = AuditBatch(self)
+            transaction.on_commit(batch.flush)
+        batch.records.extend(records)
+
+    def write(self, records):
+        if not records:
+            return
+        if getattr(settings, 'AUDIT_ASYNC', False):
+            self.get_writer().put(records)
+        else:
+            write_records(records, self.stats)
+
+    def get_writer(self):
+        with self.writer_lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = AuditWriter(
+                    self.stats,
+                    max_size=getattr(settings, 'AUDIT_QUEUE_SIZE', 10000),
+                    batch_size=getattr(settings, 'AUDIT_BATCH_SIZE', 500),
+                    interval=getattr(settings, 'AUDIT_FLUSH_INTERVAL', 1.0),
+                )
+                self.writer.start()
+            return self.writer
+
+    def shutdown(self):
+        """Write out everything still queued. Registered with atexit."""
+        with self.writer_lock:
+            writer, self.writer = self.writer, None
+        if writer is not None and writer.is_alive():
+            writer.stop()
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        writer = self.writer
+        stats["async"] = getattr(settings, 'AUDIT_ASYNC', False)
+        stats["queue_depth"] = writer.queue.qsize() if writer is not None else 0
+        stats["queue_size"] = writer.queue.maxsize if writer is not None else getattr(settings, 'AUDIT_QUEUE_SIZE', 10000)
+        return stats
+
+
+audit = AuditSink()
+atexit.register(audit.shutdown)
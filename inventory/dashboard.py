@@ -0,0 +1,98 @@
+import calendar
+from datetime import date, timedelta
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Order, Product, SalesDailyRollup
+from .rollups import bucket_starts
+from .serializers import OrderSerializer
+
+
+SECTIONS = (
+    'revenue', 'profit', 'stock', 'product_cost', 'recent_orders',
+    'daily_sales', 'weekly_sales', 'monthly_sales', 'yearly_sales',
+)
+OUT_OF_STOCK_LEVEL = 3  # Same threshold as stock_count/
+
+
+def completed_sales():
+    return SalesDailyRollup.objects.filter(status='Done', payment_status='Paid')
+
+
+def sales_totals(today):
+    totals = completed_sales().aggregate(revenue=Sum('revenue'), cost=Sum('cost'))
+    revenue = totals['revenue'] or 0
+    return {
+        'revenue': {"total_revenue": totals['revenue']},
+        # Revenue including VAT minus cost, like profit/
+        'profit': {"total_profit": float(revenue - (totals['cost'] or 0))},
+    }
+
+
+def period_sales(today):
+    # One query for every day of the year (and the last week, early in January)
+    start = min(date(today.year, 1, 1), today - timedelta(days=6))
+    daily = dict(
+        completed_sales().filter(date__gte=start, date__lte=today)
+        .values('date').annotate(sales=Sum('revenue')).order_by().values_list('date', 'sales')
+    )
+    monthly = {}
+    for day, sales in daily.items():
+        if day.year == today.year:
+            monthly[day.month] = monthly.get(day.month, 0) + sales
+    return {
+        'daily_sales': {"date": str(today), "total_sales": daily.get(today, 0)},
+        'weekly_sales': [
+            {"period": day.strftime("%A"), "sales": float(daily.get(day, 0))}
+            for day in bucket_starts(today - timedelta(days=6), today, 'day')
+        ],
+        'monthly_sales': [
+            {"period": calendar.month_name[month], "sales": float(monthly.get(month, 0))}
+            for month in range(1, 13)
+        ],
+        'yearly_sales': [{"period": str(today.year), "sales": float(sum(monthly.values()))}],
+    }
+
+
+def catalog_totals(today):
+    totals = Product.objects.aggregate(
+        out_of_stock=Count('id', filter=Q(stock__lte=OUT_OF_STOCK_LEVEL)),
+        total_product_cost=Sum('buying_price'),
+    )
+    return {
+        'stock': {"out_of_stock": totals['out_of_stock']},
+        'product_cost': {"total_product_cost": totals['total_product_cost']},
+    }
+
+
+def recent_orders(today):
+    orders = Order.objects.select_related('customer').prefetch_related('items__product').order_by('-order_date')[:10]
+    return {'recent_orders': list(OrderSerializer(orders, many=True).data)}
+
+
+# Each builder answers several sections from the same queries
+BUILDERS = (
+    (('revenue', 'profit'), sales_totals),
+    (('daily_sales', 'weekly_sales', 'monthly_sales', 'yearly_sales'), period_sales),
+    (('stock', 'product_cost'), catalog_totals),
+    (('recent_orders',), recent_orders),
+)
+
+
+def build_dashboard(sections=SECTIONS):
+    """
+    The manager dashboard KPIs for the requested sections. Every section
+    carries the time it was computed as `as_of`.
+    """
+    today = timezone.localdate()
+    dashboard = {}
+    for names, builder in BUILDERS:
+        wanted = [name for name in names if name in sections]
+        if not wanted:
+            continue
+        data = builder(today)
+        as_of = timezone.now()
+        for name in wanted:
+            dashboard[name] = {"as_of": as_of, "data": data[name]}
+    return dashboard
@@ -0,0 +1,43 @@
+import hashlib
+import json
+
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def table_version(queryset):
+    # Row count and highest id catch inserts and deletes, updated_at catches edits
+    state = queryset.order_by().aggregate(rows=Count('id'), last_id=Max('id'), last_update=Max('updated_at'))
+    return [state['rows'], state['last_id'], state['last_update']]
+
+
+def list_etag(request, queryset, *related):
+    """
+    ETag of a list response, from one aggregate query on the listed rows and
+    one per table the list shows fields of (`related`), and the query string.
+    Much cheaper than serializing the list to hash it.
+    """
+    versions = [table_version(queryset), *(table_version(other) for other in related)]
+    raw = json.dumps([versions, sorted(request.query_params.lists())], default=str)
+    return f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+
+def revalidate(response, etag):
+    """Let the client keep the response, checking it with If-None-Match before each use."""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, etag):
+    """A 304 response when the client's copy is current, otherwise None."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return None
+    etags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    if '*' not in etags and etag not in etags:
+        return None
+    return revalidate(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
@@ -0,0 +1,203 @@
+import csv
+import gzip
+import io
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+
+import openpyxl
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .rollups import day_start
+
+
+CHUNK_SIZE = 2000
+BLOCK_SIZE = 64 * 1024
+
+REPORT_COLUMNS = (
+    'id', 'order_id', 'order_date', 'user', 'customer_name', 'customer_phone', 'customer_tin_number',
+    'item_receipt', 'product_name', 'unit', 'product_price', 'quantity', 'sub_total', 'vat',
+    'payment_status', 'total_amount',
+)
+# Same headers as the old export, so the file can be imported back
+PRODUCT_COLUMNS = (
+    'id', 'name', 'description', 'package', 'piece', 'buying_price',
+    'selling_price', 'unit', 'stock', 'receipt_no', 'user',
+)
+PRODUCT_NAME_COLUMNS = {'category': 'category__name', 'supplier': 'supplier__name'}
+# type: (content type, file name) of the product downloads
+PRODUCT_FILE_TYPES = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'products.xlsx'),
+    'csv': ('text/csv', 'products.csv'),
+    'csv.gz': ('application/gzip', 'products.csv.gz'),
+}
+
+# query parameter and Report field of the exact match filters
+REPORT_FILTERS = {
+    'user': 'user',
+    'payment_status': 'payment_status',
+    'receipt': 'item_receipt',
+    'order_id': 'order_id',
+}
+
+
+def filter_reports(reports, params):
+    """Apply the from/to dates (inclusive) and exact match filters of a request. Raises ValueError on a bad date."""
+    if params.get('from'):
+        reports = reports.filter(order_date__gte=day_start(date.fromisoformat(params['from'])))
+    if params.get('to'):
+        reports = reports.filter(order_date__lt=day_start(date.fromisoformat(params['to']) + timedelta(days=1)))
+    for param, field in REPORT_FILTERS.items():
+        if params.get(param):
+            reports = reports.filter(**{field: params[param]})
+    return reports
+
+
+def iter_rows(queryset, columns, chunk_size=CHUNK_SIZE):
+    """
+    Yield the rows of a queryset as tuples, `chunk_size` rows per query,
+    walking the primary key. Unlike .iterator() this holds one chunk in
+    memory on MySQL too, whose driver otherwise buffers the whole result.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *columns)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+def cell(value):
+    # Excel has no time zones, write the local time
+    if isinstance(value, datetime):
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+    return value
+
+
+class Echo:
+    """A file-like object for csv.writer that hands back each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([cell(value) for value in row])
+
+
+def product_columns(names=False):
+    """(columns, fields) of the product export, with the category and supplier names when `names`."""
+    columns = list(PRODUCT_COLUMNS)
+    fields = list(PRODUCT_COLUMNS)
+    if names:
+        columns += PRODUCT_NAME_COLUMNS.keys()
+        fields += PRODUCT_NAME_COLUMNS.values()
+    return columns, fields
+
+
+def xlsx_file(columns, rows, title, output=None):
+    """
+    The rows as an .xlsx in `output` (a temporary file by default), written
+    with openpyxl's write-only mode: rows go to disk as they come, so memory
+    stays flat.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(list(columns))
+    for row in rows:
+        ws.append([cell(value) for value in row])
+    output = output or tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def csv_file(columns, rows, compress=False, output=None):
+    """
+    The rows as CSV (gzip compressed when `compress`) in `output`, a
+    temporary file by default.
+    The gzip header carries no timestamp, so the same rows always give the
+    same bytes and an interrupted download can be resumed.
+    """
+    output = output or tempfile.TemporaryFile()
+    raw = gzip.GzipFile(fileobj=output, mode='wb', mtime=0) if compress else output
+    text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([cell(value) for value in row])
+    text.flush()
+    text.detach()
+    if compress:
+        raw.close()  # Writes the gzip trailer, leaves `output` open
+    output.seek(0)
+    return output
+
+
+def read_blocks(output, start, length):
+    try:
+        output.seek(start)
+        while length > 0:
+            block = output.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        output.close()
+
+
+def byte_range(header, size):
+    """
+    (start, end) of a single `bytes=` Range header, None to send the whole
+    file (no header, or one this doesn't handle), or False if unsatisfiable.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1  # The last N bytes
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def file_download(request, output, filename, content_type, etag=None):
+    """
+    Send a file built in a temporary file with its Content-Length. When it
+    has an ETag (its bytes only depend on the data) a Range request gets
+    just the bytes asked for, so a broken download can be resumed; If-Range
+    makes sure the part comes from the same file.
+    """
+    output.seek(0, io.SEEK_END)
+    size = output.tell()
+    span = None
+    if etag is not None and request.headers.get('If-Range', etag) == etag:
+        span = byte_range(request.headers.get('Range'), size)
+    if span is False:
+        output.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = span or (0, size - 1)
+    response = StreamingHttpResponse(read_blocks(output, start, end - start + 1), content_type=content_type, status=206 if span else 200)
+    response['Content-Length'] = str(end - start + 1)
+    if span:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if etag is not None:
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
@@ -0,0 +1,136 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import transaction, IntegrityError
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .stock import retry_on_deadlock
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+class Retry(Exception):
+    pass
+
+
+def expired_before():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+
+
+def abandoned_before():
+    # A reservation without a response this old belongs to a request that died mid-way
+    return timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_PENDING_TTL', 60))
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f"{request.method} {request.path}\n{body}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    """Response for a key that was already used, or None if it has expired."""
+    if record.created_at < expired_before():
+        record.delete()
+        return None
+    if record.request_hash != fingerprint:
+        return Response({"error": "Idempotency-Key was already used for a different request."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status_code is None:
+        if record.created_at < abandoned_before():
+            return None
+        return Response({"error": "A request with this Idempotency-Key is still being processed."}, status=status.HTTP_409_CONFLICT)
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotency-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Make a create/update view method safe to retry.
+
+    The first request with a given Idempotency-Key reserves the key, runs the
+    view and stores its response. A retry with the same key and body gets that
+    response back from a single SELECT, without running the write again. Only
+    successful responses are kept, so a failed request can be sent again.
+
+    The view runs in one transaction with the response it stores, holding
+    the reservation's row lock: either both commit or neither does. A
+    reservation left without a response (the worker died) is taken over by
+    a retry after IDEMPOTENCY_PENDING_TTL seconds; the lock makes the retry
+    wait for a request that is in fact still running.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            return Response({"error": "Idempotency-Key must be at most 255 characters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user if request.user.is_authenticated else None
+        fingerprint = request_fingerprint(request)
+
+        record = IdempotencyKey.objects.filter(key=key, user=user).first()
+        if record is not None:
+            response = replay(record, fingerprint)
+            if response is not None:
+                return response
+
+        if record is None or record.created_at < expired_before():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(key=key, user=user, request_hash=fingerprint)
+            except IntegrityError:
+                # Another terminal sent the same key at the same moment
+                record = IdempotencyKey.objects.filter(key=key, user=user).first()
+                response = replay(record, fingerprint) if record is not None else None
+                return response or wrapper(self, request, *args, **kwargs)
+
+        def run():
+            locked = IdempotencyKey.objects.select_for_update().filter(pk=record.pk).first()
+            if locked is None or locked.status_code is not None:
+                # Another request took the key over and finished first
+                raise Retry
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except (APIException, Http404, PermissionDenied) as exc:
+                # Answer it as the request without a key would be, keeping what the view
+                # wrote before raising (a salesman's cancel request is saved, then refused)
+                return self.handle_exception(exc)
+            if status.is_success(response.status_code):
+                locked.status_code = response.status_code
+                locked.response_body = response.data
+                locked.save(update_fields=['status_code', 'response_body'])
+            return response
+
+        try:
+            # The view's own deadlock retry can't start over inside this transaction, retry it here
+            response = retry_on_deadlock(run)
+        except Retry:
+            return wrapper(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(pk=record.pk, status_code=None).delete()
+            raise
+
+        if not status.is_success(response.status_code):
+            IdempotencyKey.objects.filter(pk=record.pk, status_code=None).delete()
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys():
+    """Delete stored responses older than IDEMPOTENCY_KEY_TTL seconds."""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expired_before()).delete()
+    return deleted
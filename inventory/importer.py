@@ -0,0 +1,235 @@
+import itertools
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Category, Product, StockMovement, Supplier
+from .result_cache import bump_data_version
+from .search import SEARCH_FIELDS, index_products
+from .stock import stock_change, stock_values
+from .valuation import add_products, revalue_products
+
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+CENTS = Decimal('0.01')
+
+# column and max length of the text fields
+TEXT_FIELDS = {'name': 200, 'description': None, 'specification': 255, 'unit': 255, 'user': 255}
+INTEGER_FIELDS = ('package', 'piece', 'stock', 'receipt_no')
+MONEY_FIELDS = ('buying_price', 'selling_price')
+# Name columns, like the export with names=1
+RELATED_FIELDS = {'category': Category, 'supplier': Supplier}
+RELATED_ATTNAMES = {'category': 'category_id', 'supplier': 'supplier_id'}
+
+
+def blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def number(value):
+    value = Decimal(str(value).strip())
+    if not value.is_finite():
+        raise InvalidOperation
+    return value
+
+
+def clean_row(data, names):
+    """
+    (values, errors) of one sheet row. `values` only has the fields of the
+    columns the sheet has, so an update leaves the other fields alone.
+    """
+    values = {}
+    errors = {}
+    for field, max_length in TEXT_FIELDS.items():
+        if field in data:
+            values[field] = None if blank(data[field]) else str(data[field]).strip()
+            if max_length and values[field] and len(values[field]) > max_length:
+                errors[field] = f"At most {max_length} characters."
+    for field in INTEGER_FIELDS:
+        if field not in data or blank(data[field]):
+            if field in data:
+                values[field] = None
+            continue
+        try:
+            value = number(data[field])
+            if value != value.to_integral_value():
+                raise InvalidOperation
+        except InvalidOperation:
+            errors[field] = "Must be a whole number."
+            continue
+        if value < 0:
+            errors[field] = "Can't be negative."
+        values[field] = int(value)
+    for field in MONEY_FIELDS:
+        if field not in data or blank(data[field]):
+            if field in data:
+                values[field] = None
+            continue
+        try:
+            value = number(data[field]).quantize(CENTS)
+        except InvalidOperation:
+            errors[field] = "Must be a number."
+            continue
+        if not 0 <= value < 10 ** 8:
+            errors[field] = "Must be between 0 and 99999999.99."
+        values[field] = value
+    for field in RELATED_FIELDS:
+        if field in data:
+            name = None if blank(data[field]) else str(data[field]).strip()
+            values[field] = names[field].get(name) if name else None
+            if name and values[field] is None:
+                errors[field] = f"No {field} named '{name}'."
+    if 'name' in data and not values.get('name'):
+        errors['name'] = "This field is required."
+    return values, errors
+
+
+def add_errors(report, row, errors):
+    report['error_count'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({"row": row, "errors": errors})
+
+
+def import_products(header, rows, dry_run=False, user=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Create or update products from sheet rows, `chunk_size` rows per
+    transaction. A row updates the product with its `id`, or else the
+    product with the same name (and category and specification, when the
+    sheet has those columns); other rows create products.
+
+    Each chunk costs a handful of queries whatever its size: one to fetch
+    and lock the products it touches, then bulk writes. Invalid rows are
+    skipped and listed in the report (the first MAX_REPORTED_ERRORS of them),
+    with their sheet row number. With dry_run nothing is written.
+
+    `progress`, if given, is called with the number of sheet rows read after
+    each chunk.
+    """
+    columns = ['' if column is None else str(column).strip() for column in header]
+    if 'id' not in columns and 'name' not in columns:
+        raise ValueError("The sheet needs an id or a name column.")
+    names = {field: dict(model.objects.values_list('name', 'id')) for field, model in RELATED_FIELDS.items() if field in columns}
+    key_fields = ['name'] + [field for field in ('category', 'specification') if field in columns]
+
+    report = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0, "error_count": 0, "errors": []}
+    planned = set()  # Keys created by earlier chunks of a dry run, which aren't in the database
+    numbered = enumerate(rows, start=2)  # Row 1 is the header
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return report
+        cleaned = []
+        for row_number, row in chunk:
+            if all(blank(value) for value in row):
+                continue
+            report['rows'] += 1
+            data = dict(zip(columns, row))
+            values, errors = clean_row(data, names)
+            pk = None
+            if not blank(data.get('id')):
+                try:
+                    pk = int(number(data['id']))
+                except (InvalidOperation, ValueError):
+                    errors['id'] = "Must be a product id."
+            if errors:
+                add_errors(report, row_number, errors)
+            else:
+                cleaned.append((row_number, pk, values))
+        import_chunk(cleaned, key_fields, report, planned, dry_run, user)
+        if progress:
+            progress(chunk[-1][0] - 1)
+
+
+def row_key(values, key_fields):
+    return tuple(values.get(field) for field in key_fields)
+
+
+def product_key(product, key_fields):
+    return tuple(getattr(product, RELATED_ATTNAMES.get(field, field)) for field in key_fields)
+
+
+def import_chunk(cleaned, key_fields, report, planned, dry_run, user):
+    if not cleaned:
+        return
+    with transaction.atomic():
+        ids = {pk for _, pk, _ in cleaned if pk}
+        product_names = {values['name'] for _, pk, values in cleaned if not pk and values.get('name')}
+        existing = Product.objects.filter(Q(id__in=ids) | Q(name__in=product_names)).order_by('id')
+        if not dry_run:
+            existing = existing.select_for_update()
+        by_id = {}
+        by_key = {}
+        for product in existing:
+            by_id[product.id] = product
+            by_key.setdefault(product_key(product, key_fields), product)
+
+        # id(product): [product, stock values before the import (None when new), changed]
+        touched = {}
+        changed_fields = set()
+        for row_number, pk, values in cleaned:
+            key = row_key(values, key_fields) if 'name' in values else None
+            product = by_id.get(pk) if pk else by_key.get(key)
+            if product is None and not pk and dry_run and key in planned:
+                report['updated'] += 1
+                continue
+            if product is None:
+                if not values.get('name'):
+                    add_errors(report, row_number, {"name": "This field is required for a new product."})
+                    continue
+                product = Product(id=pk, user=user)
+                touched[id(product)] = [product, None, False]
+                entry = None  # Counted as created
+                report['created'] += 1
+                planned.add(key)
+            else:
+                entry = touched.setdefault(id(product), [product, stock_values(product), False])
+
+            fields = {RELATED_ATTNAMES.get(field, field): value for field, value in values.items()}
+            updates = {field: value for field, value in fields.items() if getattr(product, field) != value}
+            for field, value in updates.items():
+                setattr(product, field, value)
+            if entry is not None:
+                report['updated' if updates else 'unchanged'] += 1
+                # A product created by an earlier row of the chunk is still inserted with the others
+                if updates and entry[1] is not None:
+                    entry[2] = True
+                    changed_fields.update(updates)
+            by_key[product_key(product, key_fields)] = product
+            if pk:
+                by_id[pk] = product
+
+        if not dry_run:
+            write_chunk(list(touched.values()), changed_fields, key_fields, user)
+
+
+def write_chunk(touched, changed_fields, key_fields, user):
+    new = [product for product, old, _ in touched if old is None]
+    changed = [product for product, old, updated in touched if old is not None and updated]
+    if changed:
+        # An upsert of the locked rows: bulk_update builds a CASE WHEN per row and field and
+        # is several times slower. It sets updated_at like an insert, bulk_update wouldn't.
+        fields = sorted(field.removesuffix('_id') for field in changed_fields) + ['updated_at']
+        unique_fields = ['id'] if connection.features.supports_update_conflicts_with_target else None
+        Product.objects.bulk_create(changed, batch_size=500, update_conflicts=True, update_fields=fields, unique_fields=unique_fields)
+        revalue_products(changed)
+    if new:
+        Product.objects.bulk_create(new, batch_size=500)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # MySQL doesn't hand back the new ids, look them up (the newest product of each key)
+            missing = [product for product in new if product.pk is None]
+            found = {}
+            for product in Product.objects.filter(name__in={product.name for product in missing}).order_by('id'):
+                found[product_key(product, key_fields)] = product.pk
+            for product in missing:
+                product.pk = found.get(product_key(product, key_fields))
+        add_products(new)
+
+    # Search terms of the new products, and of the changed ones when a searched field changed
+    index_products(new + (changed if changed_fields.intersection(SEARCH_FIELDS) else []))
+
+    movements = [stock_change(product, old or (None, None, None), 'Import', user=product.user or user) for product, old, _ in touched]
+    StockMovement.objects.bulk_create([movement for movement in movements if movement is not None and movement.product.pk])
+    if new or changed:
+        bump_data_version('products')
@@ -0,0 +1,322 @@
+import logging
+import os
+import time
+import uuid
+from datetime import date, timedelta
+
+import openpyxl
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .exports import (
+    CHUNK_SIZE, PRODUCT_FILE_TYPES, REPORT_COLUMNS,
+    csv_file, filter_reports, iter_rows, product_columns, xlsx_file,
+)
+from .idempotency import purge_expired_keys
+from .importer import import_products
+from .models import Job, JobSchedule, Product, Report
+from .rollups import rebuild_sales_rollups
+from .search import rebuild_search_index
+from .sync import purge_tombstones
+from .valuation import reconcile_valuation
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'Queued', 'Running', 'Done', 'Failed', 'Cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+MANAGERS = ('Manager',)
+REPORT_ROLES = ('Manager', 'Salesman', 'Sales Manager')
+
+
+def result_dir(*parts):
+    path = os.path.join(settings.JOB_RESULT_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_upload(upload):
+    """Store an uploaded file for a job to read, returns its name under JOB_RESULT_DIR/uploads."""
+    name = f"{uuid.uuid4().hex}{os.path.splitext(upload.name)[1].lower()}"
+    with open(os.path.join(result_dir('uploads'), name), 'wb') as output:
+        for block in upload.chunks():
+            output.write(block)
+    return name
+
+
+class Progress:
+    """Stores a job's progress in percent, at most once a second."""
+
+    def __init__(self, job):
+        self.job = job
+        self.percent = 0
+        self.written_at = 0
+
+    def __call__(self, done, total):
+        percent = min(int(done * 100 / total), 99) if total else 0
+        now = time.monotonic()
+        if percent == self.percent or now - self.written_at < 1:
+            return
+        self.percent = percent
+        self.written_at = now
+        Job.objects.filter(pk=self.job.pk).update(progress=percent, heartbeat_at=timezone.now())
+
+
+def counted(rows, total, progress):
+    for done, row in enumerate(rows, start=1):
+        if done % CHUNK_SIZE == 0:
+            progress(done, total)
+        yield row
+
+
+def result_file(job, name, content_type):
+    """Path of the job's result file. The file is named after the job, the download after `name`."""
+    job.result_path = f"{job.pk}-{name}"
+    job.result_name = name
+    job.content_type = content_type
+    return os.path.join(result_dir(), job.result_path)
+
+
+# ------------------ Tasks ------------------
+# Each takes the job and a Progress, writes its file through result_file() and
+# returns a JSON summary (or None).
+
+def export_products(job, progress):
+    file_type = job.params.get('type', 'xlsx')
+    content_type, filename = PRODUCT_FILE_TYPES[file_type]
+    columns, fields = product_columns(bool(job.params.get('names')))
+    products = Product.objects.all()
+    rows = counted(iter_rows(products, fields), products.count(), progress)
+    with open(result_file(job, filename, content_type), 'wb') as output:
+        if file_type == 'xlsx':
+            xlsx_file(columns, rows, 'Products', output=output)
+        else:
+            csv_file(columns, rows, compress=file_type == 'csv.gz', output=output)
+    return None
+
+
+def export_report(job, progress):
+    file_type = job.params.get('type', 'xlsx')
+    reports = filter_reports(Report.objects.all(), job.params)
+    rows = counted(iter_rows(reports, REPORT_COLUMNS), reports.count(), progress)
+    filename = f"report_{job.params.get('from') or 'start'}_{job.params.get('to') or timezone.localdate()}.{file_type}"
+    if file_type == 'csv':
+        content_type = 'text/csv'
+    else:
+        content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    with open(result_file(job, filename, content_type), 'wb') as output:
+        if file_type == 'csv':
+            csv_file(REPORT_COLUMNS, rows, output=output)
+        else:
+            xlsx_file(REPORT_COLUMNS, rows, 'Report', output=output)
+    return None
+
+
+def import_products_file(job, progress):
+    path = os.path.join(result_dir('uploads'), os.path.basename(job.params['upload']))
+    try:
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            sheet = wb.active
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                raise ValueError("The sheet is empty.")
+            total = max((sheet.max_row or 1) - 1, 0)  # From the sheet's dimension, can be missing
+            return import_products(
+                header, rows, dry_run=bool(job.params.get('dry_run')),
+                user=job.user.name if job.user else None,
+                progress=lambda done: progress(done, total),
+            )
+        finally:
+            wb.close()
+    finally:
+        os.remove(path)
+
+
+def rebuild_rollups(job, progress):
+    start = date.fromisoformat(job.params['from']) if job.params.get('from') else None
+    end = date.fromisoformat(job.params['to']) if job.params.get('to') else None
+    rows = sum(count for _, count in rebuild_sales_rollups(start, end))
+    return {"rows": rows}
+
+
+def reconcile_inventory_valuation(job, progress):
+    drift = reconcile_valuation()
+    return {"drifted_buckets": len(drift)}
+
+
+def purge_idempotency_keys(job, progress):
+    return {"deleted": purge_expired_keys()}
+
+
+def rebuild_product_search(job, progress):
+    return {"products": rebuild_search_index()}
+
+
+def purge_sync_tombstones(job, progress):
+    return {"deleted": purge_tombstones()}
+
+
+def purge_jobs(job, progress):
+    """Delete finished jobs older than JOB_RESULT_DAYS with their files, and uploads no job reads."""
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RESULT_DAYS)
+    old = Job.objects.filter(state__in=FINISHED, finished_at__lt=cutoff)
+    for path in old.exclude(result_path=None).values_list('result_path', flat=True):
+        try:
+            os.remove(os.path.join(result_dir(), path))
+        except FileNotFoundError:
+            pass
+    deleted, _ = old.delete()
+
+    pending = {params.get('upload') for params in Job.objects.filter(kind='import_products', state__in=[QUEUED, RUNNING]).values_list('params', flat=True)}
+    for entry in os.scandir(result_dir('uploads')):
+        if entry.name not in pending and entry.stat().st_mtime < cutoff.timestamp():
+            os.remove(entry.path)
+    return {"deleted": deleted}
+
+
+# kind: (task, parameters a request may set, roles that may submit it; None for every user)
+TASKS = {
+    'export_products': (export_products, ('type', 'names'), None),
+    'export_report': (export_report, ('type', 'from', 'to', 'user', 'payment_status', 'receipt', 'order_id'), REPORT_ROLES),
+    'import_products': (import_products_file, ('dry_run',), None),
+    'rebuild_sales_rollups': (rebuild_rollups, ('from', 'to'), MANAGERS),
+    'reconcile_inventory_valuation': (reconcile_inventory_valuation, (), MANAGERS),
+    'purge_idempotency_keys': (purge_idempotency_keys, (), MANAGERS),
+    'rebuild_product_search': (rebuild_product_search, (), MANAGERS),
+    'purge_sync_tombstones': (purge_sync_tombstones, (), MANAGERS),
+    'purge_jobs': (purge_jobs, (), MANAGERS),
+}
+
+
+def can_submit(user, kind):
+    roles = TASKS[kind][2]
+    return roles is None or user.is_superuser == True or user.role in roles
+
+
+def clean_params(kind, params):
+    """The parameters of a submitted job, checked so a bad one fails the request rather than the job. Raises ValueError."""
+    params = {name: params[name] for name in TASKS[kind][1] if params.get(name) not in (None, '')}
+    if kind == 'export_products' and params.get('type', 'xlsx') not in PRODUCT_FILE_TYPES:
+        raise ValueError(f"type must be one of {', '.join(PRODUCT_FILE_TYPES)}.")
+    if kind == 'export_report' and params.get('type', 'xlsx') not in ('csv', 'xlsx'):
+        raise ValueError("type must be csv or xlsx.")
+    for name in ('from', 'to'):
+        if name in params:
+            try:
+                date.fromisoformat(str(params[name]))
+            except ValueError:
+                raise ValueError("from and to must be dates (YYYY-MM-DD).")
+    for name in ('names', 'dry_run'):
+        if name in params:
+            params[name] = str(params[name]).lower() in ('1', 'true', 'yes')
+    return params
+
+
+# ------------------ Queue ------------------
+
+def skip_locked():
+    # Without SKIP LOCKED (MySQL before 8.0) workers queue on the row instead, the state check still holds
+    return connection.features.has_select_for_update_skip_locked
+
+
+def claim_job(worker):
+    """
+    The next due job, marked running for `worker`, or None. The row is read
+    with FOR UPDATE SKIP LOCKED, so workers polling together each take a
+    different job without waiting on one another.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = Job.objects.filter(state=QUEUED, run_after__lte=now).order_by('run_after', 'id')
+        job = next(iter(due.select_for_update(skip_locked=skip_locked())[:1]), None)
+        if job is None:
+            return None
+        # The state check keeps the claim safe where the row isn't locked (SQLite)
+        if not Job.objects.filter(pk=job.pk, state=QUEUED).update(state=RUNNING, worker=worker, started_at=now, heartbeat_at=now):
+            return None
+    job.state, job.worker, job.started_at, job.heartbeat_at = RUNNING, worker, now, now
+    return job
+
+
+def run_job(job_id):
+    """Run a claimed job. A failure is stored on the job, never raised."""
+    job = Job.objects.select_related('user').get(pk=job_id)
+    try:
+        task = TASKS[job.kind][0]
+        job.result = task(job, Progress(job))
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        if job.result_path:
+            try:
+                os.remove(os.path.join(result_dir(), job.result_path))
+            except FileNotFoundError:
+                pass
+        Job.objects.filter(pk=job.pk, state=RUNNING).update(state=FAILED, error=f"{type(e).__name__}: {e}", result_path=None, finished_at=timezone.now())
+        return
+    # Only a job still running: fail_stale_jobs on another machine may have failed it meanwhile
+    finished = Job.objects.filter(pk=job.pk, state=RUNNING).update(
+        state=DONE, progress=100, result=job.result, result_path=job.result_path,
+        result_name=job.result_name, content_type=job.content_type, finished_at=timezone.now(),
+    )
+    if not finished and job.result_path:
+        try:
+            os.remove(os.path.join(result_dir(), job.result_path))
+        except FileNotFoundError:
+            pass
+
+
+def run_job_in_process(job_id):
+    # Pool processes are long-lived, drop connections the database timed out
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def fail_job(job_id, error):
+    Job.objects.filter(pk=job_id, state=RUNNING).update(state=FAILED, error=error, finished_at=timezone.now())
+
+
+def heartbeat(job_ids):
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, state=RUNNING).update(heartbeat_at=timezone.now())
+
+
+def fail_stale_jobs():
+    """Fail the running jobs whose worker stopped sending heartbeats (killed, or its machine restarted)."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    return Job.objects.filter(state=RUNNING, heartbeat_at__lt=cutoff).update(
+        state=FAILED, error="The worker running the job stopped.", finished_at=timezone.now(),
+    )
+
+
+def queue_due_schedules(now=None):
+    """
+    Queue a job for every schedule that is due and move it to its next run.
+    Runs missed while no worker was up are skipped, and a schedule whose
+    last job is still queued or running doesn't queue another.
+    """
+    now = now or timezone.now()
+    queued = []
+    with transaction.atomic():
+        due = JobSchedule.objects.filter(enabled=True, next_run_at__lte=now).select_for_update(skip_locked=skip_locked())
+        for schedule in due:
+            if not schedule.jobs.filter(state__in=[QUEUED, RUNNING]).exists():
+                queued.append(Job.objects.create(kind=schedule.kind, params=schedule.params, schedule=schedule))
+            interval = timedelta(seconds=max(schedule.interval, 1))
+            schedule.next_run_at += ((now - schedule.next_run_at) // interval + 1) * interval
+            schedule.save(update_fields=['next_run_at'])
+    return queued
+
+
+def visible_jobs(user):
+    """Managers see every job, other users their own."""
+    jobs = Job.objects.select_related('user').order_by('-id')
+    if user.role == 'Manager' or user.is_superuser == True:
+        return jobs
+    return jobs.filter(user=user)
@@ -0,0 +1,46 @@
+from django.db.models import Case, DecimalField, F, FloatField, Q, Sum, Value, When, Window
+from django.db.models.functions import Cast, Rank
+
+from .models import SalesDailyRollup
+
+
+# Ranking metric and whether a higher value ranks first
+RANKINGS = {
+    'revenue': ('revenue_total', True),
+    'orders': ('completed_orders', True),
+    'average_basket': ('average_basket', True),
+    'cancellation_rate': ('cancellation_rate', False),
+}
+
+
+def leaderboard(start, end, rank_by='revenue'):
+    """
+    Every salesperson with orders between two dates (inclusive): revenue and
+    order count of the paid, done orders, average basket and the share of
+    orders cancelled. One grouped query on the sales rollup, ranked with a
+    window function on `rank_by`.
+
+    Returns the queryset, ordered by rank, so it can be paginated; the ranks
+    are computed over every row before the page is cut.
+    """
+    completed = Q(status='Done', payment_status='Paid')
+    field, descending = RANKINGS[rank_by]
+    rows = SalesDailyRollup.objects.filter(date__gte=start, date__lte=end, user_email__isnull=False).values('user_email').annotate(
+        revenue_total=Sum('revenue', filter=completed, default=0),
+        completed_orders=Sum('orders', filter=completed, default=0),
+        all_orders=Sum('orders', default=0),
+        cancelled_orders=Sum('orders', filter=Q(status='Cancelled'), default=0),
+    ).annotate(
+        average_basket=Case(
+            When(completed_orders__gt=0, then=F('revenue_total') / F('completed_orders')),
+            default=Value(0),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        ),
+        cancellation_rate=Case(
+            When(all_orders__gt=0, then=Cast('cancelled_orders', FloatField()) / F('all_orders')),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+    order = F(field).desc() if descending else F(field).asc()
+    return rows.annotate(rank=Window(Rank(), order_by=order)).order_by('rank', 'user_email')
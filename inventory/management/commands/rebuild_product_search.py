@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from the products, their categories and suppliers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Products reindexed per transaction.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        total = rebuild_search_index(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {total} products."))
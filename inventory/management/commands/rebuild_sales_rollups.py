@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollup from the orders, a few weeks per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help="First day to rebuild (YYYY-MM-DD). Defaults to the first order.")
+        parser.add_argument('--to', dest='end', help="Last day to rebuild (YYYY-MM-DD). Defaults to the last order.")
+        parser.add_argument('--days', type=int, default=31, help="Days per transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if options['days'] < 1:
+            raise CommandError("--days must be at least 1.")
+
+        total = 0
+        for day, rows in rebuild_sales_rollups(start, end, days=options['days']):
+            total += rows
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{day}: {rows} rows")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} sales rollup rows."))
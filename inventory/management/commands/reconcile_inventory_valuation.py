@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.valuation import reconcile_valuation
+
+
+class Command(BaseCommand):
+    help = "Recount the running inventory valuation from the products and fix the buckets that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Products per grouped query.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the drift without fixing it.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        drift = reconcile_valuation(options['chunk_size'], dry_run=options['dry_run'])
+        for (category_key, supplier_key), stored, counted in drift:
+            self.stdout.write(
+                f"category {category_key or '-'}, supplier {supplier_key or '-'}: "
+                f"stored {' / '.join(map(str, stored))}, counted {' / '.join(map(str, counted))}"
+            )
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Inventory valuation is up to date."))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} valuation buckets drifted."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drift)} valuation buckets."))
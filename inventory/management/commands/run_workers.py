@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from inventory.jobs import claim_job, fail_job, fail_stale_jobs, heartbeat, queue_due_schedules, run_job, run_job_in_process
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queued jobs (exports, imports, scheduled maintenance) in a pool of processes. "
+        "Jobs are claimed from the database, no broker is needed; start one per machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.JOB_WORKERS, help="Jobs run at once. 0 runs them one by one in this process, for debugging.")
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL, help="Seconds between looks at the queue.")
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit.")
+
+    def handle(self, *args, **options):
+        if options['processes'] < 0:
+            raise CommandError("--processes can't be negative.")
+        if options['poll_interval'] <= 0:
+            raise CommandError("--poll-interval must be positive.")
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        if not options['once']:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        if options['processes'] == 0:
+            self.run_inline(options['poll_interval'], options['once'])
+        else:
+            self.run_pool(options['processes'], options['poll_interval'], options['once'])
+
+    def stop(self, signum, frame):
+        # Finish the running jobs, claim no more
+        self.stdout.write("Stopping after the running jobs finish.")
+        self.stopping = True
+
+    def poll(self):
+        fail_stale_jobs()
+        queue_due_schedules()
+
+    def run_inline(self, poll_interval, once):
+        while not self.stopping:
+            self.poll()
+            job = claim_job(self.worker)
+            if job is not None:
+                self.run_with_heartbeat(job.pk, poll_interval)
+                self.stdout.write(f"Ran job {job.pk} ({job.kind}).")
+            elif once:
+                return
+            else:
+                time.sleep(poll_interval)
+
+    def run_with_heartbeat(self, job_id, interval):
+        # A job that never reports progress would look stale to the other workers while it runs
+        done = threading.Event()
+
+        def beat():
+            try:
+                while not done.wait(interval):
+                    heartbeat([job_id])
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            run_job(job_id)
+        finally:
+            done.set()
+            thread.join()
+
+    def new_pool(self, processes):
+        # Spawned, not forked: a child must not share the parent's database connection
+        return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+
+    def run_pool(self, processes, poll_interval, once):
+        pool = self.new_pool(processes)
+        running = {}  # future: job id
+        try:
+            while running or not self.stopping:
+                # Long-lived, drop connections the database timed out like a request would
+                close_old_connections()
+                self.poll()
+                heartbeat(list(running.values()))
+                while not self.stopping and len(running) < processes:
+                    job = claim_job(self.worker)
+                    if job is None:
+                        break
+                    running[pool.submit(run_job_in_process, job.pk)] = job.pk
+                    self.stdout.write(f"Started job {job.pk} ({job.kind}).")
+                if not running:
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        fail_job(job_id, "The worker process running the job died.")
+                    except Exception as e:
+                        fail_job(job_id, f"{type(e).__name__}: {e}")
+                if broken:
+                    # Every job of a broken pool fails with it, start a new one
+                    for job_id in running.values():
+                        fail_job(job_id, "The worker process running the job died.")
+                    running = {}
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.new_pool(processes)
+        finally:
+            pool.shutdown(wait=True)
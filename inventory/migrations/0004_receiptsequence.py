@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_order_credit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceiptSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=50)),
+                ('fiscal_year', models.IntegerField(default=0)),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('series', 'fiscal_year'), name='unique_receipt_sequence')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    # Start the ledger from the stock each product has today
+    Product = apps.get_model('inventory', 'Product')
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    movements = [
+        StockMovement(
+            product_id=product_id,
+            quantity=stock or 0,
+            package=package or 0,
+            receipt_no=receipt_no or 0,
+            reason='Opening Balance',
+        )
+        for product_id, stock, package, receipt_no in Product.objects.values_list('id', 'stock', 'package', 'receipt_no').iterator()
+        if stock or package or receipt_no
+    ]
+    StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('package', models.IntegerField(default=0)),
+                ('receipt_no', models.IntegerField(default=0)),
+                ('reason', models.CharField(choices=[('Opening Balance', 'Opening Balance'), ('Sale', 'Sale'), ('Order Edit', 'Order Edit'), ('Item Edit', 'Item Edit'), ('Item Cancelled', 'Item Cancelled'), ('Order Cancelled', 'Order Cancelled'), ('Product Update', 'Product Update'), ('Import', 'Import')], max_length=50)),
+                ('user', models.CharField(blank=True, max_length=255, null=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='inventory.order')),
+                ('order_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='inventory.orderitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_product_id')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
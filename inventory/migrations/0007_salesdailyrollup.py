@@ -0,0 +1,70 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:48
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def build_rollups(apps, schema_editor):
+    # Count the existing orders; `manage.py rebuild_sales_rollups` does the same in chunks
+    Order = apps.get_model('inventory', 'Order')
+    OrderItem = apps.get_model('inventory', 'OrderItem')
+    SalesDailyRollup = apps.get_model('inventory', 'SalesDailyRollup')
+    tz = timezone.get_current_timezone()
+    group = ('user_email', 'receipt', 'status', 'payment_status')
+
+    rows = {}
+    for row in Order.objects.annotate(day=TruncDate('order_date', tzinfo=tz)).values('day', *group).annotate(
+        revenue=Sum('total_amount'), vat_total=Sum('vat'), order_count=Count('id'),
+    ):
+        rows[(row['day'], *(row[field] for field in group))] = SalesDailyRollup(
+            date=row['day'],
+            **{field: row[field] for field in group},
+            revenue=row['revenue'] or 0,
+            vat=row['vat_total'] or 0,
+            orders=row['order_count'],
+        )
+    for row in OrderItem.objects.annotate(day=TruncDate('order__order_date', tzinfo=tz)).values('day', *(f'order__{field}' for field in group)).annotate(
+        item_count=Count('id', filter=~Q(status='Cancelled')), cost_total=Sum('cost'),
+    ):
+        rollup = rows.get((row['day'], *(row[f'order__{field}'] for field in group)))
+        if rollup is not None:
+            rollup.items = row['item_count']
+            rollup.cost = row['cost_total'] or 0
+    SalesDailyRollup.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user_email', models.CharField(blank=True, max_length=255, null=True)),
+                ('receipt', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(blank=True, max_length=100, null=True)),
+                ('payment_status', models.CharField(blank=True, max_length=50, null=True)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('vat', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('cost', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'user_email', 'receipt'], name='sales_rollup_key')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:53
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def build_product_rollups(apps, schema_editor):
+    # Same rows as inventory.rollups.build_rollups, for the orders already placed
+    OrderItem = apps.get_model('inventory', 'OrderItem')
+    ProductSalesDailyRollup = apps.get_model('inventory', 'ProductSalesDailyRollup')
+    tz = timezone.get_current_timezone()
+
+    rows = {}
+    items = OrderItem.objects.filter(order__status='Done', order__payment_status='Paid').exclude(status='Cancelled')
+    for row in items.annotate(day=TruncDate('order__order_date', tzinfo=tz)).values(
+        'day', 'product', 'order__user_email', 'order__receipt', 'order__vat_type',
+    ).annotate(quantity_total=Sum('quantity'), price_total=Sum('price'), cost_total=Sum('cost')):
+        key = (row['day'], row['product'], row['order__user_email'], row['order__receipt'])
+        rollup = rows.get(key)
+        if rollup is None:
+            rollup = rows[key] = ProductSalesDailyRollup(
+                date=row['day'], product_id=row['product'], user_email=row['order__user_email'],
+                receipt=row['order__receipt'], quantity=0, revenue=0, cost=0,
+            )
+        revenue = row['price_total'] or 0
+        if row['order__receipt'] == 'Receipt' and row['order__vat_type'] == 'Inclusive':
+            revenue = revenue / Decimal('1.15')
+        rollup.quantity += row['quantity_total'] or 0
+        rollup.revenue += revenue
+        rollup.cost += row['cost_total'] or 0
+    ProductSalesDailyRollup.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_salesdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user_email', models.CharField(blank=True, max_length=255, null=True)),
+                ('receipt', models.CharField(blank=True, max_length=255, null=True)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('cost', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'user_email', 'receipt'], name='product_rollup_key'), models.Index(fields=['product', 'date'], name='product_rollup_product')],
+            },
+        ),
+        migrations.RunPython(build_product_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+
+def create_counters(apps, schema_editor):
+    DataVersion = apps.get_model('inventory', 'DataVersion')
+    DataVersion.objects.bulk_create([DataVersion(name=name) for name in ('orders', 'products', 'expenses')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_productsalesdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:06
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+
+
+def value_inventory(apps, schema_editor):
+    # Value the existing stock; `manage.py reconcile_inventory_valuation` does the same in chunks
+    Product = apps.get_model('inventory', 'Product')
+    InventoryValuation = apps.get_model('inventory', 'InventoryValuation')
+    money = DecimalField(max_digits=20, decimal_places=2)
+    InventoryValuation.objects.bulk_create([
+        InventoryValuation(
+            category_key=row['category'] or 0,
+            supplier_key=row['supplier'] or 0,
+            products=row['product_count'],
+            units=row['units'] or 0,
+            cost_value=row['cost'] or 0,
+            retail_value=row['retail'] or 0,
+        )
+        for row in Product.objects.values('category', 'supplier').annotate(
+            product_count=Count('id'),
+            units=Sum('stock'),
+            cost=Sum(F('stock') * F('buying_price'), output_field=money),
+            retail=Sum(F('stock') * F('selling_price'), output_field=money),
+        ).order_by()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryValuation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_key', models.IntegerField(default=0)),
+                ('supplier_key', models.IntegerField(default=0)),
+                ('products', models.IntegerField(default=0)),
+                ('units', models.BigIntegerField(default=0)),
+                ('cost_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('retail_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category_key', 'supplier_key'), name='unique_valuation_bucket')],
+            },
+        ),
+        migrations.RunPython(value_inventory, migrations.RunPython.noop),
+    ]
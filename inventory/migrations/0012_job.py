@@ -0,0 +1,78 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:20
+
+import django.core.serializers.json
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+NIGHTLY = [
+    ('nightly-valuation-reconcile', 'reconcile_inventory_valuation', datetime.time(2, 0)),
+    ('nightly-idempotency-purge', 'purge_idempotency_keys', datetime.time(2, 30)),
+    ('nightly-job-purge', 'purge_jobs', datetime.time(3, 0)),
+]
+
+
+def create_schedules(apps, schema_editor):
+    JobSchedule = apps.get_model('inventory', 'JobSchedule')
+    now = django.utils.timezone.localtime()
+    schedules = []
+    for name, kind, at in NIGHTLY:
+        next_run_at = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+        if next_run_at <= now:
+            next_run_at += datetime.timedelta(days=1)
+        schedules.append(JobSchedule(name=name, kind=kind, interval=86400, next_run_at=next_run_at))
+    JobSchedule.objects.bulk_create(schedules)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_inventoryvaluation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('kind', models.CharField(max_length=50)),
+                ('params', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('interval', models.PositiveIntegerField(default=86400)),
+                ('next_run_at', models.DateTimeField(db_index=True)),
+                ('enabled', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('params', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('state', models.CharField(choices=[('Queued', 'Queued'), ('Running', 'Running'), ('Done', 'Done'), ('Failed', 'Failed'), ('Cancelled', 'Cancelled')], default='Queued', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('result', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('result_path', models.CharField(blank=True, max_length=500, null=True)),
+                ('result_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('content_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('worker', models.CharField(blank=True, max_length=255, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+                ('schedule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='inventory.jobschedule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'run_after'], name='job_state_run_after')],
+            },
+        ),
+        migrations.RunPython(create_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:28
+
+import datetime
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_schedule(apps, schema_editor):
+    JobSchedule = apps.get_model('inventory', 'JobSchedule')
+    now = django.utils.timezone.localtime()
+    next_run_at = now.replace(hour=3, minute=30, second=0, microsecond=0)
+    if next_run_at <= now:
+        next_run_at += datetime.timedelta(days=1)
+    JobSchedule.objects.create(name='nightly-tombstone-purge', kind='purge_sync_tombstones', interval=86400, next_run_at=next_run_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.RunPython(create_schedule, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_products(apps, schema_editor):
+    # Index the existing catalog; `manage.py rebuild_product_search` does the same
+    from inventory.search import product_terms
+    Product = apps.get_model('inventory', 'Product')
+    ProductSearchToken = apps.get_model('inventory', 'ProductSearchToken')
+    products = Product.objects.values_list('id', 'name', 'specification', 'category__name', 'supplier__name').order_by('id')
+    rows = []
+    for product_id, *texts in products.iterator(chunk_size=2000):
+        rows.extend(ProductSearchToken(product_id=product_id, token=term, weight=weight) for term, weight in product_terms(*texts).items())
+        if len(rows) >= 10000:
+            ProductSearchToken.objects.bulk_create(rows, batch_size=1000)
+            rows = []
+    ProductSearchToken.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_synctombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='inventory.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('token', 'product'), name='unique_product_search_token')],
+            },
+        ),
+        migrations.RunPython(index_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:53
+
+from django.db import migrations, models
+
+
+def drop_duplicate_rollups(apps, schema_editor):
+    # Rows two racing writers both inserted; rebuild_sales_rollups recounts their days
+    for name, key in (
+        ('SalesDailyRollup', ('date', 'user_email', 'receipt', 'status', 'payment_status')),
+        ('ProductSalesDailyRollup', ('date', 'product', 'user_email', 'receipt')),
+    ):
+        model = apps.get_model('inventory', name)
+        seen = set()
+        duplicates = []
+        for pk, *values in model.objects.order_by('pk').values_list('pk', *key).iterator():
+            if tuple(values) in seen:
+                duplicates.append(pk)
+            else:
+                seen.add(tuple(values))
+        model.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_productsearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollupKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user_email', models.CharField(blank=True, default='', max_length=255)),
+                ('receipt', models.CharField(blank=True, default='', max_length=255)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='salesdailyrollup',
+            name='sales_rollup_key',
+        ),
+        migrations.RunPython(drop_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productsalesdailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'product', 'user_email', 'receipt'), name='unique_product_sales_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesdailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'user_email', 'receipt', 'status', 'payment_status'), name='unique_sales_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollupkey',
+            constraint=models.UniqueConstraint(fields=('date', 'user_email', 'receipt'), name='unique_sales_rollup_key'),
+        ),
+    ]
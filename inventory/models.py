@@ -1,14 +1,20 @@
 from django.db import models
 from user.models import UserAccount
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 from django.db.models import UniqueConstraint
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Sum, Count, Q
 from decimal import Decimal
 from django.db import transaction
+from django.utils import timezone
+from contextlib import contextmanager
+import threading
 
 
+VAT_RATE = Decimal('0.15')
+
 
 class OrderLog(models.Model):
     ACTION_CHOICES = [
@@ -34,6 +40,15 @@ class OrderLog(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=100, default='', unique=True)
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The name in the products' search terms, so only a rename reindexes them
+        if 'name' in instance.__dict__:
+            instance._search_name = instance.name
+        return instance
 
     def __str__(self):
         return self.name
@@ -43,6 +58,15 @@ class Supplier(models.Model):
     contact_info = models.CharField(max_length=50, null=True, blank=True)
     tin_number = models.CharField(max_length=50, null=True, blank=True)
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The name in the products' search terms, so only a rename reindexes them
+        if 'name' in instance.__dict__:
+            instance._search_name = instance.name
+        return instance
 
     def __str__(self):
         return self.name
@@ -62,6 +86,18 @@ class Product(models.Model):
     receipt_no = models.IntegerField(null=True, blank=True)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The values counted in InventoryValuation, so a save can apply the difference
+        from .valuation import valuation_state
+        instance._valuation = valuation_state(instance)
+        # And the ones in the search index, so a save that leaves them alone skips it
+        from .search import search_state
+        instance._search_state = search_state(instance)
+        return instance
 
     def __str__(self):
         return self.name
@@ -76,6 +112,7 @@ class CustomerInfo(models.Model):
     city = models.CharField(max_length=255, null=True, blank=True)
     sub_city = models.CharField(max_length=255, null=True, blank=True)
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -125,7 +162,7 @@ class Order(models.Model):
     ]
 
     customer = models.ForeignKey(CustomerInfo, on_delete=models.SET_NULL, null=True, blank=True)
-    order_date = models.DateTimeField(auto_now_add=True)
+    order_date = models.DateTimeField(auto_now_add=True, db_index=True)
     status = models.CharField(max_length=100, choices=(('Cancelled', 'Cancelled'), ('Pending', 'Pending'), ('Done', 'Done')), default="Done", null=True, blank=True)
     receipt = models.CharField(max_length=255, choices=ACTION_CHOICES, default="No Receipt", null=True, blank=True)
     receipt_id = models.CharField(max_length=255, null=True, blank=True)
@@ -145,6 +182,13 @@ class Order(models.Model):
 
     def str(self):
         return self.customer
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Where the order was counted in SalesDailyRollup, in case an edit moves it
+        instance._sales_key = (instance.__dict__.get('order_date'), instance.__dict__.get('user_email'), instance.__dict__.get('receipt'))
+        return instance
     
     # @property
     def is_empty(self):
@@ -153,11 +197,76 @@ class Order(models.Model):
     def get_sub_total_price(self):
         """Calculate the total price of the entire order."""
         return sum(item.get_price() for item in self.items.all())
-    
+
+    def calculate_totals(self, items_total):
+        """Set sub_total, vat and total_amount from the summed item prices."""
+        items_total = Decimal(items_total or 0)
+        if self.receipt == 'Receipt' and self.vat_type == 'Exclusive':
+            self.sub_total = items_total
+            self.vat = items_total * VAT_RATE
+            self.total_amount = items_total + self.vat
+        elif self.receipt == 'Receipt' and self.vat_type == 'Inclusive':
+            self.total_amount = items_total  # Total including VAT
+            self.sub_total = items_total / (1 + VAT_RATE)  # Pre-VAT amount
+            self.vat = self.total_amount - self.sub_total
+        else:
+            self.sub_total = items_total
+            self.vat = 0
+            self.total_amount = items_total
+
+    def apply_item_counts(self, count, pending, done, cancelled):
+        """Set number_of_items, item_pending and status from the item status counts."""
+        self.number_of_items = count
+        if count and cancelled == count:
+            self.status = 'Cancelled'
+
+        if count == 1 and pending == 1:
+            self.item_pending = 0
+            self.status = 'Pending'
+        elif count > 1:
+            if done:
+                self.item_pending = pending
+            elif pending == count:
+                self.item_pending = 0
+                self.status = 'Pending'
+        else:
+            self.item_pending = 0
+
     def check_and_delete_if_no_items(self):
         if not self.items.exists():
             self.delete()
 
+class ReceiptSequence(models.Model):
+    """Next receipt number per receipt series (and fiscal year, when numbering restarts yearly)."""
+    series = models.CharField(max_length=50)
+    fiscal_year = models.IntegerField(default=0)  # 0 when numbering never restarts
+    next_value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['series', 'fiscal_year'], name='unique_receipt_sequence')
+        ]
+
+    def __str__(self):
+        return f"{self.series} ({self.fiscal_year}): {self.next_value}"
+
+class IdempotencyKey(models.Model):
+    """Stored response of a write sent with an Idempotency-Key header, so a retry can be replayed."""
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE, null=True, blank=True)
+    request_hash = models.CharField(max_length=64)  # sha256 of method, path and body
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None while the request is running
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key')
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code})"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
@@ -218,6 +327,7 @@ class Report(models.Model):
 class ExpenseTypes(models.Model):
     name = models.CharField(max_length=100)
     user = models.CharField(max_length=255, default="User", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -253,6 +363,224 @@ class ProductLog(models.Model):
     user = models.CharField(max_length=255, null=True, blank=True)
 
 
+class StockMovement(models.Model):
+    """
+    Append-only ledger of stock changes. Product.stock, package and receipt_no
+    are the running totals of quantity, package and receipt_no below.
+    """
+    REASON_CHOICES = [
+        ('Opening Balance', 'Opening Balance'),
+        ('Sale', 'Sale'),
+        ('Order Edit', 'Order Edit'),
+        ('Item Edit', 'Item Edit'),
+        ('Item Cancelled', 'Item Cancelled'),
+        ('Order Cancelled', 'Order Cancelled'),
+        ('Product Update', 'Product Update'),
+        ('Import', 'Import'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.IntegerField(default=0)  # pieces, negative when stock goes out
+    package = models.IntegerField(default=0)
+    receipt_no = models.IntegerField(default=0)
+    reason = models.CharField(max_length=50, choices=REASON_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, related_name='stock_movements', null=True, blank=True)
+    order_item = models.ForeignKey(OrderItem, on_delete=models.SET_NULL, related_name='stock_movements', null=True, blank=True)
+    user = models.CharField(max_length=255, null=True, blank=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stock_movement_product_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.reason} {self.product_id}: {self.quantity}"
+
+
+class SalesRollupKey(models.Model):
+    """
+    One row per (business day, salesperson, receipt type) the rollups hold.
+    Writers lock it before recounting the key's orders, so two checkouts of
+    one salesperson on one day recount one after the other. Empty strings
+    stand for null, a unique key can't hold nulls.
+    """
+    date = models.DateField()
+    user_email = models.CharField(max_length=255, default='', blank=True)
+    receipt = models.CharField(max_length=255, default='', blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'user_email', 'receipt'], name='unique_sales_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.user_email} {self.receipt}"
+
+
+class SalesDailyRollup(models.Model):
+    """
+    Order totals per business day, salesperson, receipt type, order status and
+    payment status. Kept up to date by the order write paths; rebuild it with
+    `manage.py rebuild_sales_rollups`.
+    """
+    date = models.DateField()
+    user_email = models.CharField(max_length=255, null=True, blank=True)
+    receipt = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=100, null=True, blank=True)
+    payment_status = models.CharField(max_length=50, null=True, blank=True)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)  # Sum of total_amount
+    vat = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    cost = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)  # Items that are not cancelled
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'user_email', 'receipt', 'status', 'payment_status'], name='unique_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.user_email} {self.receipt}: {self.revenue}"
+
+
+class ProductSalesDailyRollup(models.Model):
+    """
+    Paid, done sales per business day, product, salesperson and receipt type,
+    kept together with SalesDailyRollup. Revenue is net of VAT.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, related_name='sales_rollups', null=True, blank=True)
+    user_email = models.CharField(max_length=255, null=True, blank=True)
+    receipt = models.CharField(max_length=255, null=True, blank=True)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    cost = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'user_email', 'receipt'], name='product_rollup_key'),
+            models.Index(fields=['product', 'date'], name='product_rollup_product'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product', 'user_email', 'receipt'], name='unique_product_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}: {self.revenue}"
+
+
+class DataVersion(models.Model):
+    """Counter per data set ('orders', 'products', 'expenses'), bumped after every committed write to it."""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+
+class InventoryValuation(models.Model):
+    """
+    Running stock valuation of the products of one category and supplier,
+    updated by every stock or price write. 0 stands for no category or
+    supplier, so the pair can be unique.
+    """
+    category_key = models.IntegerField(default=0)
+    supplier_key = models.IntegerField(default=0)
+    products = models.IntegerField(default=0)
+    units = models.BigIntegerField(default=0)
+    cost_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    retail_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['category_key', 'supplier_key'], name='unique_valuation_bucket')
+        ]
+
+    def __str__(self):
+        return f"{self.category_key}/{self.supplier_key}: {self.cost_value}"
+
+
+class SyncTombstone(models.Model):
+    """A deleted product, customer, category or supplier, kept so delta sync clients drop their copy."""
+    model_name = models.CharField(max_length=50)  # _meta.model_name of the deleted row
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model_name} {self.object_id} deleted at {self.deleted_at}"
+
+
+class ProductSearchToken(models.Model):
+    """
+    A search term of a product: a normalized word, prefix or trigram of its
+    name, specification, category or supplier, weighted by the field it
+    comes from. Kept current by the product signals, see search.py.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['token', 'product'], name='unique_product_search_token')
+        ]
+
+    def __str__(self):
+        return f"{self.token} {self.product_id}: {self.weight}"
+
+
+class JobSchedule(models.Model):
+    """Queues a job of `kind` every `interval` seconds, from next_run_at on (nightly maintenance)."""
+    name = models.CharField(max_length=100, unique=True)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    interval = models.PositiveIntegerField(default=86400)  # seconds
+    next_run_at = models.DateTimeField(db_index=True)
+    enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.kind}, every {self.interval}s)"
+
+
+class Job(models.Model):
+    """
+    A long-running operation (export, import, maintenance) queued for the
+    run_workers command instead of running in a request.
+    """
+    STATE_CHOICES = [
+        ('Queued', 'Queued'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed'),
+        ('Cancelled', 'Cancelled'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='Queued')
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    result = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)  # summary, e.g. the import report
+    result_path = models.CharField(max_length=500, null=True, blank=True)  # file under JOB_RESULT_DIR
+    result_name = models.CharField(max_length=255, null=True, blank=True)  # download file name
+    content_type = models.CharField(max_length=100, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    user = models.ForeignKey(UserAccount, on_delete=models.SET_NULL, related_name='jobs', null=True, blank=True)
+    schedule = models.ForeignKey(JobSchedule, on_delete=models.SET_NULL, related_name='jobs', null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=255, null=True, blank=True)  # host:pid of the run_workers process
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'run_after'], name='job_state_run_after'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id}: {self.state}"
 
 
 @receiver(pre_save, sender=OrderItem)
@@ -266,15 +594,6 @@ def set_order_item_cost(sender, instance, **kwargs):
     instance.cost = instance.get_cost()
 
 
-@receiver(post_save, sender=OrderItem)
-def update_order_status_if_all_items_status_cancelled(sender, instance, **kwargs):
-    # Check if the associated order has no items with status 'Done'
-    order = instance.order
-    items = order.items.all()
-    if items.exists() and items.filter(status='Cancelled').count() == items.count():
-        order.status = 'Cancelled'
-        order.save()
-
 @receiver(post_save, sender=Order)
 def update_order_items_status_on_order_update(sender, instance, **kwargs):
     """
@@ -300,96 +619,250 @@ def update_order_items_status_on_order_update(sender, instance, **kwargs):
         instance.save(update_fields=['sub_total', 'vat', 'total_amount', 'paid_amount', 'unpaid_amount', 'payment_status'])
         instance._updating = False  # Unset flag
 
-        items_to_update = []  # List to collect OrderItems for bulk update
-
-        for item_data in items_data:
-            product = item_data.product  # Access related product
-            receipt = item_data.item_receipt  # Access receipt type
-            quantity = item_data.quantity  # Access quantity
-            package = item_data.package  # Access package
-
-
-            if item_data.status != 'Cancelled':  # Check if item is not already cancelled
-                product.stock += item_data.quantity  # Restock the product
-                item_data.quantity = 0 
+        from .stock import StockBatch
+
+        with transaction.atomic():
+            items_to_update = [item for item in items_data if item.status != 'Cancelled']  # Items still holding stock
+            if not items_to_update:
+                return
+
+            # Put everything back with one conditional UPDATE per product
+            batch = StockBatch(item.product_id for item in items_to_update if item.product_id)
+            for item_data in items_to_update:
+                package = item_data.package
+                if item_data.product_id:
+                    product = batch[item_data.product_id]
+                    returned_package = package if product.package is not None and package is not None else None
+                    batch.give_back(product.id, item_data.quantity, package=returned_package, receipt=item_data.item_receipt)
+                    if returned_package is not None:
+                        item_data.package = 0
+                item_data.quantity = 0
                 item_data.price = 0
-                item_data.unit_price = 0 
+                item_data.unit_price = 0
                 item_data.cost = 0
                 item_data.status = 'Cancelled'  # Mark item as cancelled
-                if product.package is not None and package is not None:
-                    product.package += package
-                    item_data.package = 0
-                if receipt == "Receipt":
-                    if product.receipt_no is not None:
-                        product.receipt_no += quantity
-                items_to_update.append(item_data)  # Collect for bulk update
 
-                # Save the updated product and order item
-                product.save()  # Save the updated product
-                # item_data.save()  # Save the updated order item but it causes the multiple save issue
+            batch.apply('Order Cancelled', order=instance)
+
+            # Bulk update all OrderItems at once
+            OrderItem.objects.bulk_update(items_to_update, ['quantity', 'status', 'price', 'unit_price', 'cost', 'package'])
+
+
+@receiver(post_save, sender=Order)
+def refresh_sales_rollup_on_order_save(sender, instance, created, raw=False, **kwargs):
+    # Registered after update_order_items_status_on_order_update, so a cancelled
+    # order is counted once its items are zeroed. A new order has no items yet,
+    # _place_order refreshes its rollup once they are written.
+    if created or raw or getattr(instance, '_updating', False):
+        return
+    from .rollups import refresh_order_rollups
+    refresh_order_rollups(instance)
+
+
+@receiver(post_delete, sender=Order)
+def refresh_sales_rollup_on_order_delete(sender, instance, **kwargs):
+    from .rollups import refresh_order_rollups
+    refresh_order_rollups(instance)
+
+
+# ------------------ Deferred order recomputation ------------------
+
+class DirtyOrderRegistry(threading.local):
+    """Orders whose items changed in the current transaction, per thread."""
+
+    def __init__(self):
+        self.order_ids = set()
+        self.suspended = 0
+
+
+dirty_orders = DirtyOrderRegistry()
+
+
+def mark_order_dirty(order_id):
+    """Queue an order for recomputation when the current transaction commits."""
+    if order_id is None:
+        return
+    dirty_orders.order_ids.add(order_id)
+    if not dirty_orders.suspended:
+        # Registering is just a list append; only the first callback to run
+        # finds work, so N item saves still cost one recompute.
+        transaction.on_commit(flush_dirty_orders)
+
+
+def flush_dirty_orders():
+    order_ids = dirty_orders.order_ids
+    if not order_ids:
+        return
+    dirty_orders.order_ids = set()
+    recompute_orders(order_ids)
+
+
+@contextmanager
+def suspend_order_signals():
+    """
+    Suspend the per-row OrderItem receivers during a bulk operation.
+    Item saves inside the block only record their order; every order touched
+    is recomputed once when the outermost block exits.
+    """
+    dirty_orders.suspended += 1
+    try:
+        yield
+    finally:
+        dirty_orders.suspended -= 1
+        if not dirty_orders.suspended and dirty_orders.order_ids:
+            transaction.on_commit(flush_dirty_orders)
+
+
+def recompute_orders(order_ids):
+    """Recompute totals, item counts and status with one aggregate query for all orders."""
+    orders = Order.objects.filter(pk__in=order_ids).annotate(
+        items_total=Sum('items__price'),
+        items_count=Count('items'),
+        items_pending=Count('items', filter=Q(items__status='Pending')),
+        items_done=Count('items', filter=Q(items__status='Done')),
+        items_cancelled=Count('items', filter=Q(items__status='Cancelled')),
+    )
+    with transaction.atomic():
+        for order in orders:
+            old_status = order.status
+            order.calculate_totals(order.items_total)
+            order.apply_item_counts(
+                count=order.items_count,
+                pending=order.items_pending,
+                done=order.items_done,
+                cancelled=order.items_cancelled,
+            )
+
+            # Handle payment status
+            if order.payment_status == 'Paid':
+                order.paid_amount = order.total_amount
+            else:
+                order.unpaid_amount = order.total_amount - (order.paid_amount or 0)
+
+            if order.status == 'Cancelled' and old_status != 'Cancelled':
+                # Full save so update_order_items_status_on_order_update resets the order
+                order.save()
+            else:
+                order.save(update_fields=[
+                    'sub_total', 'vat', 'total_amount', 'paid_amount', 'unpaid_amount',
+                    'number_of_items', 'item_pending', 'status',
+                ])
 
-        # Bulk update all OrderItems at once
-        OrderItem.objects.bulk_update(items_to_update, ['quantity', 'status', 'price', 'unit_price', 'cost', 'package'])
 
 @receiver([post_save, post_delete], sender=OrderItem)
-def update_order_item_pending_count(sender, instance, **kwargs):
-    order = instance.order
-    items = order.items.all()
-    pending_count = items.filter(status='Pending').count()
-    done_exists = items.filter(status='Done').exists()
-
-    if items.count() == 1 and items.first().status == 'Pending':
-        order.item_pending = 0
-        order.status = "Pending"
-    elif items.count() > 1:
-        if done_exists:
-            order.item_pending = pending_count
-        elif not done_exists and items.exists() and items.filter(status='Pending').count() == items.count():
-            order.item_pending = 0
-            order.status = "Pending"
-    else:
-        order.item_pending = 0  # No items at all
-
-    order.save(update_fields=['item_pending', 'status'])
+def mark_order_dirty_on_item_change(sender, instance, **kwargs):
+    mark_order_dirty(instance.order_id)
+
 
+# ------------------ Result cache invalidation ------------------
 
+@receiver([post_save, post_delete], sender=Order)
 @receiver([post_save, post_delete], sender=OrderItem)
-def update_order_totals(sender, instance, **kwargs):
-    order = instance.order
-    order.sub_total = order.get_sub_total_price()
-
-    # Handle VAT and total_amount based on receipt type
-    if order.receipt == 'Receipt':
-        if order.vat_type == 'Exclusive':
-            order.vat = order.sub_total * Decimal('0.15')
-            order.total_amount = order.sub_total + order.vat
-        elif order.vat_type == 'Inclusive':
-            print("This is It.")
-            order.total_amount = order.get_sub_total_price()  # Total including VAT
-            order.sub_total = order.total_amount / (1 + Decimal('0.15'))  # Pre-VAT amount
-            order.vat = order.total_amount - order.sub_total  # VAT amount
-        else:
-            order.vat = 0
-            order.total_amount = order.sub_total
-    else:
-        order.vat = 0
-        order.total_amount = order.sub_total
+def bump_orders_version(sender, **kwargs):
+    from .result_cache import bump_data_version
+    bump_data_version('orders')
 
-    # Handle payment status
-    if order.payment_status == 'Paid':
-        order.paid_amount = order.total_amount
-    else:
-        order.unpaid_amount = order.total_amount - order.paid_amount
 
-    # Save only once, with update_fields to avoid unnecessary recalculations
-    order.save(update_fields=['sub_total', 'vat', 'total_amount', 'paid_amount', 'unpaid_amount'])
+@receiver([post_save, post_delete], sender=Product)
+def bump_products_version(sender, **kwargs):
+    from .result_cache import bump_data_version
+    bump_data_version('products')
 
 
-@receiver([post_save, post_delete], sender=OrderItem)
-def update_order_item_count(sender, instance, **kwargs):
-    order = instance.order
-    items = order.items.all()
-    items_count = items.all().count()
-    order.number_of_items = items_count
-    order.save(update_fields=['number_of_items'])
+@receiver([post_save, post_delete], sender=OtherExpenses)
+def bump_expenses_version(sender, **kwargs):
+    from .result_cache import bump_data_version
+    bump_data_version('expenses')
+
+
+# ------------------ Inventory valuation ------------------
+
+@receiver(post_save, sender=Product)
+def revalue_product_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .valuation import revalue_product
+    revalue_product(instance, created)
+
+
+@receiver(post_delete, sender=Product)
+def revalue_product_on_delete(sender, instance, **kwargs):
+    from .valuation import remove_product
+    remove_product(instance)
+
+
+@receiver(post_delete, sender=Category)
+def revalue_category_on_delete(sender, instance, **kwargs):
+    # Its products were set to no category with a queryset update
+    from .valuation import merge_bucket
+    merge_bucket(category_key=instance.pk)
+
+
+@receiver(post_delete, sender=Supplier)
+def revalue_supplier_on_delete(sender, instance, **kwargs):
+    from .valuation import merge_bucket
+    merge_bucket(supplier_key=instance.pk)
+
+
+# ------------------ Delta sync ------------------
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=CustomerInfo)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Supplier)
+def record_sync_tombstone(sender, instance, **kwargs):
+    SyncTombstone.objects.create(model_name=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Supplier)
+def touch_products_on_delete(sender, instance, **kwargs):
+    # SET_NULL then clears the products' category or supplier with a queryset update, which
+    # leaves updated_at alone: stamp them now so delta sync sends them again
+    from .result_cache import bump_data_version
+    field = 'category' if sender is Category else 'supplier'
+    if Product.objects.filter(**{field: instance}).update(updated_at=timezone.now()):
+        bump_data_version('products')
+
+
+# ------------------ Product search ------------------
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .search import index_product
+    index_product(instance, created)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Supplier)
+def reindex_products_on_rename(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Their products are found by the category and supplier name too
+    if created or raw:
+        instance._search_name = instance.name
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    if '_search_name' in instance.__dict__ and instance._search_name == instance.name:
+        return
+    from .search import reindex_products
+    field = 'category' if sender is Category else 'supplier'
+    reindex_products(Product.objects.filter(**{field: instance}))
+    instance._search_name = instance.name
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Supplier)
+def remember_products_on_delete(sender, instance, **kwargs):
+    # SET_NULL clears the products' field before post_delete, note which they were
+    field = 'category' if sender is Category else 'supplier'
+    instance._product_ids = list(Product.objects.filter(**{field: instance}).values_list('id', flat=True))
+
 
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Supplier)
+def reindex_products_on_delete(sender, instance, **kwargs):
+    from .search import reindex_products
+    if getattr(instance, '_product_ids', None):
+        reindex_products(Product.objects.filter(id__in=instance._product_ids))
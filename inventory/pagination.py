@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+COUNT_MODES = ('none', 'exact', 'cached', 'approximate')
+
+
+class Pagination(PageNumberPagination):
+    page_size = 10  # default items per page
+    page_size_query_param = 'page_size'  # allow client to override
+    max_page_size = 100
+
+
+def wants_cursor(request):
+    return 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+
+def list_paginator(request):
+    """Keyset pages when the client sends ?pagination=cursor (then the cursor of the next links), page numbers otherwise."""
+    return KeysetPagination() if wants_cursor(request) else Pagination()
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages walked with an opaque cursor that holds the ordering values of the
+    row before it. A page is one range read on the ordering's index, as cheap
+    on page 1000 as on page 1: no OFFSET, and no COUNT(*) unless asked for.
+
+    The ordering fields can't be null and the last one must be unique.
+    Views set `cursor_orderings` ({name: fields}, the first is the default)
+    to offer more than '-id', picked with ?ordering=.
+
+    ?count=exact|cached|approximate adds the total: cached keeps the exact
+    count for PAGINATION_COUNT_TIMEOUT seconds, approximate reads MySQL's
+    row estimate for an unfiltered table (else falls back to cached).
+    """
+    page_size = Pagination.page_size
+    page_size_query_param = 'page_size'
+    max_page_size = Pagination.max_page_size
+    cursor_query_param = 'cursor'
+    cursor_orderings = {'-id': ('-id',)}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        orderings = getattr(view, 'cursor_orderings', None) or self.cursor_orderings
+        name = request.query_params.get('ordering') or next(iter(orderings))
+        if name not in orderings:
+            raise ParseError(f"ordering must be one of {', '.join(orderings)}.")
+        self.ordering = orderings[name]
+        self.page_size = self.get_page_size(request)
+        self.count_mode = request.query_params.get('count', 'none')
+        if self.count_mode not in COUNT_MODES:
+            raise ParseError(f"count must be one of {', '.join(COUNT_MODES)}.")
+        self.count = self.count_type = None
+        if self.count_mode != 'none':
+            self.count, self.count_type = page_count(queryset, self.count_mode)
+
+        values, backwards = self.decode_cursor(request)
+        ordering = [flip(field) for field in self.ordering] if backwards else list(self.ordering)
+        if values is not None:
+            queryset = queryset.filter(after(ordering, values))
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+
+        # A page reached going forward has rows before it, one reached going back has rows after it
+        self.has_next = more if not backwards else values is not None
+        self.has_previous = values is not None if not backwards else more
+        self.first = self.position(rows[0]) if rows else None
+        self.last = self.position(rows[-1]) if rows else None
+        if not rows and values is not None:
+            # Past either end: the next (or previous) page starts where this one was asked for
+            self.first = self.last = values
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def position(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, backwards = data['v'], bool(data.get('b'))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+        except (ValueError, TypeError, KeyError):
+            raise NotFound("Invalid cursor.")
+        return values, backwards
+
+    def encode_cursor(self, values, backwards):
+        data = {'v': values, 'b': 1} if backwards else {'v': values}
+        cursor = base64.urlsafe_b64encode(json.dumps(data, default=cursor_value, separators=(',', ':')).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.encode_cursor(self.last, False) if self.has_next else None
+
+    def get_previous_link(self):
+        return self.encode_cursor(self.first, True) if self.has_previous else None
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count_type is not None:
+            response.update({'count': self.count, 'count_type': self.count_type})
+        response.update({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
+        return Response(response)
+
+
+class ListPagination(BasePagination):
+    """pagination_class for generic list views: list_paginator() picked per request."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = list_paginator(request)
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+
+def cursor_value(value):
+    # Full precision: DjangoJSONEncoder cuts datetimes to milliseconds, which would skip or repeat rows
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def after(ordering, values):
+    """Rows after `values` in `ordering`: (a > x) or (a = x and b > y) ... spelled for any number of fields."""
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {ordering[j].lstrip('-'): values[j] for j in range(i)}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    return condition
+
+
+def page_count(queryset, mode):
+    """(total, how it was counted) of a list for ?count=."""
+    queryset = queryset.order_by()
+    if mode == 'approximate':
+        estimate = estimated_rows(queryset)
+        if estimate is not None:
+            return estimate, 'approximate'
+    if mode == 'exact':
+        return queryset.count(), 'exact'
+
+    cache = caches[getattr(settings, 'RESULT_CACHE_ALIAS', 'default')]
+    sql, params = queryset.query.sql_with_params()
+    key = f"count:{hashlib.sha1(json.dumps([sql, params], default=str).encode()).hexdigest()}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_TIMEOUT', 60))
+    return count, 'cached'
+
+
+def estimated_rows(queryset):
+    """MySQL's row estimate of an unfiltered table (what SHOW TABLE STATUS shows), or None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else None
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.db.models import F, Sum
+
+from user.models import UserAccount
+from .models import ProductSalesDailyRollup, SalesDailyRollup
+
+
+CENTS = Decimal('0.01')
+
+# group by field and name field on ProductSalesDailyRollup
+BREAKDOWNS = {
+    'product': ('product', 'product__name'),
+    'category': ('product__category', 'product__category__name'),
+    'supplier': ('product__supplier', 'product__supplier__name'),
+    'salesperson': ('user_email', None),
+}
+
+
+def margin(revenue, cogs):
+    revenue = Decimal(revenue or 0)
+    cogs = Decimal(cogs or 0)
+    gross_margin = revenue - cogs
+    return {
+        "revenue": revenue.quantize(CENTS),
+        "cogs": cogs.quantize(CENTS),
+        "gross_margin": gross_margin.quantize(CENTS),
+        "margin_percent": (gross_margin * 100 / revenue).quantize(CENTS) if revenue else None,
+    }
+
+
+def in_range(rollups, start=None, end=None):
+    if start is not None:
+        rollups = rollups.filter(date__gte=start)
+    if end is not None:
+        rollups = rollups.filter(date__lte=end)
+    return rollups
+
+
+def profit_report(start=None, end=None, by=None):
+    """
+    Revenue (net of VAT), cost of goods sold and gross margin of the paid,
+    done orders between two dates (inclusive, open ended when None), read
+    from the sales rollups with one grouped query.
+
+    `by` breaks the figures down by product, category, supplier or
+    salesperson; the totals are then the sum of the rows.
+    """
+    if by is None:
+        totals = in_range(SalesDailyRollup.objects.filter(status='Done', payment_status='Paid'), start, end).aggregate(
+            revenue=Sum('revenue'), vat=Sum('vat'), cogs=Sum('cost'),
+        )
+        vat = Decimal(totals['vat'] or 0)
+        return {"totals": {**margin(Decimal(totals['revenue'] or 0) - vat, totals['cogs']), "vat": vat.quantize(CENTS)}, "results": []}
+
+    key, name = BREAKDOWNS[by]
+    if by == 'salesperson':
+        rollups = SalesDailyRollup.objects.filter(status='Done', payment_status='Paid')
+        revenue = Sum(F('revenue') - F('vat'))
+    else:
+        rollups = ProductSalesDailyRollup.objects.all()
+        revenue = Sum('revenue')
+    rows = list(in_range(rollups, start, end).values(key, *([name] if name else [])).annotate(
+        revenue_total=revenue, cogs_total=Sum('cost'),
+    ).order_by())
+
+    if by == 'salesperson':
+        names = dict(UserAccount.objects.filter(email__in=[row[key] for row in rows]).values_list('email', 'name'))
+    results = [
+        {
+            "key": row[key],
+            "name": row[name] if name else names.get(row[key], row[key]),
+            **margin(row['revenue_total'], row['cogs_total']),
+        }
+        for row in rows
+    ]
+    results.sort(key=lambda row: row['gross_margin'], reverse=True)
+    totals = margin(sum(row['revenue'] for row in results), sum(row['cogs'] for row in results))
+    return {"totals": totals, "results": results}
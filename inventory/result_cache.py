@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from .models import DataVersion
+
+
+MISSING = object()
+
+
+class PendingVersions(threading.local):
+    """Data sets written in the current transaction, per thread."""
+
+    def __init__(self):
+        self.names = set()
+
+
+pending = PendingVersions()
+
+
+def bump_data_version(*names):
+    """
+    Invalidate every cached result built from these data sets once the
+    current transaction commits. Bumping after the commit keeps the counter
+    row out of the write's locks; a reader reads the version before the data,
+    so it can never store old data under the new version.
+    """
+    pending.names.update(names)
+    transaction.on_commit(flush_data_versions)
+
+
+def flush_data_versions():
+    names = pending.names
+    if not names:
+        return
+    pending.names = set()
+    if DataVersion.objects.filter(name__in=names).update(version=F('version') + 1) == len(names):
+        return
+    # The migration creates the usual counters, this only runs for a new data set
+    existing = set(DataVersion.objects.filter(name__in=names).values_list('name', flat=True))
+    for name in names - existing:
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(name=name, version=1)
+        except IntegrityError:
+            # Another process created it first
+            DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def get_data_versions(names):
+    versions = dict(DataVersion.objects.filter(name__in=names).values_list('name', 'version'))
+    return [versions.get(name, 0) for name in names]
+
+
+class ResultCacheStats:
+    """Hits, misses and bypasses per endpoint, for this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(lambda: {"hits": 0, "misses": 0, "bypassed": 0})
+
+    def add(self, endpoint, counter):
+        with self.lock:
+            self.counts[endpoint][counter] += 1
+
+    def as_dict(self):
+        with self.lock:
+            stats = {}
+            for endpoint, counts in sorted(self.counts.items()):
+                lookups = counts["hits"] + counts["misses"]
+                stats[endpoint] = {**counts, "hit_ratio": round(counts["hits"] / lookups, 3) if lookups else None}
+            return stats
+
+
+stats = ResultCacheStats()
+
+
+def is_bypassed(request):
+    # ?nocache=1 or Cache-Control: no-cache recomputes the result, for debugging
+    return (
+        request.query_params.get('nocache') in ('1', 'true')
+        or 'no-cache' in request.headers.get('Cache-Control', '')
+    )
+
+
+def cached_result(request, endpoint, params, depends_on, compute):
+    """
+    Return compute() for an analytics endpoint, cached in Django's cache
+    under the endpoint, its parameters and the current versions of the data
+    sets it reads (`depends_on`). Any committed write to one of those data
+    sets changes the key, so a stale result is never served.
+    """
+    if not getattr(settings, 'RESULT_CACHE_ENABLED', True) or is_bypassed(request):
+        stats.add(endpoint, "bypassed")
+        return compute()
+
+    versions = get_data_versions(depends_on)
+    raw = json.dumps([params, list(depends_on), versions], sort_keys=True, default=str)
+    key = f"result:{endpoint}:{hashlib.sha1(raw.encode()).hexdigest()}"
+    cache = caches[getattr(settings, 'RESULT_CACHE_ALIAS', 'default')]
+
+    result = cache.get(key, MISSING)
+    if result is not MISSING:
+        stats.add(endpoint, "hits")
+        return result
+    stats.add(endpoint, "misses")
+    result = compute()
+    cache.set(key, result, getattr(settings, 'RESULT_CACHE_TIMEOUT', 300))
+    return result
@@ -0,0 +1,293 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DateField, Max, Min, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductSalesDailyRollup, SalesDailyRollup, SalesRollupKey, VAT_RATE
+from .result_cache import bump_data_version
+
+
+GROUP_FIELDS = ('user_email', 'receipt', 'status', 'payment_status')
+CENTS = Decimal('0.01')
+
+
+def business_date(when):
+    return timezone.localtime(when).date()
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def sales_key(order_date, user_email, receipt):
+    if order_date is None:
+        return None
+    return (business_date(order_date), user_email, receipt)
+
+
+def net_of_vat(amount, receipt, vat_type):
+    # Item prices of VAT inclusive receipts contain the VAT, the others don't
+    if receipt == 'Receipt' and vat_type == 'Inclusive':
+        return amount / (1 + VAT_RATE)
+    return amount
+
+
+def build_rollups(orders):
+    """
+    SalesDailyRollup and ProductSalesDailyRollup rows for a queryset of
+    orders, from two grouped queries.
+    """
+    tz = timezone.get_current_timezone()
+    rows = {}
+    totals = orders.annotate(day=TruncDate('order_date', tzinfo=tz)).values('day', *GROUP_FIELDS).annotate(
+        revenue=Sum('total_amount'),
+        vat_total=Sum('vat'),
+        order_count=Count('id'),
+    )
+    for row in totals:
+        key = (row['day'], *(row[field] for field in GROUP_FIELDS))
+        rows[key] = SalesDailyRollup(
+            date=row['day'],
+            **{field: row[field] for field in GROUP_FIELDS},
+            revenue=row['revenue'] or 0,
+            vat=row['vat_total'] or 0,
+            cost=0,
+            orders=row['order_count'],
+            items=0,
+        )
+
+    product_rows = {}
+    items = OrderItem.objects.filter(order__in=orders).annotate(day=TruncDate('order__order_date', tzinfo=tz))
+    items = items.values('day', *(f'order__{field}' for field in GROUP_FIELDS), 'order__vat_type', 'product').annotate(
+        item_count=Count('id', filter=~Q(status='Cancelled')),
+        quantity_total=Sum('quantity', filter=~Q(status='Cancelled')),
+        price_total=Sum('price'),
+        cost_total=Sum('cost'),
+    )
+    for row in items:
+        group = {field: row[f'order__{field}'] for field in GROUP_FIELDS}
+        rollup = rows.get((row['day'], *group.values()))
+        if rollup is not None:
+            rollup.items += row['item_count']
+            rollup.cost += row['cost_total'] or 0
+
+        if group['status'] != 'Done' or group['payment_status'] != 'Paid' or not row['item_count']:
+            continue
+        key = (row['day'], row['product'], group['user_email'], group['receipt'])
+        product_rollup = product_rows.get(key)
+        if product_rollup is None:
+            product_rollup = product_rows[key] = ProductSalesDailyRollup(
+                date=row['day'],
+                product_id=row['product'],
+                user_email=group['user_email'],
+                receipt=group['receipt'],
+                quantity=0,
+                revenue=0,
+                cost=0,
+            )
+        product_rollup.quantity += row['quantity_total'] or 0
+        product_rollup.revenue += net_of_vat(row['price_total'] or 0, group['receipt'], row['order__vat_type'])
+        product_rollup.cost += row['cost_total'] or 0
+    for product_rollup in product_rows.values():
+        product_rollup.revenue = Decimal(product_rollup.revenue).quantize(CENTS)
+    return list(rows.values()), list(product_rows.values())
+
+
+def sync_rows(model, existing, rows, key_fields, value_fields):
+    """
+    Make the stored rows match `rows`, writing only the rows that changed.
+    A busy day has many product rows and one order only changes a few.
+    """
+    stored = {tuple(getattr(row, field) for field in key_fields): row for row in existing}
+
+    new = []
+    changed = []
+    for row in rows:
+        old = stored.pop(tuple(getattr(row, field) for field in key_fields), None)
+        if old is None:
+            new.append(row)
+        elif any(getattr(old, field) != getattr(row, field) for field in value_fields):
+            for field in value_fields:
+                setattr(old, field, getattr(row, field))
+            changed.append(old)
+    stale = [row.pk for row in stored.values()]
+
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+    if changed:
+        model.objects.bulk_update(changed, value_fields)
+    if new:
+        model.objects.bulk_create(new)
+
+
+def lock_sales_keys(keys):
+    """
+    Lock the SalesRollupKey rows of (date, user_email, receipt) keys until
+    the transaction ends, creating the missing ones. The upsert takes the
+    row lock even when the row exists (a plain insert that hits a duplicate
+    only takes a shared one, and two of those deadlock on the way up), and
+    rows are locked in key order so writers of several keys can't deadlock.
+    """
+    keys = sorted({(day, user_email or '', receipt or '') for day, user_email, receipt in keys})
+    if not keys:
+        return
+    unique_fields = ['date', 'user_email', 'receipt'] if connection.features.supports_update_conflicts_with_target else None
+    SalesRollupKey.objects.bulk_create(
+        [SalesRollupKey(date=day, user_email=user_email, receipt=receipt) for day, user_email, receipt in keys],
+        update_conflicts=True, update_fields=['date'], unique_fields=unique_fields,
+    )
+    condition = Q()
+    for day, user_email, receipt in keys:
+        condition |= Q(date=day, user_email=user_email, receipt=receipt)
+    list(SalesRollupKey.objects.filter(condition).order_by('date', 'user_email', 'receipt').select_for_update().values_list('id'))
+
+
+def refresh_sales_rollups(keys):
+    """
+    Recount the sales and product rollup rows of the given (date, user_email,
+    receipt) keys from their orders, inside the caller's transaction. Only
+    the orders of those days are read, so the cost does not grow with the
+    order history.
+
+    The keys are locked first: a concurrent checkout of the same key waits,
+    then reads the orders committed meanwhile (the connection runs READ
+    COMMITTED) and counts them too instead of overwriting them.
+    """
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return
+    orders = Q()
+    rollups = Q()
+    for day, user_email, receipt in keys:
+        orders |= Q(order_date__gte=day_start(day), order_date__lt=day_start(day + timedelta(days=1)), user_email=user_email, receipt=receipt)
+        rollups |= Q(date=day, user_email=user_email, receipt=receipt)
+
+    # No savepoint: if the rollup can't be written the order write fails with it
+    with transaction.atomic(savepoint=False):
+        lock_sales_keys(keys)
+        rows, product_rows = build_rollups(Order.objects.filter(orders))
+        sync_rows(
+            SalesDailyRollup, SalesDailyRollup.objects.filter(rollups), rows,
+            ('date', *GROUP_FIELDS), ['revenue', 'vat', 'cost', 'orders', 'items'],
+        )
+        sync_rows(
+            ProductSalesDailyRollup, ProductSalesDailyRollup.objects.filter(rollups), product_rows,
+            ('date', 'product_id', 'user_email', 'receipt'), ['quantity', 'revenue', 'cost'],
+        )
+
+
+def refresh_order_rollups(order):
+    """Refresh the rollup an order is counted in, and the one it was counted in before an edit."""
+    keys = {sales_key(order.order_date, order.user_email, order.receipt)}
+    if getattr(order, '_sales_key', None):
+        keys.add(sales_key(*order._sales_key))
+    refresh_sales_rollups(keys)
+    order._sales_key = (order.order_date, order.user_email, order.receipt)
+
+
+def rebuild_sales_rollups(start=None, end=None, days=31):
+    """
+    Recompute both rollups from the orders between start and end (dates,
+    inclusive), `days` days per transaction. Yields each chunk's first day and
+    row count. Without a range the whole table is rebuilt.
+    """
+    full = start is None and end is None
+    if start is None or end is None:
+        bounds = Order.objects.aggregate(first=Min('order_date'), last=Max('order_date'))
+        if bounds['first'] is None:
+            SalesDailyRollup.objects.all().delete()
+            ProductSalesDailyRollup.objects.all().delete()
+            return
+        start = start or business_date(bounds['first'])
+        end = end or business_date(bounds['last'])
+    if full:
+        SalesDailyRollup.objects.filter(Q(date__lt=start) | Q(date__gt=end)).delete()
+        ProductSalesDailyRollup.objects.filter(Q(date__lt=start) | Q(date__gt=end)).delete()
+
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=days - 1), end)
+        with transaction.atomic():
+            orders = Order.objects.filter(order_date__gte=day_start(day), order_date__lt=day_start(last + timedelta(days=1)))
+            dated = orders.annotate(day=TruncDate('order_date', tzinfo=timezone.get_current_timezone())).order_by()
+            keys = set(dated.values_list('day', 'user_email', 'receipt').distinct())
+            keys.update(SalesRollupKey.objects.filter(date__gte=day, date__lte=last).values_list('date', 'user_email', 'receipt'))
+            lock_sales_keys(keys)
+            SalesDailyRollup.objects.filter(date__gte=day, date__lte=last).delete()
+            ProductSalesDailyRollup.objects.filter(date__gte=day, date__lte=last).delete()
+            rows, product_rows = build_rollups(orders)
+            SalesDailyRollup.objects.bulk_create(rows, batch_size=1000)
+            ProductSalesDailyRollup.objects.bulk_create(product_rows, batch_size=1000)
+        bump_data_version('orders')
+        yield day, len(rows) + len(product_rows)
+        day = last + timedelta(days=1)
+
+
+BUCKETS = ('day', 'week', 'month', 'year')
+GROUP_BY = {'user': 'user_email', 'receipt': 'receipt', 'payment_status': 'payment_status'}
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())  # Weeks start on Monday, like TruncWeek
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, bucket):
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    if bucket == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if bucket == 'year':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def bucket_starts(start, end, bucket):
+    periods = []
+    period = bucket_start(start, bucket)
+    while period <= end:
+        periods.append(period)
+        period = next_bucket(period, bucket)
+    return periods
+
+
+def sales_series(start, end, bucket='day', group_by=None, user_email=None):
+    """
+    Sales of done orders between two dates (inclusive) per bucket, from one
+    GROUP BY query on the rollup. Only paid orders count, unless the series
+    is grouped by payment status.
+
+    Returns {group: [(period start, sales, orders), ...]} with a point for
+    every bucket in the range; the group is None without group_by.
+    """
+    rollups = SalesDailyRollup.objects.filter(date__gte=start, date__lte=end, status='Done')
+    if group_by != 'payment_status':
+        rollups = rollups.filter(payment_status='Paid')
+    if user_email is not None:
+        rollups = rollups.filter(user_email=user_email)
+
+    field = GROUP_BY.get(group_by)
+    rows = rollups.annotate(period=Trunc('date', bucket, output_field=DateField())).values(
+        'period', *([field] if field else [])
+    ).annotate(sales=Sum('revenue'), order_count=Sum('orders')).order_by()
+
+    found = defaultdict(dict)
+    for row in rows:
+        found[row[field] if field else None][row['period']] = (row['sales'] or 0, row['order_count'] or 0)
+    if not field:
+        found.setdefault(None, {})
+
+    periods = bucket_starts(start, end, bucket)
+    return {
+        group: [(period, *points.get(period, (0, 0))) for period in periods]
+        for group, points in found.items()
+    }
@@ -0,0 +1,141 @@
+import math
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Category, Product, ProductSearchToken, Supplier
+
+
+GRAM = 3
+MAX_WORD = 60  # Longer words are cut, the token column holds 64 characters
+MAX_RESULTS = 500
+# Share of a query's grams a product must have, so a typo still finds it
+MIN_MATCH = 0.6
+CHUNK_SIZE = 1000
+
+SEARCH_FIELDS = ('name', 'specification', 'category_id', 'supplier_id')
+# field: weight of its terms; a whole word counts twice
+FIELD_WEIGHTS = {'name': 8, 'specification': 4, 'category': 2, 'supplier': 2}
+
+
+def search_state(product):
+    """The fields the index reads, or None when one was deferred."""
+    fields = product.__dict__
+    if any(field not in fields for field in SEARCH_FIELDS):
+        return None
+    return tuple(fields[field] for field in SEARCH_FIELDS)
+
+
+def normalize(text):
+    """
+    Case-folded, compatibility-normalized text without accents, so 'Café',
+    'CAFE' and 'ｃａｆｅ' match. Ethiopic syllables have no decomposition
+    and stay as they are.
+    """
+    text = unicodedata.normalize('NFKD', str(text)).casefold()
+    return unicodedata.normalize('NFC', ''.join(char for char in text if not unicodedata.combining(char)))
+
+
+def words(text):
+    # \w covers the Ethiopic script; its word space (፡) and full stop (።) separate words
+    return [word[:MAX_WORD] for word in re.findall(r'\w+', normalize(text))]
+
+
+def word_terms(word):
+    """(term, factor) of a word: itself, its 1 and 2 letter prefixes and its trigrams."""
+    yield f'w:{word}', 2
+    for length in (1, 2):
+        if len(word) >= length:
+            yield f'p:{word[:length]}', 1
+    for i in range(len(word) - GRAM + 1):
+        yield f'g:{word[i:i + GRAM]}', 1
+
+
+def product_terms(name, specification=None, category=None, supplier=None):
+    """{term: weight} of a product, the heaviest field wins when two share a term."""
+    terms = {}
+    for field, text in (('name', name), ('specification', specification), ('category', category), ('supplier', supplier)):
+        if not text:
+            continue
+        for word in words(text):
+            for term, factor in word_terms(word):
+                weight = FIELD_WEIGHTS[field] * factor
+                if weight > terms.get(term, 0):
+                    terms[term] = weight
+    return terms
+
+
+def query_terms(query):
+    """(grams, whole words, grams a match needs) of a search query."""
+    grams = set()
+    exact = set()
+    for word in words(query):
+        exact.add(f'w:{word}')
+        if len(word) < GRAM:
+            grams.add(f'p:{word}')  # A short word is matched as a prefix
+        else:
+            grams.update(f'g:{word[i:i + GRAM]}' for i in range(len(word) - GRAM + 1))
+    return grams, exact, max(1, math.ceil(MIN_MATCH * len(grams)))
+
+
+def search_products(query, limit=MAX_RESULTS):
+    """
+    Ids of the products matching `query`, best first: one grouped query on
+    the (token, product) index. A product matches with MIN_MATCH of the
+    query's grams; its score adds the weights of the terms it has, so whole
+    words and name matches rank above partial and category ones.
+    """
+    grams, exact, needed = query_terms(query)
+    if not grams:
+        return []
+    rows = ProductSearchToken.objects.filter(token__in=grams | exact).values('product_id').annotate(
+        matched=Count('id', filter=Q(token__in=grams)),
+        score=Sum('weight'),
+    ).filter(matched__gte=needed).order_by('-score', '-product_id')
+    return [row['product_id'] for row in rows[:limit]]
+
+
+def index_products(products):
+    """Rewrite the search terms of saved products, one delete and one insert."""
+    products = [product for product in products if product.pk is not None]
+    if not products:
+        return
+    categories = dict(Category.objects.filter(pk__in={product.category_id for product in products if product.category_id}).values_list('pk', 'name'))
+    suppliers = dict(Supplier.objects.filter(pk__in={product.supplier_id for product in products if product.supplier_id}).values_list('pk', 'name'))
+    rows = [
+        ProductSearchToken(product_id=product.pk, token=term, weight=weight)
+        for product in products
+        for term, weight in product_terms(
+            product.name, product.specification, categories.get(product.category_id), suppliers.get(product.supplier_id),
+        ).items()
+    ]
+    with transaction.atomic():
+        ProductSearchToken.objects.filter(product_id__in=[product.pk for product in products]).delete()
+        ProductSearchToken.objects.bulk_create(rows, batch_size=1000)
+    for product in products:
+        product._search_state = search_state(product)
+
+
+def index_product(product, created=False):
+    if created or getattr(product, '_search_state', None) != search_state(product):
+        index_products([product])
+
+
+def reindex_products(queryset, chunk_size=CHUNK_SIZE):
+    """Reindex the products of a queryset, `chunk_size` per transaction, walking the ids. Returns how many."""
+    queryset = queryset.only(*SEARCH_FIELDS).order_by('id')
+    total = 0
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        index_products(chunk)
+        total += len(chunk)
+        if len(chunk) < chunk_size:
+            return total
+        last_id = chunk[-1].id
+
+
+def rebuild_search_index(chunk_size=CHUNK_SIZE):
+    return reindex_products(Product.objects.all(), chunk_size)
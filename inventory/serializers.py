@@ -2,7 +2,8 @@ from rest_framework import serializers
 from .models import (
     Product, Supplier, Order, OrderItem, CustomerInfo,  
     Category, CompanyInfo, OrderLog, Report, ExpenseTypes, 
-    OtherExpenses, OrderPaymentLog, ProductLog
+    OtherExpenses, OrderPaymentLog, ProductLog, StockMovement, Job, VAT_RATE,
+    suspend_order_signals, mark_order_dirty
 )
 
 from django.db import transaction
@@ -11,12 +12,16 @@ from django.db.models import UniqueConstraint
 from user.models import UserAccount
 from user.serializers import UserSerializer
 from django.utils import timezone
-from .utils import create_order_log, create_order_report
+from django.urls import reverse
+from .utils import create_order_log, create_order_report, build_order_log, build_order_report
 from decimal import Decimal
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, Count, F, prefetch_related_objects
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from .utils import update_payment_status_on_new_expense_or_product
+from .utils import update_payment_status_on_new_expense_or_product, allocate_receipt_number
+from .stock import StockBatch, retry_on_deadlock, record_stock_change, stock_values, STOCK_FIELDS
+from .audit import audit
+from .rollups import refresh_order_rollups
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -64,6 +69,13 @@ class ProductGetSerializer(serializers.ModelSerializer):
             UniqueConstraint(fields=['name', 'category_name', 'specification'], name='unique_product_category_specification')
         ]
 
+class ProductSyncSerializer(serializers.ModelSerializer):
+    """The product as delta sync sends it: category and supplier by id, their names come with their own streams."""
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'category', 'description', 'package', 'piece', 'unit', 'buying_price', 'selling_price', 'receipt_no', 'specification', 'stock', 'supplier', 'image', 'user', 'updated_at']
+
 class ProductPostSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -103,10 +115,27 @@ class ProductPostSerializer(serializers.ModelSerializer):
         if user:
             validated_data['user'] = user.name
 
-        return super().create(validated_data)
+        with transaction.atomic():
+            product = super().create(validated_data)
+            record_stock_change(product, (None, None, None), 'Opening Balance', user=product.user)
+        return product
 
 
     def update(self, instance, validated_data):
+        user = validated_data.get('user')
+        user = getattr(user, 'name', user) or instance.user
+        with transaction.atomic():
+            # Work from the locked row so a checkout running at the same time is not overwritten
+            locked = Product.objects.select_for_update().get(pk=instance.pk)
+            for field in STOCK_FIELDS:
+                setattr(instance, field, getattr(locked, field))
+            instance._valuation = locked._valuation
+            before = stock_values(instance)
+            product = self._update_product(instance, validated_data)
+            record_stock_change(product, before, 'Product Update', user=user)
+        return product
+
+    def _update_product(self, instance, validated_data):
         update_package = validated_data.pop('package', None) # Get the number of packages to add
         piece = validated_data.pop('piece', instance.piece) # Get the number of pieces to add
         update_stocks = validated_data.pop('stock', None)  # Get the
@@ -140,24 +169,24 @@ class ProductPostSerializer(serializers.ModelSerializer):
                 validated_data['stock'] = stock  # Update the stock in validated_data
                 # 🔍 Log changes
                 if new_selling_price is not None and new_selling_price != old_selling_price:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Selling Price Change",
                         field_name="Selling Price",
                         old_value=old_selling_price,
                         new_value=new_selling_price,
                         user=instance.user  # Optional if available
-                    )
+                    ))
 
                 if update_stocks is not None and update_stocks != old_stock:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Stock Update",
                         field_name="Stock",
                         old_value=old_stock,
                         new_value=update_stocks,
                         user=instance.user
-                    )
+                    ))
             else:
                 stock_quantity = piece * update_package
                 module_stock = instance.stock % piece
@@ -168,24 +197,24 @@ class ProductPostSerializer(serializers.ModelSerializer):
                 validated_data['stock'] = stock  # Update the stock in validated_data
                 # 🔍 Log changes
                 if new_selling_price is not None and new_selling_price != old_selling_price:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Selling Price Change",
                         field_name="Selling Price",
                         old_value=old_selling_price,
                         new_value=new_selling_price,
                         user=instance.user  # Optional if available
-                    )
+                    ))
 
                 if update_stocks is not None and update_stocks != old_stock:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Stock Update",
                         field_name="Stock",
                         old_value=old_stock,
                         new_value=update_stocks,
                         user=instance.user
-                    )
+                    ))
            
         elif update_stocks is not None and instance.stock is not None:
             # If update_stocks is provided, update the stock directly
@@ -198,24 +227,24 @@ class ProductPostSerializer(serializers.ModelSerializer):
                 validated_data['stock'] = stock
                 # 🔍 Log changes
                 if new_selling_price is not None and new_selling_price != old_selling_price:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Selling Price Change",
                         field_name="Selling Price",
                         old_value=old_selling_price,
                         new_value=new_selling_price,
                         user=instance.user  # Optional if available
-                    )
+                    ))
 
                 if update_stocks is not None and update_stocks != old_stock:
-                    ProductLog.objects.create(
+                    audit.add(ProductLog(
                         product=instance,
                         change_type="Stock Update",
                         field_name="Stock",
                         old_value=old_stock,
                         new_value=update_stocks,
                         user=instance.user
-                    )
+                    ))
             else:
                stock = instance.stock + update_stocks
                if stock < 0:
@@ -223,47 +252,47 @@ class ProductPostSerializer(serializers.ModelSerializer):
                validated_data['stock'] = stock
                # 🔍 Log changes
                if new_selling_price is not None and new_selling_price != old_selling_price:
-                  ProductLog.objects.create(
+                  audit.add(ProductLog(
                         product=instance,
                         change_type="Selling Price Change",
                         field_name="Selling Price",
                         old_value=old_selling_price,
                         new_value=new_selling_price,
                         user=instance.user  # Optional if available
-                    )
+                    ))
 
                if update_stocks is not None and update_stocks != old_stock:
-                  ProductLog.objects.create(
+                  audit.add(ProductLog(
                         product=instance,
                         change_type="Stock Update",
                         field_name="Stock",
                         old_value=old_stock,
                         new_value=update_stocks,
                         user=instance.user
-                    )
+                    ))
 
         else:
             validated_data['stock'] = update_stocks if update_stocks is not None else instance.stock  # Use provided stock or keep existing 
             # 🔍 Log changes
             if new_selling_price is not None and new_selling_price != old_selling_price:
-                ProductLog.objects.create(
+                audit.add(ProductLog(
                     product=instance,
                     change_type="Selling Price Change",
                     field_name="Selling Price",
                     old_value=old_selling_price,
                     new_value=new_selling_price,
                     user=instance.user  # Optional if available
-                )
+                ))
 
             if update_stocks is not None and update_stocks != old_stock:
-                ProductLog.objects.create(
+                audit.add(ProductLog(
                     product=instance,
                     change_type="Stock Update",
                     field_name="Stock",
                     old_value=old_stock,
                     new_value=update_stocks,
                     user=instance.user
-                ) 
+                )) 
 
         
         # 🔍 Log changes
@@ -316,7 +345,23 @@ class CompanyInfoSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class OrderProductField(serializers.PrimaryKeyRelatedField):
+    """Resolve the product from the batch OrderSerializer loaded, falling back to a lookup."""
+
+    def to_internal_value(self, data):
+        products = self.context.get('order_products')
+        if products is not None and not isinstance(data, bool):
+            try:
+                product = products.get(int(data))
+            except (TypeError, ValueError):
+                product = None
+            if product is not None:
+                return product
+        return super().to_internal_value(data)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    product = OrderProductField(queryset=Product.objects.all(), allow_null=True, required=False)
     price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)  # Read-only
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_specification = serializers.CharField(source='product.specification', read_only=True)
@@ -345,23 +390,14 @@ class OrderItemSerializer(serializers.ModelSerializer):
             return "0"
         
 
+    @suspend_order_signals()
     def update(self, instance, validated_data):
         user = self.context['request'].user
         user_role = user.role
         user_name = user.name
-        # Update order fields directly
         new_quantity = validated_data.get('quantity')
         new_status = validated_data.get('status')
         new_package = validated_data.get('package')
-        new_unit_price = validated_data.get('unit_price')
-        product = instance.product  # Access the product from the existing order item
-        quantity = instance.quantity
-        receipt = instance.order.receipt  # Access the receipt from the order
-        package = instance.package
-        unit_price = instance.unit_price
-        piece = product.piece
-
-
 
         # If a salesman tries to cancel, set to Pending and raise error
         if new_status == 'Cancelled' and user_role == 'Salesman' or new_status == 'Cancelled' and user_role == 'Sales Manager':
@@ -406,83 +442,45 @@ class OrderItemSerializer(serializers.ModelSerializer):
                 "error": f"Package must be greater than zero."
             })
         
+        return retry_on_deadlock(self._change_item, instance, validated_data)
+
+    def _change_item(self, instance, validated_data):
+        new_quantity = validated_data.get('quantity')
+        new_status = validated_data.get('status')
+        new_package = validated_data.get('package')
+        new_unit_price = validated_data.get('unit_price')
+        receipt = instance.order.receipt
+
+        # Lock the product first, then re-read the line so two edits of the
+        # same item can't both start from the old quantity.
+        batch = StockBatch([instance.product_id])
+        instance.refresh_from_db(fields=['quantity', 'package', 'status', 'unit_price', 'price', 'cost'])
+        product = batch[instance.product_id]
+        instance.product = product
+        quantity = instance.quantity or 0
+        package = instance.package
+        unit_price = instance.unit_price
+        piece = product.piece
+
         if new_status:
-            if new_status == 'Cancelled':
-                product.stock += instance.quantity
+            if new_status == 'Cancelled' and instance.status != 'Cancelled':
+                returned_package = package if product.package is not None and package is not None else None
+                batch.give_back(product.id, quantity, package=returned_package, receipt=receipt)
                 instance.quantity = 0
                 instance.unit_price = 0
                 instance.product_price = 0
                 instance.price = 0
                 instance.cost = 0
-                instance.status = 'Cancelled' 
-                if product.package is not None and package is not None:
-                    product.package += package
+                instance.status = 'Cancelled'
+                if returned_package is not None:
                     instance.package = 0
-                if receipt == "Receipt":
-                    if product.receipt_no is not None:
-                        product.receipt_no += quantity
-                product.save()
-                instance.save()
             elif new_status == 'Done':
-                instance.status = 'Done' 
-                instance.save()
+                instance.status = 'Done'
 
         # updating if there is quantity
         if new_quantity and new_quantity > 0 and instance.status == 'Done':
-            # Calculate the difference between new and existing quantity
-            quantity_difference = new_quantity - quantity
-            instance.quantity = new_quantity
-
-            if product.stock >= quantity_difference:  # Ensure there is enough stock
-                # Reduce stock by the order quantity_difference
-
-                if receipt == "Receipt":
-                    if package:
-                        if product.package >= package:
-                            product.package -= package
-                            product.stock -= quantity_difference
-                            if product.receipt_no is not None:
-                                product.receipt_no -= quantity_difference
-                            product.save()  # Save the product instance
-                        elif product.package < package:
-                            # raise ValidationError("The amount of package is insufficient.")
-                            raise serializers.ValidationError({
-                                "error": f"The amount of package is insufficient."
-                            })
-                            
-                    elif package is None:
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - quantity_difference
-                        # remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                        # product.package = remaining_packages
-                        product.stock = remaining_stock
-                        if product.receipt_no is not None:
-                            product.receipt_no -= quantity_difference
-                        product.save()  # Save the product instance
-
-                elif receipt == "No Receipt":
-                    if package:
-                        if product.package >= package:
-                            product.package -= package
-                            product.stock -= quantity_difference
-                            product.save()  # Save the product instance
-                        elif product.package < package:
-                            raise serializers.ValidationError({
-                                    "error": f"The amount of package is insufficient."
-                                })
-                    elif package is None:
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - quantity_difference
-                        # remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                        # product.package = remaining_packages
-                        product.stock = remaining_stock
-                        product.save()  # Save the product instance
-                    
-            else:
-                raise serializers.ValidationError({
-                        "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                    })
-            # Update the instance's quantity
+            # Only the difference between new and existing quantity moves
+            batch.adjust(product.id, new_quantity - quantity, receipt=receipt)
             instance.quantity = new_quantity
 
             # The total price without VAT
@@ -496,74 +494,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
         # updating if there is package
         if new_package and new_package > 0 and instance.status == 'Done' and piece is not None:
-            # Calculate the difference between new and existing package
-            package_difference = new_package - package
-            print(f"package_difference: {package_difference}")
-            package_quantity_difference = package_difference * piece
-            print(f"package_quantity_difference: {package_quantity_difference}")
-            print(f"product stock: {product.stock}")
-            print(f"product package: {product.package}")
-            print(f"product package calculated: {product.package - package_difference}")
-            print(f"product stock calculated: {product.stock - package_quantity_difference}")
-            instance.quantity = package_quantity_difference
-
-            if product.stock >= package_quantity_difference:  # Ensure there is enough stock
-                # Reduce stock by the order package_difference
-
-                if receipt == "Receipt":
-                    if package:
-                        if product.package >= package_difference:
-                            product.package -= package_difference
-                            product.stock -= package_quantity_difference
-                            if product.receipt_no is not None:
-                                product.receipt_no -= package_quantity_difference
-                            instance.package = new_package
-                            instance.quantity = new_package * piece
-                            product.save()  # Save the product instance
-                        elif product.package < package_difference:
-                            raise serializers.ValidationError({
-                                "error": f"The amount of package is insufficient."
-                            })    
-                    elif package is None:
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - package_quantity_difference
-                        if piece:
-                            remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                            product.package = remaining_packages
-                        product.stock = remaining_stock
-                        if product.receipt_no is not None:
-                            product.receipt_no -= package_quantity_difference
-                        product.save()  # Save the product instance
-
-                elif receipt == "No Receipt":
-                    if package:
-                        if product.package >= package_difference:
-                            product.package -= package_difference
-                            product.stock -= package_quantity_difference
-                            instance.package = new_package
-                            instance.quantity = new_package * piece
-                            product.save()  # Save the product instance
-                        elif product.package < package_difference:
-                            raise serializers.ValidationError({
-                                "error": f"The amount of package is insufficient."
-                            })
-                    elif package is None:
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - package_quantity_difference
-                        remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                        product.package = remaining_packages
-                        product.stock = remaining_stock
-                        product.save()  # Save the product instance
-                    
-            else:
-                raise serializers.ValidationError({
-                        "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                    })
-            # Update the instance's quantity
-            # if new_quantity is not None:
-            #     instance.quantity = new_quantity
-            # elif new_package is not None:
-            #     instance.package = new_package
+            new_package_quantity = new_package * piece
+            package_difference = new_package - package if package else None
+            batch.adjust(product.id, new_package_quantity - quantity, package=package_difference, receipt=receipt)
+            instance.package = new_package
+            instance.quantity = new_package_quantity
 
             # The total price without VAT
             if unit_price > 0 and new_unit_price is None:
@@ -574,8 +509,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
             else:
                 instance.price = product.selling_price * instance.quantity
 
-
+        batch.check()
         instance.save()
+        reason = 'Item Cancelled' if instance.status == 'Cancelled' else 'Item Edit'
+        batch.apply(reason, order=instance.order, item=instance, user=self.context['request'].user.name)
 
         return instance
 
@@ -604,282 +541,157 @@ class OrderSerializer(serializers.ModelSerializer):
             'total_amount': {'read_only': True}, # Make 'total_amount' read-only
         }
     
-    def create(self, validated_data, user=None):
-        user = self.context["request"].user
-        if user:
-            validated_data['user'] = user.name
-            validated_data['user_email'] = user.email
-            validated_data['user_role'] = user.role
-
-        
+    def to_internal_value(self, data):
+        # Load every product on the order in one query so the nested item
+        # serializers don't hit the database once per line.
+        items = data.get('items') if hasattr(data, 'get') else None
+        if isinstance(items, list):
+            product_ids = set()
+            for item in items:
+                try:
+                    product_ids.add(int(item.get('product')))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+            self.context['order_products'] = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
+
+    def _place_order(self, validated_data, items_data, user):
         receipt = validated_data['receipt']
-
-        all_order = Order.objects.all().count()
-        receipt_order = Order.objects.filter(receipt="Receipt").count()
-        no_receipt_order = Order.objects.filter(receipt="No Receipt").count()
-        if receipt == "Receipt":
-            id = all_order - no_receipt_order
-            id = str(id).zfill(4)
-            validated_data['receipt_id'] = id
-        else:
-            validated_data['receipt_id'] = None
-
-
-
         payment_status = validated_data.get('payment_status', 'Paid')
         paid_amount = validated_data.get('paid_amount', 0)
 
-        new_payment_status = payment_status
-        new_paid_amount = paid_amount
-        
-
-        items_data = validated_data.pop('items')
-
-        
-
-        
-        # If we get here, all validations passed - create the order
-        with transaction.atomic():
-            
-            # First validate all items before creating anything
-            for item_data in items_data:
-                product = item_data['product']
-                if product.stock is None:
-                    raise serializers.ValidationError({
-                        "error": f"Product {product.name} stock is not available."
-                    })
+        # Lock every product on the order in id order. Lines for the same
+        # product share one instance, so repeated lines add up correctly.
+        batch = StockBatch(item_data['product'].id for item_data in items_data)
+
+        # First validate all items and compute the totals in memory
+        order = Order(**validated_data)
+        items = []
+        for line, item_data in enumerate(items_data):
+            product = batch[item_data['product'].id]
+            item_data['product'] = product
+            item_data['item_receipt'] = receipt
+            item_data['unit'] = item_data.get('unit', product.unit)
+            quantity = batch.take(product.id, item_data.get('quantity'), item_data.get('package'), receipt, line=line)
+            if quantity is None:
+                continue
+            item_data['quantity'] = quantity
+
+            unit_price = item_data.get('unit_price', product.selling_price)  # Default to product's selling price if not provided
+            total_price = unit_price * item_data['quantity']
+            item = OrderItem(order=order, price=total_price, **item_data)
+            item.cost = item.get_cost()
+            items.append((item, unit_price))
+
+        # Report every short line at once instead of failing on the first one
+        batch.check()
+
+        order.calculate_totals(sum(item.price for item, _ in items))
+        order.apply_item_counts(
+            count=len(items),
+            pending=sum(1 for item, _ in items if item.status == 'Pending'),
+            done=sum(1 for item, _ in items if item.status == 'Done'),
+            cancelled=sum(1 for item, _ in items if item.status == 'Cancelled'),
+        )
+
+        total_amount = Decimal(str(order.total_amount or 0))  # Convert to Decimal
+        paid = Decimal(str(paid_amount or 0))  # Convert to Decimal
+
+        if payment_status == 'Pending':
+            order.unpaid_amount = max(total_amount - paid, Decimal('0.00'))
+        elif payment_status == 'Unpaid':
+            order.paid_amount = Decimal('0.00')
+            order.unpaid_amount = total_amount
+        elif payment_status == 'Paid':
+            order.paid_amount = total_amount
+            order.unpaid_amount = Decimal('0.00')
+
+        # Take the receipt number last so its counter row is locked as briefly as possible
+        if receipt == "Receipt":
+            order.receipt_id = allocate_receipt_number("Receipt")
 
-            # Create the Order instance           
-            order = Order.objects.create(**validated_data)
+        # Create the Order instance with its final totals
+        order.save()
 
-            # Create each OrderItem
-            for item_data in items_data:
-                # This will call OrderItemSerializer.validate() for each item
-                product = item_data['product']
-                quantity = item_data.get('quantity')
-                receipt = order.receipt
-                item_data['item_receipt'] = receipt
-                package = item_data.get('package')
-                unit_price = item_data.get('unit_price', product.selling_price)  # Default to product's selling price if not provided
-                item_data['unit'] = item_data.get('unit', product.unit)
-                
-                piece = product.piece
-
-                if receipt == "Receipt":
-                    if package:
-                        if product.package >= package:
-                            product.package -= package
-                            quantity = package * product.piece
-                            item_data['quantity'] = quantity
-                            if quantity >  product.stock:
-                                raise serializers.ValidationError({
-                                    "error": f"Insufficient stock for {product.name}. Available stock is {product.package}, but {quantity} was requested."
-                                })
-                            product.stock -= quantity
-                            if product.receipt_no is not None:
-                                product.receipt_no -= quantity
-                            product.save()  # Save the product instance
-
-                        elif product.package < package:
-                            raise serializers.ValidationError({"error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."})   
-                    
-                    elif package is None:
-                        if quantity >  product.stock:
-                            raise serializers.ValidationError({
-                                "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                            })
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - quantity
-                        if product.piece is not None and product.package is not None:
-                            # If piece and package are defined, calculate remaining packages
-                            remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                            product.package = remaining_packages
-                            product.stock = remaining_stock
-                            product.save()
-                            if product.receipt_no is not None:
-                                # If receipt_no is defined, reduce it by the quantity
-                                product.receipt_no -= quantity
-                                product.save()  # Save the product instance
-                        else:
-                            product.stock -= quantity
-                            product.save()  # Save the product instance  
-                            if product.receipt_no is not None:
-                                # If receipt_no is defined, reduce it by the quantity
-                                product.receipt_no -= quantity
-                                product.save()  # Save the product instance      
-
-                elif receipt == "No Receipt":
-                    if package:
-                        if product.package >= package:
-                            product.package -= package
-                            quantity = package * product.piece
-                            item_data['quantity'] = quantity
-                            if quantity >  product.stock:
-                                # This shows the quantity as long as it is not greater than stock
-                                raise serializers.ValidationError({
-                                    "error": f"Insufficient quantity for {product.name}. Available stock is {product.stock}, but {quantity} quantity was requested."
-                                })
-                            product.stock -= quantity
-                            product.save()  # Save the product instance
-
-                        elif product.package < package:
-                            # This shows the quantity as long as it is not greater than stock
-                            raise serializers.ValidationError({"error": f"Insufficient package for {product.name}. Available package is {product.package}, but {package} package was requested."})   
-                    
-                    elif package is None:
-                        if quantity >  product.stock:
-                            # This shows the quantity as long as it is not greater than stock
-                            raise serializers.ValidationError({
-                                "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} quantity was requested."
-                            })
-                        # Calculate the remaining stock and adjust the package count
-                        remaining_stock = product.stock - quantity
-                        if product.piece is not None and product.package is not None:
-                            # If piece and package are defined, calculate remaining packages
-                            remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                            product.package = remaining_packages
-                            product.stock = remaining_stock
-                            product.save()
-                            
-                        else:
-                            product.stock -= quantity
-                            product.save()  # Save the product instance  
-
-                total_price = unit_price * item_data['quantity']
-                vat = total_price * Decimal(0.15)
-                receipt_total_price = total_price + vat
-
-                # Create the OrderItem and associate with the Order
-                OrderItem.objects.create(order=order, price=total_price, **item_data)
-                # Adding it into the log with every itration
-                create_order_log(
-                    user = user.name,
-                    action="Create",
-                    model_name="Order",
-                    object_id=order.id,
-                    customer_info = order.customer,
-                    product_name = item_data['product'].name,
-                    quantity = item_data['quantity'],
-                    price = total_price,
-                    changes_on_update = "Created Order Item",
-                )
-                # Adding it into the report with every itration
-                if order.customer is None and order.receipt == "Receipt":
-                    create_order_report(
-                        user = user.name,
-                        customer_name = "Anonymous Customer", 
-                        customer_phone = "0000000000",
-                        customer_tin_number = "000000000",
-                        order_date = order.order_date,
-                        order_id = order.id,
-                        item_receipt = item_data['item_receipt'],
-                        unit = item_data['unit'],
-                        product_name = item_data['product'].name,
-                        product_price = unit_price,
-                        quantity = item_data['quantity'],
-                        sub_total = total_price,
-                        vat = vat,
-                        payment_status = order.payment_status,
-                        total_amount = receipt_total_price
-                    )
-                elif order.customer is not None and order.receipt == "Receipt":
-                    create_order_report(
-                        user = user.name,
-                        customer_name = order.customer.name,
-                        customer_phone = order.customer.phone,
-                        customer_tin_number = order.customer.tin_number,
-                        order_date = order.order_date,
-                        order_id = order.id,
-                        item_receipt = item_data['item_receipt'],
-                        unit = item_data['unit'],
-                        product_name = item_data['product'].name,
-                        product_price = unit_price,
-                        quantity = item_data['quantity'],
-                        sub_total = total_price,
-                        vat = vat,
-                        payment_status = order.payment_status,
-                        total_amount = receipt_total_price
-                    )
-                elif order.customer is not None and order.receipt == "No Receipt":
-                    create_order_report(
-                        user = user.name,
-                        customer_name = order.customer.name,
-                        customer_phone = order.customer.phone,
-                        customer_tin_number = order.customer.tin_number,
-                        order_date = order.order_date,
-                        order_id = order.id,
-                        item_receipt = item_data['item_receipt'],
-                        unit = item_data['unit'],
-                        product_name = item_data['product'].name,
-                        product_price = unit_price,
-                        quantity = item_data['quantity'],
-                        sub_total = total_price,
-                        vat = 0,
-                        payment_status = order.payment_status,
-                        total_amount = total_price
-                    )
-                elif order.customer is None and order.receipt == "No Receipt":
-                    create_order_report(
-                        user = user.name,
-                        customer_name = "Anonymous Customer", 
-                        customer_phone = "0000000000",
-                        customer_tin_number = "000000000",
-                        order_date = order.order_date,
-                        order_id = order.id,
-                        item_receipt = item_data['item_receipt'],
-                        unit = item_data['unit'],
-                        product_name = item_data['product'].name,
-                        product_price = unit_price,
-                        quantity = item_data['quantity'],
-                        sub_total = total_price,
-                        vat = 0,
-                        payment_status = order.payment_status,
-                        total_amount = total_price
-                    )
+        # One conditional statement per product instead of a save per line
+        batch.apply('Sale', order=order, user=user.name, revalue=False)
 
+        OrderItem.objects.bulk_create([item for item, _ in items])
+        refresh_order_rollups(order)
 
-            order.save()
-            
-            total_amount = Decimal(str(order.total_amount or 0))  # Convert to Decimal
-            paid = Decimal(str(paid_amount or 0))  # Convert to Decimal
-
-            if payment_status == 'Pending':
-                order.unpaid_amount = max(total_amount - paid, Decimal('0.00'))
-                order.save()
-            elif payment_status == 'Unpaid':
-                order.paid_amount = Decimal('0.00')
-                order.unpaid_amount = total_amount
-                order.save()
-            elif payment_status == 'Paid':
-                order.paid_amount = total_amount
-                order.unpaid_amount = Decimal('0.00')
-                order.save()
-
-            new_unpaid_amount = total_amount - paid
+        if order.customer is not None:
+            customer_name = order.customer.name
+            customer_phone = order.customer.phone
+            customer_tin_number = order.customer.tin_number
+        else:
+            customer_name = "Anonymous Customer"
+            customer_phone = "0000000000"
+            customer_tin_number = "000000000"
+
+        order_logs = []
+        reports = []
+        for item, unit_price in items:
+            if order.receipt == "Receipt":
+                vat = item.price * VAT_RATE
+                report_total = item.price + vat
+            else:
+                vat = 0
+                report_total = item.price
 
-            # 🔍 Log changes
+            order_logs.append(build_order_log(
+                user = user.name,
+                action="Create",
+                model_name="Order",
+                object_id=order.id,
+                customer_info = order.customer,
+                product_name = item.product.name,
+                quantity = item.quantity,
+                price = item.price,
+                changes_on_update = "Created Order Item",
+            ))
+            reports.append(build_order_report(
+                user = user.name,
+                customer_name = customer_name,
+                customer_phone = customer_phone,
+                customer_tin_number = customer_tin_number,
+                order_date = order.order_date,
+                order_id = order.id,
+                item_receipt = item.item_receipt,
+                unit = item.unit,
+                product_name = item.product.name,
+                product_price = unit_price,
+                quantity = item.quantity,
+                sub_total = item.price,
+                vat = vat,
+                payment_status = order.payment_status,
+                total_amount = report_total
+            ))
+
+        audit.add(*order_logs, *reports)
+
+        new_unpaid_amount = total_amount - paid
 
-            OrderPaymentLog.objects.create(
+        # 🔍 Log changes
+        audit.add(
+            OrderPaymentLog(
                 order=order,
                 customer=order.customer,
                 change_type="Status Create",
                 field_name="payment_status",
                 old_value=0,
-                new_value=new_payment_status,
+                new_value=payment_status,
                 user=user.name
-            )
-
-            OrderPaymentLog.objects.create(
+            ),
+            OrderPaymentLog(
                 order=order,
                 customer=order.customer,
                 change_type="Payment Create",
                 field_name="paid_amount",
                 old_value=0,
-                new_value=new_paid_amount,
+                new_value=paid_amount,
                 user=user.name
-            )
-
-            OrderPaymentLog.objects.create(
+            ),
+            OrderPaymentLog(
                 order=order,
                 customer=order.customer,
                 change_type="Payment Create",
@@ -887,12 +699,33 @@ class OrderSerializer(serializers.ModelSerializer):
                 old_value=0,
                 new_value=new_unpaid_amount,
                 user=user.name
-            )
+            ),
+        )
+
+        # Last, so the shared valuation buckets are locked only until the commit
+        batch.revalue()
+        return order
+
+    def create(self, validated_data, user=None):
+        user = self.context["request"].user
+        if user:
+            validated_data['user'] = user.name
+            validated_data['user_email'] = user.email
+            validated_data['user_role'] = user.role
 
         
+        validated_data['receipt_id'] = None
+        items_data = validated_data.pop('items')
+
+        order = retry_on_deadlock(self._place_order, validated_data, items_data, user)
+
+        # bulk_create doesn't hand back ids on every backend, so read the items
+        # (and their products) back in two queries for the response.
+        prefetch_related_objects([order], 'items__product')
         return order
 
 
+    @suspend_order_signals()
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
         # print("items", items_data)
@@ -900,11 +733,8 @@ class OrderSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         user_role = user.role
         user_name = user.name
-        # Update order fields directly
-        instance.customer = validated_data.get('customer', instance.customer)
-        instance.status = validated_data.get('status', instance.status)
         new_status = validated_data.get('status')
-        new_paid = validated_data.get('paid_amount')
+        was_cancelled = instance.status == 'Cancelled'
 
         old_status = instance.payment_status
         old_paid = instance.paid_amount
@@ -935,341 +765,63 @@ class OrderSerializer(serializers.ModelSerializer):
                 "error": "You cannot cancel orders directly. Your cancellation request is now pending manager/admin approval."
             })
 
-        # Update Performa basic fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-
-        
-
         if items_data is not None:
             existing_items = {item.id: item for item in instance.items.all()}
-            sent_ids = [item.get('id') for item in items_data if item.get('id')]
-            # print("sent_id",  sent_ids)
-
-            # Delete items not included in the update
-            for item in instance.items.all():
-                if item.id not in sent_ids:
-                    item.delete()
 
-            # Add or update items
+            # A salesman cancelling a line only files a request, and nothing else in the edit is applied
             for item_data in items_data:
-                item_id = item_data.get('id')
-
-                user = self.context['request'].user
-                user_role = user.role
-                user_name = user.name
-                # Update order fields directly
-                new_quantity = item_data.get('quantity')
-                new_status = item_data.get('status')
-                new_package = item_data.get('package')
-                new_unit_price = item_data.get('unit_price')
-
-
-                if item_id and item_id in existing_items:
-                    item = existing_items[item_id]
-                    
-                    product = item.product  # Access the product from the existing order item
-                    quantity = item.quantity
-                    receipt = item.order.receipt  # Access the receipt from the order
-                    package = item.package
-                    unit_price = item.unit_price
-
-
-
-                    # If a salesman tries to cancel, set to Pending and raise error
-                    if new_status == 'Cancelled' and user_role == 'Salesman':
-                        item.status = 'Pending'
-                        item.save()
-
-                        create_order_log(
-                            user=user_name,
-                            action="Request Cancel",
-                            model_name="OrderItem",
-                            object_id=item.id,
-                            customer_info=item.order.customer,
-                            product_name=item.product.name,
-                            quantity=item.quantity,
-                            price=item.price,
-                            changes_on_update="Salesman requested cancellation"
-                        )
-
-                        raise serializers.ValidationError({
-                            "error": "You cannot cancel orders directly. Your cancellation request is now pending manager/admin approval."
-                        })
-
-
-                    if new_quantity and item.status == 'Cancelled':
-                        raise serializers.ValidationError({
-                            "error": f"The order is already cancelled."
-                        })
-                    
-                    if new_quantity and new_quantity <= 0:
-                        raise serializers.ValidationError({
-                            "error": f"Quantity must be greater than zero."
-                        })
-                    
-                    if new_status:
-                        if new_status == 'Cancelled':
-                            product.stock += item.quantity
-                            item.quantity = 0
-                            item.unit_price = 0
-                            item.product_price = 0
-                            item.price = 0
-                            item.cost = 0
-                            item.status = 'Cancelled' 
-                            if product.package is not None and package is not None:
-                                product.package += package
-                                item.package = 0
-                            if receipt == "Receipt":
-                                if product.receipt_no is not None:
-                                    product.receipt_no += quantity
-                            product.save()
-                            item.save()
-                        elif new_status == 'Done':
-                            item.status = 'Done' 
-                            item.save()
-
-
-
-                    if new_quantity and new_quantity > 0 and item.status == 'Done':
-                        # Calculate the difference between new and existing quantity
-                        quantity_difference = new_quantity - quantity
-
-                        piece = product.piece
-
-                        if product.stock >= quantity_difference:  # Ensure there is enough stock
-                            # Reduce stock by the order quantity_difference
-
-                            if receipt == "Receipt":
-                                if package:
-                                    if product.package >= package:
-                                        product.package -= package
-                                        product.stock -= quantity_difference
-                                        if product.receipt_no is not None:
-                                            product.receipt_no -= quantity_difference
-                                        product.save()  # Save the product item
-                                    elif product.package < package:
-                                        # raise ValidationError("The amount of package is insufficient.")
-                                        raise serializers.ValidationError({
-                                            "error": f"The amount of package is insufficient."
-                                        })
-                                        
-                                elif package is None:
-                                    if piece is not None:
-                                        # Calculate the remaining stock and adjust the package count
-                                        remaining_stock = product.stock - quantity_difference
-                                        remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                                        product.package = remaining_packages
-                                        product.stock = remaining_stock
-                                        if product.receipt_no is not None:
-                                            product.receipt_no -= quantity_difference
-                                        product.save()  # Save the product item
-                                    else:
-                                        remaining_stock = product.stock - quantity_difference
-                                        product.stock = remaining_stock
-                                        product.save()  # Save the product item
-
-                            elif receipt == "No Receipt":
-                                if package:
-                                    if product.package >= package:
-                                        product.package -= package
-                                        product.stock -= quantity_difference
-                                        product.save()  # Save the product item
-                                    elif product.package < package:
-                                        raise serializers.ValidationError({
-                                                "error": f"The amount of package is insufficient."
-                                            })
-                                elif package is None:
-                                    if piece is not None:
-                                        # Calculate the remaining stock and adjust the package count
-                                        remaining_stock = product.stock - quantity_difference
-                                        remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                                        product.package = remaining_packages
-                                        product.stock = remaining_stock
-                                        product.save()  # Save the product item
-                                    else:
-                                        remaining_stock = product.stock - quantity_difference
-                                        product.stock = remaining_stock
-                                        product.save()  # Save the product item
-
-                                
-                        else:
-                            raise serializers.ValidationError({
-                                    "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                                })
-                        # Update the item's quantity
-                        item.quantity = new_quantity
-
-                        # The total price without VAT
-                        if unit_price > 0 and new_unit_price is None:
-                            item.price = unit_price * item.quantity
-                        elif new_unit_price is not None:
-                            item.unit_price = new_unit_price
-                            item.price = new_unit_price * item.quantity
-                        else:
-                            item.price = product.selling_price * item.quantity
-
+                item = existing_items.get(item_data.get('id'))
+                if item is not None and item_data.get('status') == 'Cancelled' and user_role == 'Salesman':
+                    item.status = 'Pending'
                     item.save()
 
-
-                    for attr, value in item_data.items():
-                        if attr != 'id':
-                            setattr(item, attr, value)
-
-                    item.price = item.quantity * item.unit_price
-                    item.save()
-                else:
-                    # Remove 'id' if present, as it's not needed for new order item creation
-                    item_data.pop('id', None)
-                    item_data.pop('order', None)
-
-                    product = item_data['product']
-                    quantity = item_data.get('quantity')
-                    receipt = instance.receipt
-                    item_data['item_receipt'] = receipt
-                    package = item_data.get('package')
-                    unit_price = item_data.get('unit_price', product.selling_price)  # Default to product's selling price if not provided
-                    piece = product.piece
-
-                    if quantity is not None and product.stock < quantity:
-                        raise serializers.ValidationError({
-                            "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                        })
-                    
-                    if package is not None and product.package < package:
-                        raise serializers.ValidationError({
-                            "error": f"Insufficient package for {product.name}. Available package is {product.package}, but {package} was requested."
-                        })
-                    
-                    if receipt == "Receipt":
-                        if package:
-                            if product.package >= package:
-                                product.package -= package
-                                quantity = package * product.piece
-                                item_data['quantity'] = quantity
-                                if quantity >  product.stock:
-                                    raise serializers.ValidationError({
-                                        "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} was requested."
-                                    })
-                                product.stock -= quantity
-                                if product.receipt_no is not None:
-                                    product.receipt_no -= quantity
-                                product.save()  # Save the product instance
-
-                            elif product.package < package:
-                                raise serializers.ValidationError({"error": f"Insufficient package for {product.name}. Available package is {product.package}, but {package} was requested."})   
-                        
-                        elif package is None:
-                            # Calculate the remaining stock and adjust the package count
-                            remaining_stock = product.stock - quantity
-                            if product.piece is not None and product.package is not None:
-                                # If piece and package are defined, calculate remaining packages
-                                remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                                product.package = remaining_packages
-                                product.stock = remaining_stock
-                                product.save()
-                                if product.receipt_no is not None:
-                                    # If receipt_no is defined, reduce it by the quantity
-                                    product.receipt_no -= quantity
-                                    product.save()  # Save the product instance
-                            else:
-                                product.stock -= quantity
-                                product.save()  # Save the product instance  
-                                if product.receipt_no is not None:
-                                    # If receipt_no is defined, reduce it by the quantity
-                                    product.receipt_no -= quantity
-                                    product.save()  # Save the product instance      
-
-                    elif receipt == "No Receipt":
-                        if package:
-                            if product.package >= package:
-                                product.package -= package
-                                quantity = package * piece
-                                item_data['quantity'] = quantity
-                                if quantity >  product.stock:
-                                    # This shows the quantity as long as it is not greater than stock
-                                    raise serializers.ValidationError({
-                                        "error": f"Insufficient stock for {product.name}. Available stock is {product.stock}, but quantity {quantity} was requested."
-                                    })
-                                product.stock -= quantity
-                                product.save()  # Save the product instance
-
-                            elif product.package < package:
-                                # This shows the quantity as long as it is not greater than stock
-                                raise serializers.ValidationError({"error": f"Insufficient stock for {product.name}. Available package is {product.package}, but package {package} was requested."})   
-                        
-                        elif package is None:
-                            # Calculate the remaining stock and adjust the package count
-                            remaining_stock = product.stock - quantity
-                            if product.piece is not None and product.package is not None:
-                                # If piece and package are defined, calculate remaining packages
-                                remaining_packages = remaining_stock // piece  # Calculate remaining packages
-                                product.package = remaining_packages
-                                product.stock = remaining_stock
-                                product.save()
-                                
-                            else:
-                                product.stock -= quantity
-                                product.save()  # Save the product instance  
-
-                    total_price = unit_price * item_data['quantity']
-                    
-                    # update_payment_status_on_new_order_item(order=instance, new_items=None)
-
-
-                    if instance.pk is None:
-                       instance.save()
-                    OrderItem.objects.create(
-                        order=instance,
-                        price=total_price,
-                        **item_data
+                    create_order_log(
+                        user=user_name,
+                        action="Request Cancel",
+                        model_name="OrderItem",
+                        object_id=item.id,
+                        customer_info=instance.customer,
+                        product_name=item.product.name,
+                        quantity=item.quantity,
+                        price=item.price,
+                        changes_on_update="Salesman requested cancellation"
                     )
 
-                    #  Add this line
-                    # update_payment_status_on_new_order_item(instance, [new_order_item])
-
-
-        instance.total_amount = sum(item.price for item in instance.items.all())  # Total including VAT
-        instance.sub_total = instance.total_amount / (1 + Decimal('0.15'))  # Pre-VAT amount
-        instance.vat = instance.total_amount - instance.sub_total  # VAT amount
+                    raise serializers.ValidationError({
+                        "error": "You cannot cancel orders directly. Your cancellation request is now pending manager/admin approval."
+                    })
 
+        instance = retry_on_deadlock(self._apply_update, instance, validated_data, items_data, old_status, old_paid, old_unpaid, was_cancelled)
 
-        if 'paid_amount' in validated_data:
-            paid = old_paid + new_paid
-            total = Decimal(str(instance.total_amount or 0))
-            
-            if paid < 0:
-                raise serializers.ValidationError("Paid amount cannot be negative")
-            if paid > total:
-                raise serializers.ValidationError("Paid amount cannot be greater than total amount")
-            
-            instance.paid_amount = paid
-            instance.total_amount = total
-            instance.save()
+        # Items and their products for the response in two queries
+        prefetch_related_objects([instance], 'items__product')
+        return instance
 
-        # need more work when i get home
-        # instance.paid_amount += new_paid
+    def _apply_update(self, instance, validated_data, items_data, old_status, old_paid, old_unpaid, was_cancelled):
+        plan = self._plan_update(instance, validated_data, items_data, old_paid, was_cancelled)
+        plan['batch'].check()
 
-        if instance.payment_status == 'Pending':
-            instance.unpaid_amount = max(instance.total_amount - instance.paid_amount, Decimal('0.00'))
-            if instance.unpaid_amount == Decimal('0.00'):
-                instance.payment_status = 'Paid'
+        # Writing the plan: one save for the order, one statement per kind of
+        # item change and one conditional stock UPDATE per product.
+        if plan['cancel_order']:
+            # update_order_items_status_on_order_update restocks and cancels every item
             instance.save()
-        elif instance.payment_status == 'Unpaid':
-            instance.paid_amount = Decimal('0.00')
-            instance.unpaid_amount = instance.total_amount
-            instance.save()
-        elif instance.payment_status == 'Paid':
-            instance.paid_amount = instance.total_amount
-            instance.unpaid_amount = Decimal('0.00')
+        else:
+            if plan['removed']:
+                OrderItem.objects.filter(pk__in=[item.id for item in plan['removed']]).delete()
+            if plan['changed']:
+                OrderItem.objects.bulk_update(plan['changed'], ['product', 'quantity', 'package', 'unit', 'unit_price', 'price', 'cost', 'status'])
+            if plan['added']:
+                OrderItem.objects.bulk_create(plan['added'])
+            plan['batch'].apply('Order Edit', order=instance, user=self.context['request'].user.name, revalue=False)
             instance.save()
-        
-
+            # bulk_update and bulk_create skip the item signals
+            mark_order_dirty(instance.id)
 
         # 🔍 Log changes
+        payment_logs = []
         if instance.payment_status != old_status:
-            OrderPaymentLog.objects.create(
+            payment_logs.append(OrderPaymentLog(
                 order=instance,
                 customer=instance.customer,
                 change_type="Status Change",
@@ -1277,10 +829,10 @@ class OrderSerializer(serializers.ModelSerializer):
                 old_value=old_status,
                 new_value=instance.payment_status,
                 user=instance.user  # Optional if available
-            )
+            ))
 
         if instance.paid_amount != old_paid:
-            OrderPaymentLog.objects.create(
+            payment_logs.append(OrderPaymentLog(
                 order=instance,
                 customer=instance.customer,
                 change_type="Payment Update",
@@ -1288,10 +840,10 @@ class OrderSerializer(serializers.ModelSerializer):
                 old_value=old_paid,
                 new_value=instance.paid_amount,
                 user=instance.user
-            )
+            ))
         
         if instance.unpaid_amount != old_unpaid:
-            OrderPaymentLog.objects.create(
+            payment_logs.append(OrderPaymentLog(
                 order=instance,
                 customer=instance.customer,
                 change_type="Payment Update",
@@ -1299,12 +851,264 @@ class OrderSerializer(serializers.ModelSerializer):
                 old_value=old_unpaid,
                 new_value=instance.unpaid_amount,
                 user=instance.user
-            )
+            ))
+        audit.add(*payment_logs)
 
+        # Last, so the shared valuation buckets are locked only until the commit
+        plan['batch'].revalue()
+        return instance
 
-        instance.save()
+    def plan_update(self):
+        """
+        Work out what saving this serializer would do, without writing anything.
+        Used by `?dry_run=1` on the order detail endpoint.
+        """
+        validated_data = dict(self.validated_data)
+        items_data = validated_data.pop('items', None)
+        if items_data is not None:
+            items_data = [dict(item_data) for item_data in items_data]
+        # Plan against a fresh copy so the serializer's own instance stays untouched
+        instance = Order.objects.select_related('customer').get(pk=self.instance.pk)
+        plan = self._plan_update(instance, validated_data, items_data, instance.paid_amount, instance.status == 'Cancelled', lock=False)
+        return self._describe_plan(instance, plan)
+
+    def _plan_update(self, instance, validated_data, items_data, old_paid, was_cancelled, lock=True):
+        """
+        Diff the request against the stored order.
+
+        Nothing is written here: items are changed in memory and stock moves
+        are collected in a StockBatch, so the same plan can be applied or shown.
+        """
+        # Update Performa basic fields
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
 
-        return instance
+        existing_items = {item.id: item for item in instance.items.select_related('product').order_by('id')}
+        receipt = instance.receipt
+
+        # Lock the products of the existing lines and of the requested ones up front
+        product_ids = [item.product_id for item in existing_items.values() if item.product_id]
+        product_ids += [item_data['product'].id for item_data in items_data or [] if item_data.get('product')]
+        batch = StockBatch(product_ids, lock=lock)
+
+        plan = {
+            'batch': batch,
+            'cancel_order': instance.status == 'Cancelled' and not was_cancelled,
+            'added': [],
+            'removed': [],
+            'changed': [],
+            'lines': {'added': [], 'removed': [], 'quantity_changed': [], 'package_changed': [], 'product_changed': [], 'cancelled': []},
+        }
+
+        if plan['cancel_order']:
+            # The whole order goes back on the shelf, whatever the items say
+            for item in existing_items.values():
+                if item.status != 'Cancelled':
+                    self._plan_cancel(item, batch, plan, receipt)
+            instance.sub_total = 0
+            instance.vat = 0
+            instance.total_amount = 0
+            instance.paid_amount = 0
+            instance.unpaid_amount = 0
+            instance.payment_status = 'Unpaid'
+            return plan
+
+        kept = list(existing_items.values())
+        if items_data is not None:
+            sent_ids = {item_data.get('id') for item_data in items_data if item_data.get('id')}
+
+            # Items not included in the update are removed and their stock goes back
+            for item in existing_items.values():
+                if item.id not in sent_ids:
+                    if item.status != 'Cancelled' and item.product_id:
+                        self._give_back_item(item, batch, receipt)
+                    plan['removed'].append(item)
+                    plan['lines']['removed'].append({
+                        "item": item.id,
+                        "product": item.product_id,
+                        "quantity": item.quantity,
+                        "price": item.price,
+                    })
+            kept = [item for item in existing_items.values() if item.id in sent_ids]
+
+            for line, item_data in enumerate(items_data):
+                item = existing_items.get(item_data.get('id'))
+                if item is not None:
+                    self._plan_item_change(item, item_data, batch, plan, receipt, line)
+                else:
+                    self._plan_new_item(instance, item_data, batch, plan, receipt, line)
+
+            if not kept and not plan['added']:
+                raise serializers.ValidationError({
+                    "error": "An order needs at least one item. Cancel the order instead of removing every item."
+                })
+
+        final_items = kept + plan['added']
+        instance.calculate_totals(sum(item.price or 0 for item in final_items))
+        instance.apply_item_counts(
+            count=len(final_items),
+            pending=sum(1 for item in final_items if item.status == 'Pending'),
+            done=sum(1 for item in final_items if item.status == 'Done'),
+            cancelled=sum(1 for item in final_items if item.status == 'Cancelled'),
+        )
+        self._settle_payment(instance, validated_data, old_paid)
+        return plan
+
+    def _give_back_item(self, item, batch, receipt):
+        product = batch[item.product_id]
+        returned_package = item.package if product.package is not None and item.package is not None else None
+        batch.give_back(product.id, item.quantity or 0, package=returned_package, receipt=receipt)
+        return returned_package
+
+    def _plan_cancel(self, item, batch, plan, receipt, line=None):
+        plan['lines']['cancelled'].append({"line": line, "item": item.id, "product": item.product_id, "quantity": item.quantity})
+        if item.product_id:
+            if self._give_back_item(item, batch, receipt) is not None:
+                item.package = 0
+        item.quantity = 0
+        item.unit_price = 0
+        item.product_price = 0
+        item.price = 0
+        item.cost = 0
+        item.status = 'Cancelled'
+
+    def _plan_item_change(self, item, item_data, batch, plan, receipt, line):
+        new_quantity = item_data.get('quantity')
+        new_status = item_data.get('status')
+        new_package = item_data.get('package')
+        new_unit_price = item_data.get('unit_price')
+        new_product = item_data.get('product')
+
+        if new_quantity and item.status == 'Cancelled':
+            raise serializers.ValidationError({
+                "error": f"The order is already cancelled."
+            })
+        
+        if new_quantity and new_quantity <= 0:
+            raise serializers.ValidationError({
+                "error": f"Quantity must be greater than zero."
+            })
+
+        fields = ('product_id', 'quantity', 'package', 'unit', 'unit_price', 'price', 'cost', 'status')
+        before = tuple(getattr(item, field) for field in fields)
+
+        if new_status == 'Cancelled' and item.status != 'Cancelled':
+            self._plan_cancel(item, batch, plan, receipt, line)
+        elif item.status != 'Cancelled':
+            if new_status:
+                item.status = new_status
+            if 'unit' in item_data:
+                item.unit = item_data['unit']
+            quantity = item.quantity or 0
+
+            if new_product is not None and new_product.id != item.product_id:
+                # A different product on the same line: return the old one, sell the new one
+                if item.product_id:
+                    self._give_back_item(item, batch, receipt)
+                taken = batch.take(new_product.id, new_quantity or quantity, new_package or None, receipt, line=line)
+                plan['lines']['product_changed'].append({"line": line, "item": item.id, "from": item.product_id, "to": new_product.id})
+                item.product = batch[new_product.id]
+                item.package = new_package or None
+                item.quantity = taken if taken is not None else quantity
+            elif new_package and new_package != item.package and item.product_id and item.product.piece is not None:
+                new_package_quantity = new_package * item.product.piece
+                package_difference = new_package - item.package if item.package else None
+                batch.adjust(item.product_id, new_package_quantity - quantity, package=package_difference, receipt=receipt, line=line)
+                plan['lines']['package_changed'].append({"line": line, "item": item.id, "product": item.product_id, "from": item.package, "to": new_package})
+                item.package = new_package
+                item.quantity = new_package_quantity
+            elif new_quantity and new_quantity != quantity and item.product_id:
+                # Only the difference between new and existing quantity moves
+                batch.adjust(item.product_id, new_quantity - quantity, receipt=receipt, line=line)
+                plan['lines']['quantity_changed'].append({"line": line, "item": item.id, "product": item.product_id, "from": quantity, "to": new_quantity})
+                item.quantity = new_quantity
+
+            # The total price without VAT
+            if new_unit_price is not None:
+                item.unit_price = new_unit_price
+            if item.unit_price and item.unit_price > 0:
+                item.price = item.unit_price * item.quantity
+            elif item.product_id:
+                item.price = item.product.selling_price * item.quantity
+            if item.product_id:
+                item.cost = item.get_cost()
+
+        if tuple(getattr(item, field) for field in fields) != before:
+            plan['changed'].append(item)
+
+    def _plan_new_item(self, instance, item_data, batch, plan, receipt, line):
+        # Remove 'id' if present, as it's not needed for new order item creation
+        item_data.pop('id', None)
+        item_data.pop('order', None)
+
+        product = batch[item_data['product'].id]
+        item_data['product'] = product
+        item_data['item_receipt'] = receipt
+        item_data['unit'] = item_data.get('unit', product.unit)
+        unit_price = item_data.get('unit_price', product.selling_price)  # Default to product's selling price if not provided
+        quantity = batch.take(product.id, item_data.get('quantity'), item_data.get('package'), receipt, line=line)
+        if quantity is None:
+            return
+        item_data['quantity'] = quantity
+
+        item = OrderItem(order=instance, price=unit_price * quantity, **item_data)
+        item.cost = item.get_cost()
+        plan['added'].append(item)
+        plan['lines']['added'].append({
+            "line": line,
+            "product": product.id,
+            "product_name": product.name,
+            "quantity": quantity,
+            "package": item.package,
+            "price": item.price,
+        })
+
+    def _settle_payment(self, instance, validated_data, old_paid):
+        if 'paid_amount' in validated_data:
+            paid = old_paid + validated_data['paid_amount']
+            total = Decimal(str(instance.total_amount or 0))
+            
+            if paid < 0:
+                raise serializers.ValidationError("Paid amount cannot be negative")
+            if paid > total:
+                raise serializers.ValidationError("Paid amount cannot be greater than total amount")
+            
+            instance.paid_amount = paid
+            instance.total_amount = total
+
+        if instance.payment_status == 'Pending':
+            instance.unpaid_amount = max(instance.total_amount - instance.paid_amount, Decimal('0.00'))
+            if instance.unpaid_amount == Decimal('0.00'):
+                instance.payment_status = 'Paid'
+        elif instance.payment_status == 'Unpaid':
+            instance.paid_amount = Decimal('0.00')
+            instance.unpaid_amount = instance.total_amount
+        elif instance.payment_status == 'Paid':
+            instance.paid_amount = instance.total_amount
+            instance.unpaid_amount = Decimal('0.00')
+
+    def _describe_plan(self, instance, plan):
+        batch = plan['batch']
+        stock = []
+        for product_id, delta in sorted(batch.changes().items()):
+            product = batch[product_id]
+            stock.append(dict(delta, product=product_id, product_name=product.name))
+        return {
+            **plan['lines'],
+            "stock": stock,
+            "shortages": batch.shortages,
+            "totals": {
+                "status": instance.status,
+                "number_of_items": instance.number_of_items,
+                "item_pending": instance.item_pending,
+                "sub_total": instance.sub_total,
+                "vat": instance.vat,
+                "total_amount": instance.total_amount,
+                "payment_status": instance.payment_status,
+                "paid_amount": instance.paid_amount,
+                "unpaid_amount": instance.unpaid_amount,
+            },
+        }
 
 
 class OrderLogSerializer(serializers.ModelSerializer):
@@ -1368,4 +1172,26 @@ class OrderPaymentLogSerializer(serializers.ModelSerializer):
 class ProductLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductLog
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'product', 'quantity', 'package', 'receipt_no', 'reason', 'order', 'order_item', 'user', 'timestamp']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'state', 'progress', 'result', 'result_name', 'download',
+            'error', 'user', 'schedule', 'created_at', 'started_at', 'finished_at',
+        ]
+
+    def get_download(self, obj):
+        if obj.state != 'Done' or not obj.result_path:
+            return None
+        return reverse('jobs-download', args=[obj.id])
@@ -0,0 +1,229 @@
+import time
+
+from django.db import transaction, connection, OperationalError
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import Product, StockMovement
+from .result_cache import bump_data_version
+from .valuation import revalue_products
+
+
+DEADLOCK_RETRIES = 3
+# MySQL deadlock / lock wait timeout and PostgreSQL deadlock_detected
+DEADLOCK_ERROR_CODES = {1213, 1205, '40P01'}
+
+STOCK_FIELDS = ('stock', 'package', 'receipt_no')
+
+
+def is_deadlock(error):
+    cause = error.__cause__ or error
+    code = getattr(cause, 'pgcode', None)
+    if code is None and cause.args:
+        code = cause.args[0]
+    return code in DEADLOCK_ERROR_CODES
+
+
+def retry_on_deadlock(func, *args, **kwargs):
+    """
+    Run func in its own transaction and start it over when the database picks
+    it as a deadlock victim. Inside an outer transaction there is nothing safe
+    to retry, so the error is raised as is.
+    """
+    for attempt in range(DEADLOCK_RETRIES):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if connection.in_atomic_block or not is_deadlock(e) or attempt == DEADLOCK_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+class StockBatch:
+    """
+    Stock movements for one write (checkout, order edit or cancellation).
+
+    The products are locked in id order when the batch is created, so two
+    writes touching the same products always queue instead of deadlocking.
+    With lock=False the batch only plans the movements (for dry runs).
+    Each movement is checked against the locked rows and every shortage is
+    collected, then apply() writes one conditional UPDATE per product.
+    """
+
+    def __init__(self, product_ids, lock=True):
+        products = Product.objects.filter(pk__in=set(product_ids)).order_by('id')
+        if lock:
+            products = products.select_for_update()
+        self.products = {product.id: product for product in products}
+        self.original = {product.id: stock_values(product) for product in self.products.values()}
+        self.shortages = []
+        self.moved = []  # Products apply() wrote, for revalue()
+
+    def __getitem__(self, product_id):
+        return self.products[product_id]
+
+    def _short(self, product, field, requested, available, message, line=None):
+        self.shortages.append({
+            "line": line,
+            "product": product.id,
+            "product_name": product.name,
+            "field": field,
+            "requested": requested,
+            "available": available,
+            "message": message,
+        })
+
+    def take(self, product_id, quantity=None, package=None, receipt=None, line=None):
+        """Deduct a sale line. Returns the quantity in pieces, or None if it is short."""
+        product = self.products[product_id]
+        if product.stock is None:
+            self._short(product, 'stock', quantity, None, f"Product {product.name} stock is not available.", line)
+            return None
+
+        if package:
+            if product.piece is None:
+                self._short(product, 'piece', package, None, f"Product {product.name} has no piece count, order it by quantity instead.", line)
+                return None
+            quantity = package * product.piece
+        elif quantity is None:
+            self._short(product, 'stock', None, product.stock, f"Quantity or package is required for {product.name}.", line)
+            return None
+
+        return self.adjust(product_id, quantity, package=package or None, receipt=receipt, line=line)
+
+    def give_back(self, product_id, quantity, package=None, receipt=None):
+        """Restock a cancelled or removed line."""
+        self.adjust(product_id, -(quantity or 0), package=-package if package is not None else None, receipt=receipt)
+
+    def adjust(self, product_id, quantity, package=None, receipt=None, line=None):
+        """
+        Move `quantity` pieces (and `package` packages) out of stock; negative
+        values put them back. Without a package count the product's packages are
+        recalculated from the remaining stock.
+        """
+        product = self.products[product_id]
+        counts_receipt = receipt == "Receipt" and product.receipt_no is not None
+        short = False
+
+        if quantity > 0:
+            if product.stock is None or quantity > product.stock:
+                self._short(product, 'stock', quantity, product.stock, f"Insufficient stock for {product.name}. Available stock is {product.stock}, but {quantity} quantity was requested.", line)
+                short = True
+            if package and package > 0 and (product.package is None or package > product.package):
+                self._short(product, 'package', package, product.package, f"Insufficient package for {product.name}. Available package is {product.package}, but {package} package was requested.", line)
+                short = True
+            if counts_receipt and quantity > product.receipt_no:
+                self._short(product, 'receipt_no', quantity, product.receipt_no, f"Insufficient receipt quantity for {product.name}. Available receipt quantity is {product.receipt_no}, but {quantity} quantity was requested.", line)
+                short = True
+        if short:
+            return None
+
+        if product.stock is not None:
+            product.stock -= quantity
+        if package is not None and product.package is not None:
+            product.package -= package
+        elif product.piece and product.package is not None and product.stock is not None:
+            # Calculate the remaining packages from the remaining stock
+            product.package = product.stock // product.piece
+        if counts_receipt:
+            product.receipt_no -= quantity
+        return quantity
+
+    def check(self):
+        """Raise one validation error listing every shortage in the batch."""
+        if self.shortages:
+            raise serializers.ValidationError({
+                "error": " ".join(shortage["message"] for shortage in self.shortages),
+                "shortages": self.shortages,
+            })
+
+    def changes(self):
+        """Net change per product as {product_id: {field: delta}}, negative for stock taken out."""
+        changes = {}
+        for product_id, product in self.products.items():
+            delta = {}
+            for field, before in zip(STOCK_FIELDS, self.original[product_id]):
+                after = getattr(product, field)
+                if before is not None and after is not None and after != before:
+                    delta[field] = after - before
+            if delta:
+                changes[product_id] = delta
+        return changes
+
+    def apply(self, reason, order=None, item=None, user=None, revalue=True):
+        """
+        Write one `SET field = field - n WHERE field >= n` UPDATE per changed
+        product, and the matching StockMovement rows in one bulk insert.
+        With revalue=False the caller applies the valuation with revalue().
+        """
+        self.check()
+        movements = []
+        for product_id, delta in sorted(self.changes().items()):
+            updates = {}
+            guards = {}
+            for field, change in delta.items():
+                updates[field] = F(field) + change
+                if change < 0:
+                    guards[f'{field}__gte'] = -change
+            # A queryset update skips auto_now, the list ETags need the new updated_at
+            updates['updated_at'] = timezone.now()
+            if not Product.objects.filter(pk=product_id, **guards).update(**updates):
+                product = self.products[product_id]
+                raise serializers.ValidationError({
+                    "error": f"Stock for {product.name} changed while the order was being saved, please try again."
+                })
+            movements.append(StockMovement(
+                product_id=product_id,
+                quantity=delta.get('stock', 0),
+                package=delta.get('package', 0),
+                receipt_no=delta.get('receipt_no', 0),
+                reason=reason,
+                order=order,
+                order_item=item,
+                user=user,
+            ))
+        StockMovement.objects.bulk_create(movements)
+        self.moved = [movement.product_id for movement in movements]
+        if movements:
+            if revalue:
+                self.revalue()
+            bump_data_version('products')
+
+    def revalue(self):
+        """
+        Apply the applied movements to the inventory valuation. Its bucket rows
+        are shared by every write in a category and supplier and stay locked
+        until the commit, so a checkout calls this as its last statement.
+        """
+        revalue_products([self.products[product_id] for product_id in self.moved])
+
+
+def stock_values(product):
+    return tuple(getattr(product, field) for field in STOCK_FIELDS)
+
+
+def stock_change(product, before, reason, user=None):
+    """The unsaved ledger row for a product whose stock fields were saved directly, or None if they didn't change."""
+    delta = {
+        field: (after or 0) - (old or 0)
+        for field, old, after in zip(STOCK_FIELDS, before, stock_values(product))
+    }
+    if not any(delta.values()):
+        return None
+    return StockMovement(
+        product=product,
+        quantity=delta['stock'],
+        package=delta['package'],
+        receipt_no=delta['receipt_no'],
+        reason=reason,
+        user=user,
+    )
+
+
+def record_stock_change(product, before, reason, user=None):
+    """Add the ledger row for a product whose stock fields were saved directly (create, edit)."""
+    movement = stock_change(product, before, reason, user=user)
+    if movement is not None:
+        movement.save()
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Category, CustomerInfo, Product, Supplier, SyncTombstone
+from .pagination import after, cursor_value
+
+
+LIMIT = 500
+MAX_LIMIT = 5000
+
+# stream: model, in the order a client should apply them (categories and
+# suppliers before the products that point at them)
+STREAMS = {
+    'categories': Category,
+    'suppliers': Supplier,
+    'customers': CustomerInfo,
+    'products': Product,
+}
+STREAM_NAMES = {model._meta.model_name: stream for stream, model in STREAMS.items()}
+
+
+class ExpiredToken(Exception):
+    """The token is older than the kept tombstones: the client has to sync from scratch."""
+
+
+def decode_token(token):
+    """{stream: (timestamp, id)} of a sync token. Raises ValueError."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return {stream: (datetime.fromisoformat(data[stream][0]), int(data[stream][1])) for stream in [*STREAMS, 'deleted']}
+    except (binascii.Error, KeyError, IndexError, TypeError) as e:
+        raise ValueError(str(e))
+
+
+def encode_token(positions):
+    data = {stream: [cursor_value(stamp), pk] for stream, (stamp, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+
+def read_changes(token=None, limit=LIMIT):
+    """
+    The products, customers, categories and suppliers created, updated or
+    deleted since `token` (all of them without one), at most `limit` rows
+    per stream. Each stream is walked on (updated_at, id), so a sync reads
+    the rows that changed and no others.
+
+    Rows stamped in the last SYNC_LAG seconds are left for the next sync: a
+    write still in its transaction may commit with an older stamp, and must
+    not land behind a token already handed out.
+
+    Returns {"token", "more", "changes": {stream: rows}, "deleted": {stream:
+    [ids]}}. With `more` the client should ask again with the new token
+    right away.
+    """
+    now = timezone.now()
+    horizon = now - timedelta(seconds=settings.SYNC_LAG)
+    positions = decode_token(token) if token else {}
+    if positions and positions['deleted'][0] < now - timedelta(days=settings.SYNC_TOMBSTONE_DAYS):
+        raise ExpiredToken
+
+    result = {"more": False, "changes": {}, "deleted": {stream: [] for stream in STREAMS}}
+    next_positions = {}
+    for stream, model in [*STREAMS.items(), ('deleted', SyncTombstone)]:
+        field = 'deleted_at' if model is SyncTombstone else 'updated_at'
+        rows = model.objects.filter(**{f'{field}__lte': horizon})
+        if stream in positions:
+            rows = rows.filter(after((field, 'id'), positions[stream]))
+        rows = list(rows.order_by(field, 'id')[:limit + 1])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result["more"] = True
+            next_positions[stream] = (getattr(rows[-1], field), rows[-1].id)
+        else:
+            # Caught up: the next sync starts at the horizon
+            next_positions[stream] = (horizon, 0)
+        if model is SyncTombstone:
+            for tombstone in rows:
+                if tombstone.model_name in STREAM_NAMES:
+                    result["deleted"][STREAM_NAMES[tombstone.model_name]].append(tombstone.object_id)
+        else:
+            result["changes"][stream] = rows
+    result["token"] = encode_token(next_positions)
+    return result
+
+
+def purge_tombstones():
+    """Delete tombstones older than SYNC_TOMBSTONE_DAYS, tokens that old are refused anyway."""
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_DAYS)).delete()
+    return deleted
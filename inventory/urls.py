@@ -7,6 +7,7 @@ from .views import (
     SupplierRetrieveUpdateDeleteAPIView,
 
     CustomerListCreateAPIView,
+    ChangesAPIView,
     CustomerRetrieveUpdateDeleteAPIView,
 
     CategoryListCreateAPIView,
@@ -15,6 +16,7 @@ from .views import (
     RetriveRevenueAPIView,
     RetriveProfitAPIView,
     ExcelReportAPIView,
+    ReportExportAPIView,
     OrderLogAPIView,
 
     CompanyListCreateAPIView,
@@ -30,6 +32,7 @@ from .views import (
     OtherExpensesRetrieveUpdateDeleteAPIView,
 
     RetriveTotalProductCostAPIView,
+    InventoryValuationAPIView,
     ProductExcelReportAPIView,
 
     ProductsPerSupplierAPIView,
@@ -52,6 +55,9 @@ from .views import (
 
     ExportProductExcelAPIView,
     ImportProductExcelAPIView,
+    JobListCreateAPIView,
+    JobDetailAPIView,
+    JobDownloadAPIView,
 
     OrderListCreatView,
     OrderDetailView,
@@ -61,13 +67,21 @@ from .views import (
     OrderItemCreditListView,
 
     OrderLogListView,
-    ProductLogAPIView
+    ProductLogAPIView,
+    AuditStatsAPIView,
+    ProductStockMovementAPIView,
+    SalesSeriesAPIView,
+    LeaderboardAPIView,
+    ProfitReportAPIView,
+    DashboardAPIView,
+    ResultCacheStatsAPIView,
 
 )
 
 urlpatterns = [
     path('products', ProductListCreateAPIView.as_view(), name='products-list'),
     path('products/<pk>', ProductRetrieveUpdateDeleteAPIView.as_view(), name='products-retrieve'),
+    path('products/<pk>/stock-movements', ProductStockMovementAPIView.as_view(), name='product-stock-movements'),
 
     path('suppliers', SupplierListCreateAPIView.as_view(), name='suppliers-list'),
     path('suppliers/<pk>', SupplierRetrieveUpdateDeleteAPIView.as_view(), name='suppliers-retrieve'),
@@ -81,6 +95,7 @@ urlpatterns = [
     path('orders-credit', OrderCreditListAPIView.as_view(), name='orders-credit-list'),
     path('orderitems-credit', OrderItemCreditListView.as_view(), name='orders-credit-items-list'),
     path('customers', CustomerListCreateAPIView.as_view(), name='customers-list'),
+    path('changes', ChangesAPIView.as_view(), name='catalog-changes'),
     path('customers/<pk>', CustomerRetrieveUpdateDeleteAPIView.as_view(), name='customers-retrieve'),
     
     path('company', CompanyListCreateAPIView.as_view(), name='company-list'),
@@ -91,7 +106,9 @@ urlpatterns = [
 
     path('revenue/', RetriveRevenueAPIView.as_view(), name='revenue-retrieve'),
     path('profit/', RetriveProfitAPIView.as_view(), name='profit-retrieve'),
+    path('profit-report/', ProfitReportAPIView.as_view(), name='profit-report-retrieve'),
     path('report/', ExcelReportAPIView.as_view(), name='report-retrieve'),
+    path('report/export/', ReportExportAPIView.as_view(), name='report-export'),
     path('order_log/', OrderLogAPIView.as_view(), name='order-log-retrieve'),
     path('stock/', ListOutOFStockProductAPIView.as_view(), name='stock-shortage-retrieve'),
     path('stock_count/', CountNearExpirationDateProductAPIView.as_view(), name='stock-shortage-count-retrieve'),
@@ -103,12 +120,14 @@ urlpatterns = [
     path('other_expenses/<pk>', OtherExpensesRetrieveUpdateDeleteAPIView.as_view(), name='other_expenses-retrieve'),
     path('product_report/', ProductExcelReportAPIView.as_view(), name='product-report-retrieve'),
     path('product_cost/', RetriveTotalProductCostAPIView.as_view(), name='total-product-cost-retrieve'),
+    path('inventory-valuation/', InventoryValuationAPIView.as_view(), name='inventory-valuation-retrieve'),
 
     path('products_supplier/<pk>', ProductsPerSupplierAPIView.as_view(), name='products-per-supplier'),
 
     path('orders/<pk>/receipt/', OrderReceiptAPIView.as_view(), name='order-receipt'),
     path('sales-dashboard/', SalesPersonDashboardAPIView.as_view(), name='salesperson-dashboard'),
     path('recent-orders/', RecentOrderLimitedAPIView.as_view(), name='recent-orders-limited'),
+    path('dashboard/', DashboardAPIView.as_view(), name='dashboard-retrieve'),
     path('salesperson-revenue/', RetriveSalesPersonRevenueAPIView.as_view(), name='salesperson-revenue-retrieve'),
     path('salesperson-total-orders/', RetriveTotalOrdersAPIView.as_view(), name='total-orders-retrieve'),
     
@@ -116,6 +135,8 @@ urlpatterns = [
     path('monthly-sales/', MonthlySalesAPIView.as_view(), name='monthly-sales-retrieve'),
     path('weekly-sales/', WeeklySalesAPIView.as_view(), name='weekly-sales-retrieve'),
     path('yearly-sales/', YearlySalesAPIView.as_view(), name='yearly-sales-retrieve'),
+    path('sales-series/', SalesSeriesAPIView.as_view(), name='sales-series-retrieve'),
+    path('leaderboard/', LeaderboardAPIView.as_view(), name='leaderboard-retrieve'),
 
     path('daily-sales-per-user/', DailySalesEachUserAPIView.as_view(), name='daily-sales-each-user-retrieve'),
     path('weekly-sales-per-user/', WeeklySalesEachUserAPIView.as_view(), name='weekly-sales-each-user-retrieve'),
@@ -124,7 +145,12 @@ urlpatterns = [
 
     path('export/products/', ExportProductExcelAPIView.as_view(), name='export-products-excel'),
     path('import/products/', ImportProductExcelAPIView.as_view(), name='export-products-excel'),
+    path('jobs/', JobListCreateAPIView.as_view(), name='jobs-list'),
+    path('jobs/<int:pk>', JobDetailAPIView.as_view(), name='jobs-retrieve'),
+    path('jobs/<int:pk>/download', JobDownloadAPIView.as_view(), name='jobs-download'),
 
     path('orders/<int:order_id>/logs', OrderLogListView.as_view(), name='order-logs'),
     path('product_log/', ProductLogAPIView.as_view(), name='product-log-retrieve'),
+    path('audit-stats/', AuditStatsAPIView.as_view(), name='audit-stats-retrieve'),
+    path('cache-stats/', ResultCacheStatsAPIView.as_view(), name='cache-stats-retrieve'),
 ]
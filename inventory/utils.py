@@ -1,5 +1,11 @@
-from .models import OrderLog, Report
+from .models import OrderLog, Report, Order, ReceiptSequence
 from decimal import Decimal
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from .audit import audit
 
 def create_log(user, action, model_name, object_id, details=None):
     Log.objects.create(
@@ -11,9 +17,24 @@ def create_log(user, action, model_name, object_id, details=None):
     )
 
 
+def build_order_log(user, action, model_name, object_id, customer_info, product_name, quantity, price, changes_on_update):
+    # Unsaved OrderLog, so callers can write a whole batch with bulk_create
+    return OrderLog(
+        user=user,
+        action=action,
+        model_name=model_name,
+        object_id=object_id,
+        customer_info = customer_info,
+        product_name = product_name,
+        quantity = quantity,
+        price = price,
+        changes_on_update = changes_on_update
+    )
+
+
 def create_order_log(user, action, model_name, object_id, customer_info, product_name, quantity, price, changes_on_update):
     # print("Order Log Active")
-    OrderLog.objects.create(
+    audit.add(build_order_log(
         user=user,
         action=action,
         model_name=model_name,
@@ -23,14 +44,35 @@ def create_order_log(user, action, model_name, object_id, customer_info, product
         quantity = quantity,
         price = price,
         changes_on_update = changes_on_update
-    )
+    ))
     
 
+def build_order_report(user, customer_name, customer_phone, customer_tin_number, order_date, order_id, item_receipt, unit,  product_name, product_price, quantity, sub_total, vat, payment_status, total_amount,):
+    # Unsaved Report row, so callers can write a whole batch with bulk_create
+    return Report(
+        user = user,
+        customer_name = customer_name,
+        customer_phone = customer_phone,
+        customer_tin_number = customer_tin_number,
+        order_date = order_date,
+        order_id = order_id,
+        item_receipt = item_receipt,
+        product_name = product_name,
+        unit = unit,
+        product_price = product_price,
+        quantity = quantity,
+        sub_total = sub_total,
+        vat = vat,
+        payment_status = payment_status,
+        total_amount = total_amount
+    )
+
+
 def create_order_report(user, customer_name, customer_phone, customer_tin_number, order_date, order_id, item_receipt, unit,  product_name, product_price, quantity, sub_total, vat, payment_status, total_amount,):
     # print("Order Report Active")
     # item_receipt, unit, sub_total, vat, payment_status, paid_amount, unpaid_amount, total_amount
 
-    Report.objects.create(
+    audit.add(build_order_report(
         user = user,
         customer_name = customer_name,
         customer_phone = customer_phone,
@@ -46,7 +88,7 @@ def create_order_report(user, customer_name, customer_phone, customer_tin_number
         vat = vat,
         payment_status = payment_status,
         total_amount = total_amount
-    )
+    ))
 
 
 
@@ -68,3 +110,44 @@ def update_payment_status_on_new_expense_or_product(supplier, expense=None, new_
 
     return updated
 
+
+def get_fiscal_year(when=None):
+    # Fiscal years are named after the calendar year they start in
+    when = timezone.localtime(when) if when else timezone.localtime()
+    start_month = getattr(settings, 'FISCAL_YEAR_START_MONTH', 1)
+    return when.year if when.month >= start_month else when.year - 1
+
+
+def allocate_receipt_number(series="Receipt", when=None):
+    """
+    Hand out the next receipt number for a series in O(1).
+
+    The counter row is incremented inside the caller's transaction and stays
+    locked until it commits, so concurrent checkouts never share a number and
+    a rolled back order gives its number back instead of leaving a gap.
+    """
+    fiscal_year = 0
+    if getattr(settings, 'RECEIPT_NUMBER_PER_FISCAL_YEAR', False):
+        fiscal_year = get_fiscal_year(when)
+
+    with transaction.atomic():
+        sequence = ReceiptSequence.objects.filter(series=series, fiscal_year=fiscal_year)
+        if not sequence.update(next_value=F('next_value') + 1):
+            # First number of this series: continue from the orders already issued
+            issued = Order.objects.filter(receipt=series)
+            if fiscal_year:
+                start_month = getattr(settings, 'FISCAL_YEAR_START_MONTH', 1)
+                tz = timezone.get_current_timezone()
+                issued = issued.filter(
+                    order_date__gte=datetime(fiscal_year, start_month, 1, tzinfo=tz),
+                    order_date__lt=datetime(fiscal_year + 1, start_month, 1, tzinfo=tz),
+                )
+            try:
+                with transaction.atomic():
+                    ReceiptSequence.objects.create(series=series, fiscal_year=fiscal_year, next_value=issued.count() + 1)
+            except IntegrityError:
+                # Another terminal created it first, take the next number from its row
+                sequence.update(next_value=F('next_value') + 1)
+        number = sequence.values_list('next_value', flat=True).get() - 1
+
+    return str(number).zfill(4)
@@ -0,0 +1,219 @@
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.db.models import Count, DecimalField, F, Sum
+
+from .models import Category, InventoryValuation, Product, Supplier
+from .rollups import sync_rows
+
+
+CENTS = Decimal('0.01')
+VALUE_FIELDS = ['products', 'units', 'cost_value', 'retail_value']
+VALUATION_FIELDS = ('category_id', 'supplier_id', 'stock', 'buying_price', 'selling_price')
+
+# group by field and name lookup of the breakdowns
+BREAKDOWNS = {
+    'category': ('category_key', Category),
+    'supplier': ('supplier_key', Supplier),
+}
+
+
+def money(value):
+    # Prices can still be floats or strings before the row is reloaded (imports)
+    return Decimal(str(value or 0)).quantize(CENTS)
+
+
+def valuation_state(product):
+    """The fields the valuation reads, or None when one was deferred."""
+    fields = product.__dict__
+    if any(field not in fields for field in VALUATION_FIELDS):
+        return None
+    return tuple(fields[field] for field in VALUATION_FIELDS)
+
+
+def valued(state):
+    """((category_key, supplier_key), (products, units, cost value, retail value)) of a product state."""
+    if state is None:
+        return None
+    category_id, supplier_id, stock, buying_price, selling_price = state
+    stock = stock or 0
+    return (
+        (category_id or 0, supplier_id or 0),
+        (1, stock, stock * money(buying_price), stock * money(selling_price)),
+    )
+
+
+def add_change(changes, entry, sign=1):
+    if entry is None:
+        return
+    bucket, values = entry
+    total = changes.setdefault(bucket, [0, 0, Decimal(0), Decimal(0)])
+    for i, value in enumerate(values):
+        total[i] += sign * value
+
+
+def apply_changes(changes):
+    """
+    Add {(category_key, supplier_key): [products, units, cost, retail]}
+    deltas to the valuation, one UPDATE per bucket. Buckets are written in key
+    order, so two writes queue on them instead of deadlocking.
+    """
+    for (category_key, supplier_key), delta in sorted(changes.items()):
+        if not any(delta):
+            continue
+        bucket = InventoryValuation.objects.filter(category_key=category_key, supplier_key=supplier_key)
+        if bucket.update(**{field: F(field) + value for field, value in zip(VALUE_FIELDS, delta)}):
+            continue
+        try:
+            with transaction.atomic():
+                InventoryValuation.objects.create(category_key=category_key, supplier_key=supplier_key, **dict(zip(VALUE_FIELDS, delta)))
+        except IntegrityError:
+            # Another write created the bucket first
+            bucket.update(**{field: F(field) + value for field, value in zip(VALUE_FIELDS, delta)})
+
+
+def revalue_products(products):
+    """Apply what changed in already-saved products since they were loaded."""
+    changes = {}
+    for product in products:
+        before = getattr(product, '_valuation', None)
+        if before is None:
+            continue  # Not loaded with every field, reconcile_inventory_valuation catches it up
+        after = valuation_state(product)
+        if after != before:
+            add_change(changes, valued(before), -1)
+            add_change(changes, valued(after))
+        product._valuation = after
+    apply_changes(changes)
+
+
+def add_products(products):
+    """Count products inserted without their post_save signal (bulk_create)."""
+    changes = {}
+    for product in products:
+        product._valuation = valuation_state(product)
+        add_change(changes, valued(product._valuation))
+    apply_changes(changes)
+
+
+def revalue_product(product, created=False):
+    if created:
+        add_products([product])
+    else:
+        revalue_products([product])
+
+
+def remove_product(product):
+    changes = {}
+    add_change(changes, valued(getattr(product, '_valuation', None) or valuation_state(product)), -1)
+    apply_changes(changes)
+
+
+def merge_bucket(category_key=None, supplier_key=None):
+    """Move the buckets of a deleted category or supplier to 'none'."""
+    if category_key is not None:
+        rows = InventoryValuation.objects.filter(category_key=category_key)
+    else:
+        rows = InventoryValuation.objects.filter(supplier_key=supplier_key)
+    changes = {}
+    for row in rows.select_for_update():
+        target = (0 if category_key is not None else row.category_key, 0 if supplier_key is not None else row.supplier_key)
+        add_change(changes, (target, tuple(getattr(row, field) for field in VALUE_FIELDS)))
+    rows.delete()
+    apply_changes(changes)
+
+
+def inventory_valuation(by=None):
+    """
+    Stock on hand at buying price (cost_value) and at selling price
+    (retail_value), from the running valuation: one query over a row per
+    category and supplier pair, whatever the size of the catalog.
+
+    `by` breaks the totals down by category or supplier.
+    """
+    rows = InventoryValuation.objects.all()
+    totals = rows.aggregate(**{field: Sum(field) for field in VALUE_FIELDS})
+    report = {"totals": with_margin({field: totals[field] or 0 for field in VALUE_FIELDS}), "results": []}
+    if by is None:
+        return report
+
+    key, model = BREAKDOWNS[by]
+    groups = list(rows.values(key).annotate(**{f'{field}_total': Sum(field) for field in VALUE_FIELDS}).order_by())
+    names = dict(model.objects.filter(pk__in=[row[key] for row in groups]).values_list('pk', 'name'))
+    results = [
+        with_margin({
+            "key": row[key] or None,
+            "name": names.get(row[key]),
+            **{field: row[f'{field}_total'] for field in VALUE_FIELDS},
+        })
+        for row in groups
+    ]
+    results.sort(key=lambda row: row['cost_value'], reverse=True)
+    report["results"] = results
+    return report
+
+
+def with_margin(values):
+    values['cost_value'] = Decimal(values['cost_value']).quantize(CENTS)
+    values['retail_value'] = Decimal(values['retail_value']).quantize(CENTS)
+    values['potential_margin'] = values['retail_value'] - values['cost_value']
+    return values
+
+
+def recount_valuation(chunk_size=5000):
+    """
+    The valuation recomputed from the products, one grouped query per
+    `chunk_size` products. Returns {(category_key, supplier_key): [products,
+    units, cost value, retail value]}.
+    """
+    money_field = DecimalField(max_digits=20, decimal_places=2)
+    buckets = {}
+    last_id = 0
+    while True:
+        products = Product.objects.filter(id__gt=last_id)
+        boundary = next(iter(products.order_by('id').values_list('id', flat=True)[chunk_size - 1:chunk_size]), None)
+        if boundary is not None:
+            products = products.filter(id__lte=boundary)
+        rows = products.values('category', 'supplier').annotate(
+            product_count=Count('id'),
+            units=Sum('stock'),
+            cost=Sum(F('stock') * F('buying_price'), output_field=money_field),
+            retail=Sum(F('stock') * F('selling_price'), output_field=money_field),
+        ).order_by()
+        for row in rows:
+            add_change(buckets, (
+                (row['category'] or 0, row['supplier'] or 0),
+                (row['product_count'], row['units'] or 0, money(row['cost']), money(row['retail'])),
+            ))
+        if boundary is None:
+            return buckets
+        last_id = boundary
+
+
+def reconcile_valuation(chunk_size=5000, dry_run=False):
+    """
+    Recount the valuation from the products and correct the buckets that
+    drifted (rows bulk-inserted without signals, edits of deferred rows).
+    Returns the drifted buckets as [(key, stored, counted)].
+
+    The buckets are locked before the products are read, so stock writes
+    wait for the recount instead of being overwritten by it.
+    """
+    with transaction.atomic():
+        rows = InventoryValuation.objects.all()
+        stored = list(rows if dry_run else rows.select_for_update())
+        counted = recount_valuation(chunk_size)
+        before = {(row.category_key, row.supplier_key): [getattr(row, field) for field in VALUE_FIELDS] for row in stored}
+        empty = [0, 0, Decimal(0), Decimal(0)]
+        drift = [
+            (key, before.get(key, empty), counted.get(key, empty))
+            for key in sorted(set(before) | set(counted))
+            if [Decimal(value) for value in before.get(key, empty)] != [Decimal(value) for value in counted.get(key, empty)]
+        ]
+        if drift and not dry_run:
+            sync_rows(
+                InventoryValuation, stored,
+                [InventoryValuation(category_key=key[0], supplier_key=key[1], **dict(zip(VALUE_FIELDS, values))) for key, values in counted.items()],
+                ('category_key', 'supplier_key'), VALUE_FIELDS,
+            )
+    return drift
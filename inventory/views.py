@@ -2,21 +2,24 @@ from rest_framework.views import APIView
 from rest_framework import generics
 from django.db.models import Sum, Count
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 from rest_framework import status, permissions
 from rest_framework.permissions import BasePermission
 from rest_framework.parsers import MultiPartParser
 from django.shortcuts import get_object_or_404
 from django.db.models import F, Sum, ExpressionWrapper, DecimalField
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
+from decimal import Decimal
 import calendar
+import json
+import os
 import openpyxl
 from .models import (
     Product, Supplier, Order, OrderItem, Category, 
     CustomerInfo, CompanyInfo, OrderLog, Report, ExpenseTypes, 
-    OtherExpenses, OrderPaymentLog, ProductLog 
+    OtherExpenses, OrderPaymentLog, ProductLog, StockMovement, Job
 
 )
 from .serializers import (
@@ -36,20 +39,34 @@ from .serializers import (
     OtherExpensesSerializer,
     OtherExpensesGetSerializer,
     OrderPaymentLogSerializer,
-    ProductLogSerializer
+    ProductLogSerializer,
+    StockMovementSerializer,
+    JobSerializer,
+    ProductSyncSerializer
 )
-from rest_framework.pagination import PageNumberPagination
+from .pagination import Pagination, ListPagination, list_paginator, wants_cursor
+from .search import search_products
 from rest_framework import filters
-from django.db.models import Q
+from django.db.models import Q, Case, When
 from django.core.exceptions import ValidationError
 from .utils import create_order_log
-
-# ------------------ Pagination ------------------
-class Pagination(PageNumberPagination):
-    page_size = 10  # default items per page
-    page_size_query_param = 'page_size'  # allow client to override
-    max_page_size = 100
-
+from .idempotency import idempotent
+from .audit import audit
+from .rollups import sales_series, BUCKETS, GROUP_BY
+from .profit import profit_report, BREAKDOWNS
+from .dashboard import build_dashboard, SECTIONS as DASHBOARD_SECTIONS
+from .result_cache import cached_result, stats as result_cache_stats
+from .etags import list_etag, not_modified, revalidate
+from .valuation import inventory_valuation, BREAKDOWNS as VALUATION_BREAKDOWNS
+from .leaderboard import leaderboard, RANKINGS
+from .importer import import_products
+from .jobs import TASKS, can_submit, clean_params, result_dir, save_upload, visible_jobs
+from .sync import read_changes, ExpiredToken, LIMIT as SYNC_LIMIT, MAX_LIMIT as SYNC_MAX_LIMIT
+from user.models import UserAccount
+from .exports import (
+    filter_reports, iter_rows, csv_lines, csv_file, xlsx_file, file_download, product_columns,
+    REPORT_COLUMNS, PRODUCT_FILE_TYPES,
+)
 
 
 class ProductListCreateAPIView(APIView):
@@ -68,35 +85,42 @@ class ProductListCreateAPIView(APIView):
             include_all = request.query_params.get('include_all', '').lower() in ('1', 'true', 'yes')
 
             products = Product.objects.all()
-            
-            # Apply search
-            if search_query:
-                products = products.filter(
-                    Q(name__icontains=search_query)
-                )
 
             # Ensure consistent ordering for pagination
             products = products.order_by('-id')  # or '-id'
 
+            # Apply search: ranked matches from the search index, best first (cursor pages keep -id)
+            if search_query:
+                ranked = search_products(search_query)
+                products = products.filter(id__in=ranked)
+                if ranked and not wants_cursor(request):
+                    products = products.order_by(Case(*[When(id=pk, then=rank) for rank, pk in enumerate(ranked)]), '-id')
+
+            # Answer 304 before counting and serializing when the client's copy is current
+            etag = list_etag(request, products, Category.objects.all(), Supplier.objects.all())
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
+
             # Paginate
-            paginator = Pagination()
+            paginator = list_paginator(request)
             page = paginator.paginate_queryset(products, request)
             if page is not None:
                 page_data = ProductGetSerializer(page, many=True).data
-                if include_all:
+                if include_all and isinstance(paginator, Pagination):
                     all_data = ProductGetSerializer(products, many=True).data
-                    return Response({
+                    return revalidate(Response({
                         'count': paginator.page.paginator.count,
                         'next': paginator.get_next_link(),
                         'previous': paginator.get_previous_link(),
                         'results': page_data,
                         'all_results': all_data,
-                    })
-                return paginator.get_paginated_response(page_data)
+                    }), etag)
+                return revalidate(paginator.get_paginated_response(page_data), etag)
 
             # Fallback - no pagination applied
             serializer = ProductGetSerializer(products, many=True)
-            return Response(serializer.data)
+            return revalidate(Response(serializer.data), etag)
               
         except KeyError as e:
             return Response(
@@ -255,8 +279,12 @@ class SupplierListCreateAPIView(APIView):
                 )
             # print(user.role)
             supplier = Supplier.objects.all()
+            etag = list_etag(request, supplier)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
             serializer = SupplierSerializer(supplier, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)                            
+            return revalidate(Response(serializer.data, status=status.HTTP_200_OK), etag)                            
         except KeyError as e:
             return Response(
                 {"error": f"An error occurred while Retriving the Supplier.  {str(e)}"},
@@ -419,25 +447,31 @@ class CustomerListCreateAPIView(APIView):
             # Ensure consistent ordering for pagination
             customers = customers.order_by('-id')  # or '-id'
 
+            # Answer 304 before counting and serializing when the client's copy is current
+            etag = list_etag(request, customers)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
+
             # Paginate
-            paginator = Pagination()
+            paginator = list_paginator(request)
             page = paginator.paginate_queryset(customers, request)
             if page is not None:
                 page_data = CustomerInfoSerializer(page, many=True).data
-                if include_all:
+                if include_all and isinstance(paginator, Pagination):
                     all_data = CustomerInfoSerializer(customers, many=True).data
-                    return Response({
+                    return revalidate(Response({
                         'count': paginator.page.paginator.count,
                         'next': paginator.get_next_link(),
                         'previous': paginator.get_previous_link(),
                         'results': page_data,
                         'all_results': all_data,
-                    })
-                return paginator.get_paginated_response(page_data)
+                    }), etag)
+                return revalidate(paginator.get_paginated_response(page_data), etag)
 
             # Fallback - no pagination applied
             serializer = CustomerInfoSerializer(customers, many=True)
-            return Response(serializer.data)
+            return revalidate(Response(serializer.data), etag)
                   
         except KeyError as e:
             return Response(
@@ -465,6 +499,61 @@ class CustomerListCreateAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
+
+class ChangesAPIView(APIView):
+    """
+    Delta sync of the catalog for POS terminals, instead of include_all
+    dumps: the categories, suppliers, customers and products created or
+    updated since the `since` token, and the ids of the ones deleted. Send
+    the returned token next time; while `more` is true, ask again at once.
+    Without `since` it returns everything, `limit` rows per kind at a time.
+    """
+
+    SERIALIZERS = {
+        'categories': CategorySerializer,
+        'suppliers': SupplierSerializer,
+        'customers': CustomerInfoSerializer,
+        'products': ProductSyncSerializer,
+    }
+
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Salesman' or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to sync the catalog."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            try:
+                limit = int(request.query_params.get('limit', SYNC_LIMIT))
+            except ValueError:
+                limit = 0
+            if not 1 <= limit <= SYNC_MAX_LIMIT:
+                return Response({"error": f"limit must be between 1 and {SYNC_MAX_LIMIT}."}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                result = read_changes(request.query_params.get('since') or None, limit)
+            except ExpiredToken:
+                return Response(
+                    {"error": "This sync token is too old, sync again without since."},
+                    status=status.HTTP_410_GONE
+                )
+            except ValueError:
+                return Response({"error": "Invalid sync token."}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                "token": result["token"],
+                "more": result["more"],
+                **{stream: serializer(result["changes"][stream], many=True).data for stream, serializer in self.SERIALIZERS.items()},
+                "deleted": result["deleted"],
+            }, status=status.HTTP_200_OK)
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while syncing the catalog. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class CustomerRetrieveUpdateDeleteAPIView(APIView):
     # permission_classes = (permissions.AllowAny,)
     def get(self, request, pk):
@@ -730,7 +819,9 @@ class OrderListCreatView(generics.ListCreateAPIView):
     queryset = Order.objects.filter(credit=False).order_by('-id')
     permission_classes = [OrderPermission]
     serializer_class = OrderSerializer
-    pagination_class = Pagination
+    pagination_class = ListPagination
+    # ?pagination=cursor walks the orders by id or by date, see KeysetPagination
+    cursor_orderings = {'-id': ('-id',), '-order_date': ('-order_date', '-id'), 'order_date': ('order_date', 'id')}
     filter_backends = [filters.SearchFilter]
     search_fields = ['=customer__name', '=payment_status']  # 🔍 allow searching by customer's name and payment status
 
@@ -748,6 +839,7 @@ class OrderListCreatView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
         id = response.data.get('receipt_id')
@@ -772,10 +864,30 @@ class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
         }, status=status.HTTP_200_OK)
 
     def update(self, request, *args, **kwargs):
-        response = super().update(request, *args, **kwargs)
+        if request.query_params.get('dry_run') in ('1', 'true'):
+            return self.dry_run(request, *args, **kwargs)
+        return self.save_update(request, *args, **kwargs)
+
+    def dry_run(self, request, *args, **kwargs):
+        # Show the item changes, stock moves and new totals without saving
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            "message": "Order update plan.",
+            "data": serializer.plan_update()
+        }, status=status.HTTP_200_OK)
+
+    @idempotent
+    def save_update(self, request, *args, **kwargs):
+        # Same as UpdateModelMixin.update, minus clearing the items the serializer prefetched
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
         return Response({
             "message": "Order updated successfully.",
-            "data": response.data
+            "data": serializer.data
         }, status=status.HTTP_200_OK)
     
     def destroy(self, request, *args, **kwargs):
@@ -797,6 +909,7 @@ class OrderItemDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
 
+    @idempotent
     def update(self, request, *args, **kwargs):
         response = super().update(request, *args, **kwargs)
         return Response({
@@ -845,8 +958,12 @@ class CategoryListCreateAPIView(APIView):
                 )
             # category = Category.objects.all()
             category = Category.objects.all().order_by('id')
+            etag = list_etag(request, category)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
             serializer = CategorySerializer(category, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK) 
+            return revalidate(Response(serializer.data, status=status.HTTP_200_OK), etag)
        
         except KeyError as e:
             return Response(
@@ -993,7 +1110,9 @@ class RetriveRevenueAPIView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 ) 
      
-            revenue = Order.objects.filter(status="Done", payment_status='Paid').aggregate(total_revenue=Sum('total_amount'))        
+            revenue = cached_result(request, 'revenue', {}, ('orders',), lambda: (
+                Order.objects.filter(status="Done", payment_status='Paid').aggregate(total_revenue=Sum('total_amount'))
+            ))
             return Response(revenue, status=status.HTTP_200_OK)         
         except KeyError as e:
             return Response(
@@ -1049,34 +1168,45 @@ class RetriveProfitAPIView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Get all paid and done orders
-            paid_done_orders = Order.objects.filter(status="Done", payment_status='Paid')
-            
-            # Calculate revenue from these orders
-            revenue = paid_done_orders.aggregate(total_revenue=Sum('total_amount'))
-            print(revenue)
-            
-            # Get all order items from these orders
-            order_items = OrderItem.objects.filter(order__in=paid_done_orders)
+            # Revenue here includes VAT, as this endpoint always reported it
+            totals = cached_result(request, 'profit', {}, ('orders',), lambda: profit_report()['totals'])
+            profit = {'total_profit': float(totals['revenue'] + totals['vat'] - totals['cogs'])}
+            return Response(profit, status=status.HTTP_200_OK)        
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Profit. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-            # Calculate cost and profit from these order items
-            cost = order_items.aggregate(total_cost=Sum('cost'))
-            print(cost)
-            
-            # profit = order_items.aggregate(
-            #     total_profit=Sum(revenue['total_revenue'] - cost['total_cost'])
-            # )
-            # profit = profit or 0
-            # if profit['total_profit'] is None:
-            #     profit['total_profit'] = 0
-
-            if revenue['total_revenue'] is None or cost['total_cost'] is None:
-                profit = {'total_profit': 0.00}
-            else:
-                profit = {'total_profit': float(revenue['total_revenue']) - float(cost['total_cost'])}
 
-            print(profit)
-            return Response(profit, status=status.HTTP_200_OK)        
+class ProfitReportAPIView(APIView):
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Salesman' or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to retrive the Profit."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            by = request.query_params.get('by') or None
+            if by is not None and by not in BREAKDOWNS:
+                return Response({"error": f"by must be one of {', '.join(BREAKDOWNS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                start = date.fromisoformat(request.query_params['from']) if request.query_params.get('from') else None
+                end = date.fromisoformat(request.query_params['to']) if request.query_params.get('to') else None
+            except ValueError:
+                return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+
+            report = cached_result(request, 'profit-report', {"from": start, "to": end, "by": by}, ('orders', 'products'), lambda: profit_report(start, end, by))
+            # Money as strings, like the serializers, so nothing is lost to floats
+            as_text = lambda values: {key: str(value) if isinstance(value, Decimal) else value for key, value in values.items()}
+            return Response({
+                "from": str(start) if start else None,
+                "to": str(end) if end else None,
+                "by": by,
+                "totals": as_text(report['totals']),
+                "results": [as_text(row) for row in report['results']],
+            }, status=status.HTTP_200_OK)
         except KeyError as e:
             return Response(
                 {"error": f"An error occurred while Retriving the Profit. {str(e)}"},
@@ -1181,11 +1311,11 @@ class OrderLogAPIView(APIView):
             order_log = order_log.order_by('-id')  # or '-id'
 
             # Paginate
-            paginator = Pagination()
+            paginator = list_paginator(request)
             page = paginator.paginate_queryset(order_log, request)
             if page is not None:
                 page_data = OrderLogSerializer(page, many=True).data
-                if include_all:
+                if include_all and isinstance(paginator, Pagination):
                     all_data = OrderLogSerializer(order_log, many=True).data
                     return Response({
                         'count': paginator.page.paginator.count,
@@ -1215,7 +1345,10 @@ class ExcelReportAPIView(APIView):
                     {"error": "You are not authorized to retrive the Order Report."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            report = Report.objects.all()
+            try:
+                report = filter_reports(Report.objects.all(), request.query_params)
+            except ValueError:
+                return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
             serializer = OrderReportSerializer(report, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -1226,6 +1359,46 @@ class ExcelReportAPIView(APIView):
             )
 
 
+class ReportExportAPIView(APIView):
+    """
+    The Report table as a CSV or XLSX download (`type=csv|xlsx`), with the
+    same filters as report/. Rows are read in chunks and written as they
+    come, so memory does not grow with the number of rows.
+    """
+
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Salesman' or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to export the Order Report."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            file_type = request.query_params.get('type', 'xlsx')
+            if file_type not in ('csv', 'xlsx'):
+                return Response({"error": "type must be csv or xlsx."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                report = filter_reports(Report.objects.all(), request.query_params)
+            except ValueError:
+                return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+
+            rows = iter_rows(report, REPORT_COLUMNS)
+            filename = f"report_{request.query_params.get('from') or 'start'}_{request.query_params.get('to') or timezone.localdate()}.{file_type}"
+            if file_type == 'csv':
+                response = StreamingHttpResponse(csv_lines(REPORT_COLUMNS, rows), content_type='text/csv')
+                response['Content-Disposition'] = f'attachment; filename={filename}'
+                return response
+            return FileResponse(
+                xlsx_file(REPORT_COLUMNS, rows, 'Report'), as_attachment=True, filename=filename,
+                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            )
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while exporting the Order Report.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class ListOutOFStockProductAPIView(APIView):
     def get(self, request):
         try:
@@ -1275,8 +1448,12 @@ class ExpenseTypesListCreateAPIView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             expense_type = ExpenseTypes.objects.all().order_by('id')
+            etag = list_etag(request, expense_type)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
             serializer = ExpenseTypesSerializer(expense_type, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)              
+            return revalidate(Response(serializer.data, status=status.HTTP_200_OK), etag)              
                       
         except KeyError as e:
             return Response(
@@ -1571,7 +1748,9 @@ class RetriveTotalProductCostAPIView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 ) 
      
-            total_product_cost = Product.objects.aggregate(total_product_cost=Sum('buying_price'))        
+            total_product_cost = cached_result(request, 'product-cost', {}, ('products',), lambda: (
+                Product.objects.aggregate(total_product_cost=Sum('buying_price'))
+            ))
             return Response(total_product_cost, status=status.HTTP_200_OK)         
         except KeyError as e:
             return Response(
@@ -1579,6 +1758,33 @@ class RetriveTotalProductCostAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class InventoryValuationAPIView(APIView):
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to retrive the Inventory Valuation."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            by = request.query_params.get('by') or None
+            if by is not None and by not in VALUATION_BREAKDOWNS:
+                return Response({"error": f"by must be one of {', '.join(VALUATION_BREAKDOWNS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+            report = inventory_valuation(by)
+            # Money as strings, like profit-report/
+            as_text = lambda values: {key: str(value) if isinstance(value, Decimal) else value for key, value in values.items()}
+            return Response({
+                "by": by,
+                "totals": as_text(report['totals']),
+                "results": [as_text(row) for row in report['results']],
+            }, status=status.HTTP_200_OK)
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Inventory Valuation. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class ProductExcelReportAPIView(APIView):
     def get(self, request):
         try:
@@ -1666,6 +1872,36 @@ class RecentOrderLimitedAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class DashboardAPIView(APIView):
+    """
+    Every manager dashboard KPI in one request. `?sections=revenue,profit`
+    limits the response to those sections.
+    """
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Salesman'):
+                return Response(
+                    {"error": "You are not authorized to access the Dashboard."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            sections = DASHBOARD_SECTIONS
+            if request.query_params.get('sections'):
+                sections = [name.strip() for name in request.query_params['sections'].split(',') if name.strip()]
+                unknown = [name for name in sections if name not in DASHBOARD_SECTIONS]
+                if unknown:
+                    return Response(
+                        {"error": f"Unknown sections: {', '.join(unknown)}. Available: {', '.join(DASHBOARD_SECTIONS)}."},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            dashboard = cached_result(request, 'dashboard', {"sections": sorted(sections)}, ('orders', 'products'), lambda: build_dashboard(sections))
+            return Response(dashboard, status=status.HTTP_200_OK)
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while accessing the Dashboard.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 # ------------------------------------- Total Sales relative to Time --------------------------------------------------
 
 class DailySalesAPIView(APIView):
@@ -1677,9 +1913,9 @@ class DailySalesAPIView(APIView):
                     {"error": "You are not authorized to retrieve daily sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             orders = Order.objects.filter(order_date__date=today, status="Done", payment_status='Paid')
-            total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            total_sales = sales_series(today, today)[None][0][1]
             serializer = OrderSerializer(orders, many=True)
             return Response({
                 "date": str(today),
@@ -1701,20 +1937,13 @@ class WeeklySalesAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             sales_data = []
 
-            for i in range(6, -1, -1):  # Start from 6 days ago to today
-                day = today - timedelta(days=i)
-                orders = Order.objects.filter(
-                    order_date__date=day,
-                    status="Done", 
-                    payment_status='Paid'
-                )
-                total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            for day, sales, _ in sales_series(today - timedelta(days=6), today)[None]:
                 sales_data.append({
                     "period": day.strftime("%A"),  # Day name, e.g., "Monday"
-                    "sales": float(total_sales)
+                    "sales": float(sales)
                 })
 
             return Response(sales_data, status=status.HTTP_200_OK)
@@ -1733,21 +1962,14 @@ class MonthlySalesAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             year = today.year
             sales_data = []
 
-            for month in range(1, 13):
-                orders = Order.objects.filter(
-                    order_date__year=year,
-                    order_date__month=month,
-                    status="Done", 
-                    payment_status='Paid'
-                )
-                total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            for month, sales, _ in sales_series(date(year, 1, 1), date(year, 12, 31), 'month')[None]:
                 sales_data.append({
-                    "period": calendar.month_name[month],
-                    "sales": float(total_sales)
+                    "period": calendar.month_name[month.month],
+                    "sales": float(sales)
                 })
 
             return Response(sales_data, status=status.HTTP_200_OK)
@@ -1766,15 +1988,10 @@ class YearlySalesAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             year = today.year
 
-            orders = Order.objects.filter(
-                order_date__year=year,
-                status="Done", 
-                payment_status='Paid'
-            )
-            total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            _, total_sales, _ = sales_series(date(year, 1, 1), date(year, 12, 31), 'year')[None][0]
 
             data = [{
                 "period": str(year),
@@ -1799,9 +2016,9 @@ class DailySalesEachUserAPIView(APIView):
                     {"error": "You are not authorized to retrieve daily sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             orders = Order.objects.filter(order_date__date=today, user_email=user.email, status="Done", payment_status='Paid')
-            total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            total_sales = sales_series(today, today, user_email=user.email)[None][0][1]
             serializer = OrderSerializer(orders, many=True)
             return Response({
                 "date": str(today),
@@ -1823,21 +2040,13 @@ class WeeklySalesEachUserAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             sales_data = []
 
-            for i in range(6, -1, -1):  # Start from 6 days ago to today
-                day = today - timedelta(days=i)
-                orders = Order.objects.filter(
-                    order_date__date=day,
-                    user_email=user.email,
-                    status="Done", 
-                    payment_status='Paid'
-                )
-                total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            for day, sales, _ in sales_series(today - timedelta(days=6), today, user_email=user.email)[None]:
                 sales_data.append({
                     "period": day.strftime("%A"),  # Day name, e.g., "Monday"
-                    "sales": float(total_sales)
+                    "sales": float(sales)
                 })
 
             return Response(sales_data, status=status.HTTP_200_OK)
@@ -1856,22 +2065,14 @@ class MonthlySalesEachUserAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             year = today.year
             sales_data = []
 
-            for month in range(1, 13):
-                orders = Order.objects.filter(
-                    order_date__year=year,
-                    order_date__month=month,
-                    user_email=user.email,
-                    status="Done", 
-                    payment_status='Paid'
-                )
-                total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            for month, sales, _ in sales_series(date(year, 1, 1), date(year, 12, 31), 'month', user_email=user.email)[None]:
                 sales_data.append({
-                    "period": calendar.month_name[month],
-                    "sales": float(total_sales)
+                    "period": calendar.month_name[month.month],
+                    "sales": float(sales)
                 })
 
             return Response(sales_data, status=status.HTTP_200_OK)
@@ -1890,16 +2091,10 @@ class YearlySalesEachUserAPIView(APIView):
                     {"error": "You are not authorized to retrieve sales."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            today = timezone.now().date()
+            today = timezone.localdate()
             year = today.year
 
-            orders = Order.objects.filter(
-                order_date__year=year,
-                user_email=user.email,
-                status="Done", 
-                payment_status='Paid'
-            )
-            total_sales = orders.aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+            _, total_sales, _ = sales_series(date(year, 1, 1), date(year, 12, 31), 'year', user_email=user.email)[None][0]
 
             data = [{
                 "period": str(year),
@@ -1914,71 +2109,260 @@ class YearlySalesEachUserAPIView(APIView):
             )
 
 
+class SalesSeriesAPIView(APIView):
+    """
+    Sales per day, week, month or year between `from` and `to`, optionally
+    split by user, receipt or payment_status, from a single grouped query.
+    """
+    MAX_POINTS = 1000
+
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser or user.role == 'Salesman' or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to retrieve sales."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            bucket = request.query_params.get('bucket', 'day')
+            group_by = request.query_params.get('group_by') or None
+            if bucket not in BUCKETS:
+                return Response({"error": f"bucket must be one of {', '.join(BUCKETS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            if group_by is not None and group_by not in GROUP_BY:
+                return Response({"error": f"group_by must be one of {', '.join(GROUP_BY)}."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                end = date.fromisoformat(request.query_params['to']) if request.query_params.get('to') else timezone.localdate()
+                start = date.fromisoformat(request.query_params['from']) if request.query_params.get('from') else end - timedelta(days=29)
+            except ValueError:
+                return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+            if start > end:
+                return Response({"error": "from must not be after to."}, status=status.HTTP_400_BAD_REQUEST)
+            if bucket == 'day' and (end - start).days >= self.MAX_POINTS:
+                return Response({"error": f"At most {self.MAX_POINTS} days per request, use a larger bucket."}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Sales Managers only see their own sales, like the per-user endpoints
+            mine = user.role == 'Sales Manager' or request.query_params.get('mine') in ('1', 'true')
+            user_email = user.email if mine else None
+            params = {"from": start, "to": end, "bucket": bucket, "group_by": group_by, "user": user_email}
+            series = cached_result(request, 'sales-series', params, ('orders',), lambda: sales_series(start, end, bucket, group_by, user_email=user_email))
+
+            return Response({
+                "bucket": bucket,
+                "from": str(start),
+                "to": str(end),
+                "group_by": group_by,
+                "series": [
+                    {
+                        "group": group,
+                        "points": [
+                            {"period": str(period), "sales": float(sales), "orders": orders}
+                            for period, sales, orders in points
+                        ],
+                    }
+                    for group, points in sorted(series.items(), key=lambda item: str(item[0]))
+                ],
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred while retrieving the sales series. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class LeaderboardAPIView(APIView):
+    """Salespeople ranked by revenue, orders, average basket or cancellation rate over a period, paginated."""
+
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True):
+                return Response(
+                    {"error": "You are not authorized to retrieve the leaderboard."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            rank_by = request.query_params.get('rank_by', 'revenue')
+            if rank_by not in RANKINGS:
+                return Response({"error": f"rank_by must be one of {', '.join(RANKINGS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                end = date.fromisoformat(request.query_params['to']) if request.query_params.get('to') else timezone.localdate()
+                start = date.fromisoformat(request.query_params['from']) if request.query_params.get('from') else end - timedelta(days=29)
+            except ValueError:
+                return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+            if start > end:
+                return Response({"error": "from must not be after to."}, status=status.HTTP_400_BAD_REQUEST)
+
+            paginator = Pagination()
+            page = paginator.paginate_queryset(leaderboard(start, end, rank_by), request)
+            names = dict(UserAccount.objects.filter(email__in=[row['user_email'] for row in page]).values_list('email', 'name'))
+            response = paginator.get_paginated_response([
+                {
+                    "rank": row['rank'],
+                    "user_email": row['user_email'],
+                    "name": names.get(row['user_email']),
+                    "revenue": str(Decimal(row['revenue_total']).quantize(Decimal('0.01'))),
+                    "orders": row['completed_orders'],
+                    "average_basket": str(Decimal(row['average_basket']).quantize(Decimal('0.01'))),
+                    "cancelled_orders": row['cancelled_orders'],
+                    "cancellation_rate": round(row['cancellation_rate'], 4),
+                }
+                for row in page
+            ])
+            response.data.update({"from": str(start), "to": str(end), "rank_by": rank_by})
+            return response
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while retrieving the leaderboard. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class ExportProductExcelAPIView(APIView):
+    """
+    The products as XLSX (default), CSV or gzip compressed CSV
+    (`type=xlsx|csv|csv.gz`), read in chunks and written through a temporary
+    file so memory stays flat. `names=1` adds the category and supplier names
+    through one join. The CSV files can be resumed with Range requests.
+    """
+    TYPES = PRODUCT_FILE_TYPES
+
     def get(self, request, *args, **kwargs):
-        # Create workbook and sheet
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Products"
-
-        # Fetch data
-        products = Product.objects.all().values(
-            'id', 'name', 'description', 'package', 'piece', 'buying_price',
-            'selling_price', 'unit', 'stock', 'receipt_no', 'user'
-        )
-        if not products:
+        file_type = request.query_params.get('type', 'xlsx')
+        if file_type not in self.TYPES:
+            return Response({"error": f"type must be one of {', '.join(self.TYPES)}."}, status=status.HTTP_400_BAD_REQUEST)
+        products = Product.objects.all()
+        if not products.exists():
             return Response({"error": "No product data available"}, status=204)
 
-        # Write headers
-        headers = list(products[0].keys())
-        ws.append(headers)
-
-        # Write data rows
-        for product in products:
-            ws.append(list(product.values()))
+        columns, fields = product_columns(request.query_params.get('names') in ('1', 'true'))
 
-        # Prepare HTTP response
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response['Content-Disposition'] = 'attachment; filename=products.xlsx'
-        wb.save(response)
-        return response
+        content_type, filename = self.TYPES[file_type]
+        if file_type == 'xlsx':
+            # openpyxl stamps the time into the file, so it can't be resumed
+            return file_download(request, xlsx_file(columns, iter_rows(products, fields), 'Products'), filename, content_type)
+        # Taken before the rows are read: a write during the export changes the next ETag
+        etag = list_etag(request, products, Category.objects.all(), Supplier.objects.all())
+        output = csv_file(columns, iter_rows(products, fields), compress=file_type == 'csv.gz')
+        return file_download(request, output, filename, content_type, etag=etag)
 
 class ImportProductExcelAPIView(APIView):
+    """
+    Create or update products from an .xlsx, read in read-only mode and
+    written in chunks. Returns how many rows were created, updated or
+    unchanged and the errors of the rows that were skipped. With dry_run
+    the file is only checked.
+    """
     parser_classes = [MultiPartParser]
 
     def post(self, request, *args, **kwargs):
         excel_file = request.FILES.get('file')
         if not excel_file:
             return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run') or request.query_params.get('dry_run', '')).lower() in ('1', 'true', 'yes')
 
         try:
-            wb = openpyxl.load_workbook(excel_file)
-            ws = wb.active
-            rows = list(ws.iter_rows(values_only=True))
-            headers = [str(cell).strip() for cell in rows[0]]
-            for row in rows[1:]:
-                data = dict(zip(headers, row))
-                # Adjust field names as needed for your Product model
-                Product.objects.update_or_create(
-                    id=data.get('id'),
-                    defaults={
-                        'name': data.get('name'),
-                        'description': data.get('description'),
-                        'package': data.get('package'),
-                        'piece': data.get('piece'),
-                        'buying_price': data.get('buying_price'),
-                        'selling_price': data.get('selling_price'),
-                        'unit': data.get('unit'),
-                        'stock': data.get('stock'),
-                        'receipt_no': data.get('receipt_no'),
-                        'user': data.get('user'),  # Use FK id or handle lookup
-                    }
-                )
-            return Response({"message": "Products imported successfully."}, status=status.HTTP_201_CREATED)
+            wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
         except Exception as e:
             return Response({"error": f"Failed to import products: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return Response({"error": "The sheet is empty."}, status=status.HTTP_400_BAD_REQUEST)
+            report = import_products(header, rows, dry_run=dry_run, user=request.user.name)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            wb.close()
+
+        if dry_run:
+            return Response({"message": "Products checked, nothing was imported.", "dry_run": True, **report}, status=status.HTTP_200_OK)
+        return Response({"message": "Products imported successfully.", "dry_run": False, **report}, status=status.HTTP_201_CREATED)
+
+
+class JobListCreateAPIView(APIView):
+    """
+    Background jobs run by `manage.py run_workers`. POST {kind, params}
+    queues one (multipart with a `file` for import_products) and answers
+    202 with the job to poll. GET lists the user's jobs, every job for a
+    manager, newest first.
+    """
+
+    def get(self, request):
+        try:
+            jobs = visible_jobs(request.user)
+            for param in ('state', 'kind'):
+                if request.query_params.get(param):
+                    jobs = jobs.filter(**{param: request.query_params[param]})
+            paginator = Pagination()
+            page = paginator.paginate_queryset(jobs, request)
+            return paginator.get_paginated_response(JobSerializer(page, many=True).data)
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while retrieving the jobs. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def post(self, request):
+        try:
+            kind = request.data.get('kind')
+            if kind not in TASKS:
+                return Response({"error": f"kind must be one of {', '.join(TASKS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            if not can_submit(request.user, kind):
+                return Response(
+                    {"error": f"You are not authorized to run {kind} jobs."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            params = request.data.get('params') or {}
+            try:
+                if isinstance(params, str):
+                    params = json.loads(params)  # Multipart requests send it as a string
+                if not isinstance(params, dict):
+                    raise ValueError("params must be an object.")
+                params = clean_params(kind, params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if kind == 'import_products':
+                excel_file = request.FILES.get('file')
+                if not excel_file:
+                    return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+                params['upload'] = save_upload(excel_file)
+
+            job = Job.objects.create(kind=kind, params=params, user=request.user)
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while queuing the job. {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class JobDetailAPIView(APIView):
+    """The state, progress and result of a job. DELETE cancels it while it is still queued."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(visible_jobs(request.user), pk=pk)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        job = get_object_or_404(visible_jobs(request.user), pk=pk)
+        if not Job.objects.filter(pk=job.pk, state='Queued').update(state='Cancelled', finished_at=timezone.now()):
+            return Response({"error": "Only a queued job can be cancelled."}, status=status.HTTP_409_CONFLICT)
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class JobDownloadAPIView(APIView):
+    """The file a finished job wrote. It never changes, so Range requests can resume the download."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(visible_jobs(request.user), pk=pk)
+        if job.state != 'Done' or not job.result_path:
+            return Response({"error": "This job has no file to download."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            output = open(os.path.join(result_dir(), job.result_path), 'rb')
+        except FileNotFoundError:
+            return Response({"error": "The file of this job was deleted."}, status=status.HTTP_410_GONE)
+        return file_download(request, output, job.result_name, job.content_type, etag=f'"job-{job.pk}"')
 
 
 class OrderLogListView(generics.ListAPIView):
@@ -2007,4 +2391,86 @@ class ProductLogAPIView(APIView):
                 {"error": f"An error occurred while Retriving the Product Log.  {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-    
\ No newline at end of file
+    
+
+class AuditStatsAPIView(APIView):
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True):
+                return Response(
+                    {"error": "You are not authorized to retrive the Audit Writer Stats."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            # Counters of this worker process only
+            return Response(audit.get_stats(), status=status.HTTP_200_OK)
+
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Audit Writer Stats.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ResultCacheStatsAPIView(APIView):
+    def get(self, request):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True):
+                return Response(
+                    {"error": "You are not authorized to retrive the Cache Stats."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            # Counters of this worker process only
+            return Response(result_cache_stats.as_dict(), status=status.HTTP_200_OK)
+
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Cache Stats.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ProductStockMovementAPIView(APIView):
+    def get(self, request, pk):
+        try:
+            user = request.user
+            if not (user.role == 'Manager' or user.is_superuser == True or user.role == 'Salesman' or user.role == 'Sales Manager'):
+                return Response(
+                    {"error": "You are not authorized to retrive the Stock Movements."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            if not Product.objects.filter(id=pk).exists():
+                return Response(
+                    {"error": "Product Does not Exist."},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            try:
+                limit = min(int(request.query_params.get('limit', 50)), 200)
+                before = request.query_params.get('before')
+                before = int(before) if before else None
+            except ValueError:
+                return Response(
+                    {"error": "limit and before must be numbers."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if limit < 1:
+                limit = 50
+
+            # Keyset pagination on the (product, id) index, newest first
+            movements = StockMovement.objects.filter(product_id=pk)
+            if before is not None:
+                movements = movements.filter(id__lt=before)
+            movements = list(movements.order_by('-id')[:limit])
+
+            serializer = StockMovementSerializer(movements, many=True)
+            return Response({
+                "results": serializer.data,
+                "next_cursor": movements[-1].id if len(movements) == limit else None,
+            }, status=status.HTTP_200_OK)
+
+        except KeyError as e:
+            return Response(
+                {"error": f"An error occurred while Retriving the Stock Movements.  {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
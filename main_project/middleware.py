@@ -1,12 +1,151 @@
 # myproject/middleware.py  (replace 'myproject' with your project folder name)
 
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
 class NoCacheMiddleware:
+    """
+    Default caching policy: responses are never stored, unless the view set
+    its own Cache-Control header (the list endpoints that answer
+    If-None-Match with 304 Not Modified do).
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
         response = self.get_response(request)
+        if response.has_header("Cache-Control"):
+            return response
         response["Cache-Control"] = "no-cache, no-store, must-revalidate"
         response["Pragma"] = "no-cache"
         response["Expires"] = "0"
         return response
+
+
+logger = logging.getLogger('main_project.sql')
+
+# Stats of the request being handled in this thread / task, None when it isn't sampled
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+        self.slowest_duration = 0.0
+        self.slowest_sql = ''
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+        if duration > self.slowest_duration:
+            self.slowest_duration = duration
+            self.slowest_sql = sql
+
+    @property
+    def duplicates(self):
+        # Statements with the same SQL text (parameters aside) run more than once
+        return sum(times - 1 for times in self.statements.values() if times > 1)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - started)
+
+
+def install_query_wrapper(sender=None, connection=None, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryStatsMiddleware:
+    """
+    Count the SQL statements of a request and report them.
+
+    Adds `X-DB-Queries` and `Server-Timing` headers and logs one JSON line to
+    the `main_project.sql` logger with the query count, total DB time,
+    duplicate statements and the slowest statement. Configure it with
+    SQL_STATS_ENABLED and SQL_STATS_SAMPLE_RATE; when disabled the middleware
+    removes itself and no query wrapper is installed.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_STATS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'SQL_STATS_SAMPLE_RATE', 1.0)
+        connection_created.connect(install_query_wrapper, dispatch_uid='main_project.sql_stats')
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection=connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.report(request, response, stats, started)
+
+    async def __acall__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.report(request, response, stats, started)
+
+    def report(self, request, response, stats, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = stats.duration * 1000
+        slowest_ms = stats.slowest_duration * 1000
+        response["X-DB-Queries"] = str(stats.count)
+        response["Server-Timing"] = (
+            f'db;dur={db_ms:.1f};desc="{stats.count} queries, {stats.duplicates} duplicates", '
+            f'db-slowest;dur={slowest_ms:.1f}, app;dur={total_ms:.1f}'
+        )
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(total_ms, 1),
+            "queries": stats.count,
+            "db_ms": round(db_ms, 1),
+            "duplicates": stats.duplicates,
+            "slowest_ms": round(slowest_ms, 1),
+            "slowest_sql": stats.slowest_sql[:500],
+        }))
+        return response
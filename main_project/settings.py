@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 from datetime import timedelta
+from corsheaders.defaults import default_headers
 from rest_framework import response
 # import django_heroku
 from dotenv import load_dotenv
@@ -56,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so it sees every query of the request
+    'main_project.middleware.QueryStatsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,6 +85,7 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True 
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 ROOT_URLCONF = 'main_project.urls'
 
@@ -118,6 +122,8 @@ DATABASES = {
         'OPTIONS': {
             'charset': 'utf8mb4',
             'init_command': "SET NAMES 'utf8mb4'",
+            # Django's default, pinned: a writer that waited on a row lock must then read what the other committed
+            'isolation_level': 'read committed',
         },
     },
     'mardi': {
@@ -130,6 +136,7 @@ DATABASES = {
         'OPTIONS': {
             'charset': 'utf8mb4',
             'init_command': "SET NAMES 'utf8mb4'",
+            'isolation_level': 'read committed',
         },
     }
 }
@@ -227,3 +234,77 @@ SIMPLE_JWT = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'user.UserAccount'
+
+
+# Receipt numbering
+# Restart receipt numbers every fiscal year instead of counting up forever.
+RECEIPT_NUMBER_PER_FISCAL_YEAR = os.getenv("RECEIPT_NUMBER_PER_FISCAL_YEAR", "False") == "True"
+FISCAL_YEAR_START_MONTH = int(os.getenv("FISCAL_YEAR_START_MONTH", "1"))
+
+# Idempotency keys
+# How long (in seconds) a stored order response can be replayed for a retried request.
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+# How long (in seconds) a key reserved by a request without a response yet answers 409,
+# after that a retry takes over (the request died before it finished).
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))
+
+# Audit writer
+# OrderLog, Report, OrderPaymentLog and ProductLog rows are written in bulk after the
+# transaction commits. With AUDIT_ASYNC they are handed to a background thread instead.
+AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "False") == "True"
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+
+# SQL instrumentation
+# Adds X-DB-Queries / Server-Timing headers and a "main_project.sql" log line per request.
+# Disabled it costs nothing: the middleware removes itself at startup.
+SQL_STATS_ENABLED = os.getenv("SQL_STATS_ENABLED", "False") == "True"
+SQL_STATS_SAMPLE_RATE = float(os.getenv("SQL_STATS_SAMPLE_RATE", "1.0"))
+
+# Result cache
+# Analytics results (revenue, profit, sales series, dashboard, product cost) are cached
+# under a version that every committed write bumps. Needs no cache server: results
+# live in each worker's memory, or in RESULT_CACHE_DIR to share them between workers.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "True") == "True"
+RESULT_CACHE_TIMEOUT = int(os.getenv("RESULT_CACHE_TIMEOUT", "300"))
+RESULT_CACHE_ALIAS = 'default'
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+# Totals of ?pagination=cursor lists asked with count=cached are kept this long
+PAGINATION_COUNT_TIMEOUT = int(os.getenv("PAGINATION_COUNT_TIMEOUT", "60"))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': RESULT_CACHE_DIR,
+    } if RESULT_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Background jobs
+# Exports, imports and nightly maintenance are queued in the database and run by
+# `manage.py run_workers` in a pool of JOB_WORKERS processes. No broker is needed.
+# A running job whose worker sends no heartbeat for JOB_STALE_AFTER seconds is failed.
+JOB_RESULT_DIR = os.getenv("JOB_RESULT_DIR", str(BASE_DIR / 'job_results'))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2.0"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "300"))
+JOB_RESULT_DAYS = int(os.getenv("JOB_RESULT_DAYS", "7"))  # Then the nightly purge_jobs deletes them
+
+# Delta sync
+# GET changes?since=<token> leaves out rows stamped in the last SYNC_LAG seconds, so a
+# write still in its transaction isn't skipped: keep it above the longest write.
+# Deletions are kept SYNC_TOMBSTONE_DAYS days; an older token has to sync from scratch.
+SYNC_LAG = int(os.getenv("SYNC_LAG", "30"))
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'main_project.sql': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}